@@ -0,0 +1,486 @@
+#!/usr/bin/env python
+
+# @Authors: Desh Raj
+# @Emails: r.desh26@gmail.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Grid search of the clustering hyperparameters of vbx/vbhmm.py (threshold,
+# init-smoothing, Fa, Fb, loopP) or spectral/sclust.py (min/max-neighbors), without
+# running the scripts once per point. The x-vectors are read and transformed once, the
+# intermediate results that do not depend on a parameter are reused across the points
+# that only differ in it, and DER is computed in-process (see scoring.py):
+# - VBx: the AHC tree of each recording is built once and cut at every threshold. VB is
+#   run for each distinct (AHC labels, init-smoothing, Fa, Fb, loopP) combination, so
+#   thresholds that give the same AHC clusters share the VB runs.
+# - Spectral: the affinity matrix of each recording is computed once (once per maximum
+#   number of neighbors for kNN graphs) and the NME sweep is run once per minimum
+#   number of neighbors, up to the largest maximum; each (min, max) range then only
+#   selects its best p, and the final clustering is run once per distinct selection.
+#   Recordings with more than --landmark-threshold x-vectors are clustered with
+#   landmark-based spectral clustering, as in sclust.py, once per range (without
+#   reusing the results across the ranges).
+# The VB runs (or the recordings, for spectral clustering) are distributed over a
+# process pool. The results are written as a tab-separated table (parameters, missed
+# speech, false alarm, confusion, DER and JER in percent) that local/plot_hparams.py can
+# plot.
+
+import argparse
+import itertools
+import sys
+from multiprocessing import Pool
+
+import numpy as np
+
+from diarizer.diarization_lib import (
+    PLDAScorer,
+    ahc_tree,
+    cos_similarity,
+    knn_graph,
+    read_xvector_timing_dict,
+)
+from diarizer.io_utils import group_by_recording, read_rttm
+from diarizer.model_bundle import load_model_bundle
+from diarizer.postprocessing import subsegments_to_segments
+from diarizer.scoring import rttm_segments, score_recordings, total_error_rates
+from diarizer.spectral.sclust import cluster_spectral, compute_overlap_vector
+from diarizer.spectral.Spectral_clustering import (
+    NME_SelectBest,
+    NME_SpectralClustering_fixed,
+    NME_Sweep,
+    get_kneighbors_ranking,
+)
+from diarizer.vbx.vbhmm import labels_to_segments, posterior_labels, vb_resegment
+
+VBX_PARAMS = ["threshold", "init_smoothing", "Fa", "Fb", "loopP"]
+SPECTRAL_PARAMS = ["min_neighbors", "max_neighbors"]
+
+# data shared with the pool workers (set before the pool is created, see _pool)
+_shared = {}
+
+
+def _init_worker(shared):
+    _shared.update(shared)
+
+
+def _pool(nj):
+    # the workers get a copy of the shared data when they start (inherited with the
+    # fork start method, pickled with spawn/forkserver)
+    return Pool(nj, initializer=_init_worker, initargs=(dict(_shared),))
+
+
+def load_xvectors(ark_files, segments_files):
+    """Returns a dict recording -> (x-vectors, start times, end times)."""
+    import kaldi_io
+
+    segs_dict = read_xvector_timing_dict(segments_files)
+    recordings = {}
+    for ark_file in ark_files:
+        arkit = kaldi_io.read_vec_flt_ark(ark_file)
+        # group xvectors in ark by recording name
+        for file_name, segs in itertools.groupby(
+            arkit, lambda e: e[0].rsplit("_", 1)[0]
+        ):
+            seg_names, xvecs = zip(*segs)
+            assert np.all(segs_dict[file_name][0] == np.array(seg_names))
+            start, end = segs_dict[file_name][1].T
+            recordings[file_name] = (np.array(xvecs), start, end)
+    return recordings
+
+
+def _vb_task(task):
+    file_name, labels, init_smoothing, Fa, Fb, loopP = task
+    q = vb_resegment(
+        _shared["x"][file_name],
+        _shared["model"],
+        labels,
+        _shared["lda_dim"],
+        Fa,
+        Fb,
+        loopP,
+        init_smoothing=init_smoothing,
+        dtype=_shared["dtype"],
+    )
+    return task, posterior_labels(q)
+
+
+def sweep_vbx(
+    xs,
+    model,
+    thresholds,
+    init_smoothings,
+    Fas,
+    Fbs,
+    loopPs,
+    lda_dim=128,
+    init="AHC+VB",
+    dtype=np.float64,
+    nj=1,
+):
+    """
+    Clusters the recordings for all the combinations of the parameters.
+    Input:
+        xs - dict recording -> transformed x-vectors
+    Output:
+        dict (threshold, init_smoothing, Fa, Fb, loopP) -> dict recording ->
+        (labels1st, labels2nd)
+    """
+    # AHC labels for each recording and threshold, from one tree per recording
+    ahc_labels = {}
+    for file_name, x in xs.items():
+        tree, thr = ahc_tree(x, dtype=dtype)
+        for threshold in thresholds:
+            ahc_labels[file_name, threshold] = tree.cut(thr + threshold)
+        del tree
+
+    points = list(itertools.product(thresholds, init_smoothings, Fas, Fbs, loopPs))
+    if init == "AHC":
+        return {
+            point: {name: (ahc_labels[name, point[0]], None) for name in xs}
+            for point in points
+        }
+
+    # distinct VB runs (the AHC labels of different thresholds are often the same)
+    tasks = {}
+    task_of = {}
+    for point in points:
+        threshold, *vb_params = point
+        for file_name in xs:
+            labels = ahc_labels[file_name, threshold]
+            key = (file_name, labels.tobytes(), *vb_params)
+            tasks.setdefault(key, (file_name, labels, *vb_params))
+            task_of[point, file_name] = key
+    # the longest recordings first, for a better load balance
+    order = sorted(tasks, key=lambda key: -len(xs[key[0]]))
+
+    _shared.update(x=xs, model=model, lda_dim=lda_dim, dtype=dtype)
+    vb_labels = {}
+    if nj > 1:
+        with _pool(nj) as pool:
+            for task, labels in pool.imap_unordered(
+                _vb_task, [tasks[key] for key in order]
+            ):
+                file_name, ahc, *vb_params = task
+                vb_labels[(file_name, ahc.tobytes(), *vb_params)] = labels
+    else:
+        for key in order:
+            vb_labels[key] = _vb_task(tasks[key])[1]
+    _shared.clear()
+    return {
+        point: {name: vb_labels[task_of[point, name]] for name in xs}
+        for point in points
+    }
+
+
+def _spectral_task(file_name):
+    x = _shared["x"][file_name]
+    scorer = _shared["scorer"]
+    affinity = _shared["affinity"]
+    overlaps = _shared["overlaps"].get(file_name)
+    if 0 < _shared["landmark_threshold"] < len(x):
+        # same landmark-based clustering as sclust.py, which has no shared sweep
+        return file_name, {
+            (rmin, rmax): cluster_spectral(
+                x,
+                scorer,
+                overlaps,
+                min_neighbors=rmin,
+                max_neighbors=rmax,
+                num_speakers=_shared["num_speakers"],
+                landmark_threshold=_shared["landmark_threshold"],
+                num_landmarks=_shared["num_landmarks"],
+            )
+            for rmin, rmax in _shared["ranges"]
+        }
+    # the dense affinity matrix is shared by all the ranges, while the kNN graph
+    # depends on the maximum number of neighbors
+    graphs = {}
+    for rmin, rmax in _shared["ranges"]:
+        graphs.setdefault(None if affinity == "dense" else rmax, []).append(
+            (rmin, rmax)
+        )
+    labels = {}
+    for k, ranges in graphs.items():
+        pmax = max(r[1] for r in ranges)
+        if scorer is not None:
+            A = scorer.score_dense(x) if k is None else scorer.score_knn(x, k)
+        else:
+            A = cos_similarity(x) if k is None else knn_graph(x, k)
+        ranking = get_kneighbors_ranking(A, pmax)
+        # the NME parameters of each p do not depend on the range, so a single sweep
+        # gives the results of all the ranges
+        results = NME_Sweep(A, min(r[0] for r in ranges), pmax, 10, ranking)
+        clusterings = {}
+        for rmin, rmax in ranges:
+            pbest, num_clusters = NME_SelectBest(
+                [res for res in results if rmin <= res[0] <= rmax],
+                _shared["num_speakers"],
+            )
+            if (pbest, num_clusters) not in clusterings:
+                clusterings[pbest, num_clusters] = NME_SpectralClustering_fixed(
+                    A, overlaps, num_clusters, pbest, ranking
+                )
+            labels[rmin, rmax] = clusterings[pbest, num_clusters]
+    return file_name, labels
+
+
+def sweep_spectral(
+    xs,
+    ranges,
+    scorer=None,
+    overlaps=None,
+    num_speakers=None,
+    affinity="dense",
+    landmark_threshold=5000,
+    num_landmarks=500,
+    nj=1,
+):
+    """
+    Clusters the recordings for all the (min_neighbors, max_neighbors) ranges.
+    Input:
+        xs       - dict recording -> transformed x-vectors
+        overlaps - dict recording -> overlap vector (see compute_overlap_vector)
+    Output:
+        dict (min_neighbors, max_neighbors) -> dict recording -> labels
+    """
+    _shared.update(
+        x=xs,
+        scorer=scorer,
+        ranges=ranges,
+        overlaps=overlaps or {},
+        num_speakers=num_speakers,
+        affinity=affinity,
+        landmark_threshold=landmark_threshold,
+        num_landmarks=num_landmarks,
+    )
+    order = sorted(xs, key=lambda name: -len(xs[name]))
+    if nj > 1:
+        with _pool(nj) as pool:
+            per_recording = dict(pool.imap_unordered(_spectral_task, order))
+    else:
+        per_recording = dict(map(_spectral_task, order))
+    _shared.clear()
+    return {
+        r: {name: per_recording[name][r] for name in xs} for r in ranges
+    }
+
+
+def write_table(f, param_names, results):
+    f.write("\t".join(param_names + ["miss", "fa", "conf", "error", "jer"]) + "\n")
+    for point, errors in results:
+        f.write(
+            "\t".join([str(p) for p in point] + [f"{e:.2f}" for e in errors]) + "\n"
+        )
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Tune the VBx or spectral clustering hyperparameters."
+    )
+    parser.add_argument(
+        "--method", type=str, default="vbx", choices=["vbx", "spectral"]
+    )
+    parser.add_argument(
+        "--xvec-ark-file",
+        type=str,
+        nargs="+",
+        required=True,
+        help="Kaldi ark file(s) with the x-vectors of the recordings.",
+    )
+    parser.add_argument(
+        "--segments-file",
+        type=str,
+        nargs="+",
+        required=True,
+        help="File(s) with x-vector timing info (see "
+        "diarization_lib.read_xvector_timing_dict)",
+    )
+    parser.add_argument(
+        "--ref-rttm", type=str, nargs="+", required=True, help="Reference RTTM file(s)."
+    )
+    parser.add_argument(
+        "--overlap-rttm",
+        type=str,
+        nargs="*",
+        default=None,
+        help="RTTM output(s) of an overlap detector, for overlap assignment.",
+    )
+    parser.add_argument(
+        "--xvec-transform",
+        type=str,
+        required=True,
+        help="path to x-vector transformation h5 file (or to a model bundle directory)",
+    )
+    parser.add_argument("--plda-file", type=str, default=None)
+    # VBx parameters
+    parser.add_argument("--init", type=str, default="AHC+VB", choices=["AHC", "AHC+VB"])
+    parser.add_argument("--threshold", type=float, nargs="+", default=[-0.015])
+    parser.add_argument("--init-smoothing", type=float, nargs="+", default=[7.0])
+    parser.add_argument("--Fa", type=float, nargs="+", default=[0.4])
+    parser.add_argument("--Fb", type=float, nargs="+", default=[64])
+    parser.add_argument("--loopP", type=float, nargs="+", default=[0.65])
+    parser.add_argument("--lda-dim", type=int, default=128)
+    parser.add_argument(
+        "--precision", type=str, default="float64", choices=["float32", "float64"]
+    )
+    # spectral clustering parameters
+    parser.add_argument("--min-neighbors", type=int, nargs="+", default=[3])
+    parser.add_argument("--max-neighbors", type=int, nargs="+", default=[20])
+    parser.add_argument("--num-speakers", type=int, default=None)
+    parser.add_argument(
+        "--affinity", type=str, default="dense", choices=["dense", "knn"]
+    )
+    parser.add_argument(
+        "--landmark-threshold",
+        type=int,
+        default=5000,
+        help="Recordings with more x-vectors than this are clustered with "
+        "landmark-based spectral clustering, as in sclust.py (0 to disable)",
+    )
+    parser.add_argument("--num-landmarks", type=int, default=500)
+    parser.add_argument(
+        "--max-pca-samples",
+        type=int,
+        default=None,
+        help="If provided, the PCA of the PLDA scoring is estimated on a random subset "
+        "of this many x-vectors for longer recordings.",
+    )
+    parser.add_argument(
+        "--collar",
+        type=float,
+        default=0.0,
+        help="No-score collar (in seconds) around reference segment boundaries.",
+    )
+    parser.add_argument(
+        "--nj", type=int, default=1, help="Number of processes of the pool."
+    )
+    parser.add_argument(
+        "--out-table",
+        type=str,
+        default=None,
+        help="Output table (tab-separated). By default, print to stdout.",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    dtype = np.dtype(args.precision)
+    model = load_model_bundle(args.xvec_transform, args.plda_file)
+    recordings = load_xvectors(args.xvec_ark_file, args.segments_file)
+    refs = {
+        name: segs
+        for name, segs in rttm_segments(args.ref_rttm).items()
+        if name in recordings
+    }
+    overlap_regions = {}
+    if args.overlap_rttm:
+        overlap_regions = {
+            name: (segs["start"], segs["end"])
+            for name, segs in group_by_recording(read_rttm(args.overlap_rttm)).items()
+        }
+
+    results = []
+    if args.method == "vbx":
+        xs = {
+            name: model.transform(x, dtype=dtype)
+            for name, (x, _, _) in recordings.items()
+        }
+        labels = sweep_vbx(
+            xs,
+            model,
+            args.threshold,
+            args.init_smoothing,
+            args.Fa,
+            args.Fb,
+            args.loopP,
+            lda_dim=args.lda_dim,
+            init=args.init,
+            dtype=dtype,
+            nj=args.nj,
+        )
+        param_names = VBX_PARAMS
+        for point, point_labels in labels.items():
+            hyps = {}
+            for name, (labels1st, labels2nd) in point_labels.items():
+                _, start, end = recordings[name]
+                starts, ends, out_labels = labels_to_segments(
+                    start,
+                    end,
+                    labels1st,
+                    labels2nd,
+                    overlap_regions.get(name, (np.zeros(0), np.zeros(0)))
+                    if args.overlap_rttm
+                    else None,
+                )
+                hyps[name] = (starts, ends, out_labels)
+            scores = score_recordings(refs, hyps, args.collar, nj=args.nj)
+            results.append((point, total_error_rates(scores)))
+    else:
+        xs = {name: model.transform(x) for name, (x, _, _) in recordings.items()}
+        overlaps = None
+        if args.overlap_rttm:
+            overlaps = {
+                name: compute_overlap_vector(
+                    overlap_regions.get(name, (np.zeros(0), np.zeros(0))),
+                    np.c_[start, end],
+                )
+                for name, (_, start, end) in recordings.items()
+            }
+        ranges = [
+            (pmin, pmax)
+            for pmin, pmax in itertools.product(args.min_neighbors, args.max_neighbors)
+            if pmin <= pmax
+        ]
+        scorer = None
+        if model.kaldi_plda is not None:
+            scorer = PLDAScorer(
+                model.kaldi_plda,
+                dtype=dtype.type,
+                max_pca_samples=args.max_pca_samples,
+            )
+        labels = sweep_spectral(
+            xs,
+            ranges,
+            scorer=scorer,
+            overlaps=overlaps,
+            num_speakers=args.num_speakers,
+            affinity=args.affinity,
+            landmark_threshold=args.landmark_threshold,
+            num_landmarks=args.num_landmarks,
+            nj=args.nj,
+        )
+        param_names = SPECTRAL_PARAMS
+        for point, point_labels in labels.items():
+            hyps = {
+                name: subsegments_to_segments(
+                    recordings[name][1], recordings[name][2], point_labels[name]
+                )
+                for name in point_labels
+            }
+            scores = score_recordings(refs, hyps, args.collar, nj=args.nj)
+            results.append((point, total_error_rates(scores)))
+
+    if args.out_table is None:
+        write_table(sys.stdout, param_names, results)
+    else:
+        with open(args.out_table, "w") as f:
+            write_table(f, param_names, results)
+
+    best_point, best_errors = min(results, key=lambda r: r[1][3])
+    print(
+        "Best: "
+        + " ".join(f"{name}={value}" for name, value in zip(param_names, best_point))
+        + f" DER={best_errors[3]:.2f}%",
+        file=sys.stderr,
+    )
@@ -4,11 +4,17 @@
 # Licensed under the Apache License, Version 2.0 (the "License")
 
 import os
+import fastcluster
 import numpy as np
 import scipy.linalg as spl
 import errno
+from scipy.cluster.hierarchy import fcluster
+from scipy.spatial.distance import squareform
 from scipy.special import softmax
 
+from diarizer.intervals import intersect
+from diarizer.io_utils import group_by_recording, read_rttm, read_segments
+
 
 def twoGMMcalib_lin(s, niters=20):
     """
@@ -52,6 +58,16 @@ def PLDA_scoring_in_LDA_space(Fe, Ft, diagAC):
     Output:
         out    - NxM matrix of log likelihood ratio scores
     """
+    Lambda, Gamma, k = _plda_scoring_params(diagAC)
+    return (
+        np.dot(Fe * Lambda, Ft.T)
+        + (Fe ** 2).dot(Gamma)[:, np.newaxis]
+        + (Ft ** 2).dot(Gamma)
+        + k
+    )
+
+
+def _plda_scoring_params(diagAC):
     # See (7-8) in L. Burget et al.: "Discriminatively trained probabilistic
     # linear discriminant analysis for speaker verification", in ICASSP 2011.
     iTC = 1.0 / (1 + diagAC)
@@ -61,19 +77,160 @@ def PLDA_scoring_in_LDA_space(Fe, Ft, diagAC):
     Gamma = -0.25 * (iWC2AC + 1 - 2 * iTC)
     Lambda = -0.5 * (iWC2AC - 1)
     k = -0.5 * (ldWC2AC - 2 * ldTC)
-    return (
-        np.dot(Fe * Lambda, Ft.T)
-        + (Fe ** 2).dot(Gamma)[:, np.newaxis]
-        + (Ft ** 2).dot(Gamma)
-        + k
-    )
+    return Lambda, Gamma, k
+
+
+class PLDAScorer:
+    """PLDA scoring of x-vectors with the PCA reduction of the standard kaldi
+    diarization recipe (see kaldi_ivector_plda_scoring_dense). All the factors that do
+    not depend on the recording (e.g. the inverse of the PLDA transform) are computed
+    once in the constructor, so that one scorer can be reused for all the recordings.
+    Input:
+        kaldi_plda      - PLDA model using the kaldi parametrization (mu, tr, psi)
+                          as loaded by 'read_plda' function.
+        target_energy   - PCA is estimated on the x-vectors of each recording. The
+                          x-vectors (and PLDA model) are projected into low-dimensional
+                          space preserving at least 'target_energy' variability in the
+                          x-vectors.
+        pca_dim         - This parameter overwrites 'target_energy' and directly
+                          specifies the PCA target dimensionality.
+        dtype           - floating point type of the scores (np.float32 halves the
+                          memory of the dense score matrix)
+        max_pca_samples - if given, the PCA covariance is estimated on a random subset
+                          of this many x-vectors for longer recordings (by default, on
+                          all the x-vectors)
+        max_full_dim    - for x-vectors of higher dimensionality, only the leading PCA
+                          components are computed (by Lanczos iterations)
+    """
+
+    def __init__(
+        self,
+        kaldi_plda,
+        target_energy=0.1,
+        pca_dim=None,
+        dtype=np.float64,
+        max_pca_samples=None,
+        max_full_dim=1024,
+    ):
+        self.plda_mu, plda_tr, self.plda_psi = kaldi_plda
+        self.plda_tr_inv = np.linalg.inv(plda_tr)
+        self.target_energy = target_energy
+        self.pca_dim = pca_dim
+        self.dtype = dtype
+        self.max_pca_samples = max_pca_samples
+        self.max_full_dim = max_full_dim
+
+    def _pca(self, x):
+        # returns the PCA basis (in columns) ordered by decreasing variance
+        if self.max_pca_samples is not None and len(x) > self.max_pca_samples:
+            rng = np.random.RandomState(0)
+            x = x[rng.choice(len(x), self.max_pca_samples, replace=False)]
+        cov = np.cov(x.T, bias=True)
+        D = len(cov)
+        pca_dim = self.pca_dim
+        if D <= self.max_full_dim:
+            energy, PCA = spl.eigh(cov)
+            energy, PCA = energy[::-1], PCA[:, ::-1]
+            total = energy.sum()
+        else:
+            from scipy.sparse.linalg import eigsh
+
+            # The leading eigenvalues are enough to find the dimensionality preserving
+            # 'target_energy' (the total energy is the trace), so compute more of them
+            # until the target is reached.
+            total = np.trace(cov)
+            k = pca_dim if pca_dim is not None else 16
+            while True:
+                k = min(k, D - 1)
+                energy, PCA = eigsh(cov, k=k, which="LA")
+                energy, PCA = energy[::-1], PCA[:, ::-1]
+                if pca_dim is not None or k == D - 1:
+                    break
+                # the 2 extra dimensions (see below) must be among the k computed
+                if energy[:-2].sum() / total > self.target_energy:
+                    break
+                k *= 2
+        if pca_dim is None:
+            energy = np.cumsum(energy)
+            pca_dim = np.sum(energy / total <= self.target_energy) + 2
+            # we need at least 2 dimensions, so 2 more dimensions are always added
+        return PCA[:, :pca_dim]
+
+    def project(self, x):
+        """Projects x-vectors (NxR) of one recording into the space, where the PLDA model
+        (reduced by PCA estimated on the x-vectors) has identity within-class and
+        diagonal across-class covariance (see kaldi_ivector_plda_projection).
+        Output:
+            x     - matrix of projected (and kaldi style length-normalized) x-vectors
+            acvar - diagonal of the across-class covariance matrix in this space
+        """
+        PCA = self._pca(x)
+        plda_tr_inv_pca = PCA.T.dot(self.plda_tr_inv)
+        W = plda_tr_inv_pca.dot(plda_tr_inv_pca.T)
+        B = (plda_tr_inv_pca * self.plda_psi).dot(plda_tr_inv_pca.T)
+        acvar, wccn = spl.eigh(B, W)
+        x = np.dot(x - self.plda_mu, PCA).dot(wccn)
+        x *= np.sqrt(x.shape[1] / np.dot(x ** 2, 1.0 / (acvar + 1.0)))[
+            :, np.newaxis
+        ]  # kaldi style length-norm
+        return x, acvar
+
+    def score_dense(self, x, block_size=4096):
+        """Returns NxN matrix of pairwise PLDA scores of x-vectors (NxR) of one
+        recording. The scores are computed in blocks of 'block_size' rows directly into
+        the output matrix of type self.dtype."""
+        x, acvar = self.project(x)
+        Lambda, Gamma, k = _plda_scoring_params(acvar)
+        x = x.astype(self.dtype)
+        xl = x * Lambda.astype(self.dtype)
+        g = (x ** 2).dot(Gamma.astype(self.dtype)) + self.dtype(k / 2)
+        scr_mx = np.empty((len(x), len(x)), dtype=self.dtype)
+        for i in range(0, len(x), block_size):
+            out = scr_mx[i : i + block_size]
+            np.dot(xl[i : i + block_size], x.T, out=out)
+            out += g[i : i + block_size, np.newaxis]
+            out += g
+        return scr_mx
+
+    def score_pairs(self, x, rows, cols):
+        """Returns PLDA scores of the pairs of x-vectors (x[rows[i]], x[cols[i]])."""
+        x, acvar = self.project(x)
+        return _pair_scores(x, rows, cols, "plda", acvar).astype(self.dtype)
+
+    def score_knn(self, x, k, index=None):
+        """Returns sparse graph of PLDA scores of the k nearest neighbours of each
+        x-vector (see knn_graph)."""
+        x, acvar = self.project(x)
+        graph = knn_graph(x, k, "plda", diagAC=acvar, index=index)
+        return graph.astype(self.dtype)
+
+
+def kaldi_ivector_plda_projection(kaldi_plda, x, target_energy=0.1, pca_dim=None):
+    """Projects x-vectors into the space, where the PLDA model (reduced by PCA estimated
+    on the x-vectors) has identity within-class and diagonal across-class covariance,
+    so that the PLDA scores can be computed by PLDA_scoring_in_LDA_space.
+    Input:
+        kaldi_plda    - PLDA model using the kaldi parametrization (mu, tr, psi)
+                        as loaded by 'read_plda' function.
+        x             - matrix of x-vectors (NxR)
+        target_energy - PCA is estimated on the input x-vectors. The x-vectors
+                        (and PLDA model) are projected into low-dimensional space
+                        preserving at least 'target_energy' variability in the x-vectors.
+        pca_dim       - This parameter overwrites 'target_energy' and directly
+                        specifies the PCA target dimensionality.
+    Output:
+        x             - matrix of projected (and kaldi style length-normalized) x-vectors
+        acvar         - diagonal of the across-class covariance matrix in this space
+    """
+    return PLDAScorer(kaldi_plda, target_energy, pca_dim).project(x)
 
 
 def kaldi_ivector_plda_scoring_dense(kaldi_plda, x, target_energy=0.1, pca_dim=None):
     """Given input array of N x-vectors and pretrained PLDA model, this function
     calculates NxN matrix of pairwise similarity scores for the following AHC
     clustering. This function produces exactly the same similarity scores as the
-    standard kaldi diarization recipe.
+    standard kaldi diarization recipe. Use PLDAScorer to score several recordings
+    with the same PLDA model.
     Input:
         kaldi_plda    - PLDA model using the kaldi parametrization (mu, tr, psi)
                         as loaded by 'read_plda' function.
@@ -87,25 +244,222 @@ def kaldi_ivector_plda_scoring_dense(kaldi_plda, x, target_energy=0.1, pca_dim=N
     Output:
         matrix of pairwise similarities between the input x-vectors
     """
-    plda_mu, plda_tr, plda_psi = kaldi_plda
-    energy, PCA = spl.eigh(np.cov(x.T, bias=True))
-    if pca_dim is None:
-        energy = np.cumsum(energy[::-1])
-        pca_dim = np.sum(energy / energy[-1] <= target_energy) + 2
-        # we need at least 2 dimensions, so 2 more dimensions are always added
-
-    PCA = PCA[:, : -pca_dim - 1 : -1]
-    print("pca_dim:", pca_dim)
-
-    plda_tr_inv_pca = PCA.T.dot(np.linalg.inv(plda_tr))
-    W = plda_tr_inv_pca.dot(plda_tr_inv_pca.T)
-    B = (plda_tr_inv_pca * plda_psi).dot(plda_tr_inv_pca.T)
-    acvar, wccn = spl.eigh(B, W)
-    x = np.dot(x - plda_mu, PCA).dot(wccn)
-    x *= np.sqrt(x.shape[1] / np.dot(x ** 2, 1.0 / (acvar + 1.0)))[
-        :, np.newaxis
-    ]  # kaldi style length-norm
-    return PLDA_scoring_in_LDA_space(x, x, acvar)
+    scorer = PLDAScorer(kaldi_plda, target_energy, pca_dim, dtype=np.float64)
+    return scorer.score_dense(x)
+
+
+def ahc_clustering(x, threshold, dtype=np.float64):
+    """Kaldi-like AHC of x-vectors using average linkage on the pairwise cosine
+    similarities. Clustering stops at a threshold, which is calibrated on the similarity
+    scores of the input x-vectors (see twoGMMcalib_lin) and shifted by 'threshold'.
+    Input:
+        x         - NxD matrix of (transformed and length-normalized) x-vectors
+        threshold - bias added to the calibrated threshold
+        dtype     - floating point type of the similarity matrix
+    Outputs:
+        labels    - N dimensional vector of zero based cluster ids
+        thr       - calibrated threshold (without the bias)
+    """
+    tree, thr = ahc_tree(x, dtype=dtype)
+    # output "labels" is an integer vector of speaker (cluster) ids
+    return tree.cut(thr + threshold), thr
+
+
+def ahc_tree(x, dtype=np.float64):
+    """Returns the AHCTree of the x-vectors and the calibrated threshold used by
+    ahc_clustering, so that the clustering for several biases is tree.cut(thr + bias)."""
+    if len(x) < 2:
+        return AHCTree(np.zeros((len(x), len(x)))), np.nan
+    # scr_mx is matrix of pairwise similarities between all x-vectors
+    scr_mx = cos_similarity(x, dtype=dtype)
+    # Figure out utterance specific threshold for AHC.
+    thr, _ = twoGMMcalib_lin(scr_mx.ravel())
+    return AHCTree(scr_mx), thr
+
+
+class AHCTree:
+    """Average linkage tree of a matrix of pairwise similarities. cut() returns the
+    clusters obtained when the clustering stops at a similarity, so the tree can be
+    cut at several thresholds without clustering again."""
+
+    def __init__(self, scr_mx):
+        self.num_items = len(scr_mx)
+        self.lin_mat = None
+        if self.num_items < 2:
+            return
+        scr_mx = squareform(-scr_mx, checks=False)
+        self.lin_mat = fastcluster.linkage(
+            scr_mx, method="average", preserve_input="False"
+        )
+        del scr_mx
+        self.adjust = abs(self.lin_mat[:, 2].min())
+        self.lin_mat[:, 2] += self.adjust
+
+    def cut(self, stop_similarity):
+        """Clusters (zero based ids) when the similarity of the closest clusters drops
+        below 'stop_similarity'."""
+        if self.lin_mat is None:
+            return np.zeros(self.num_items, dtype=int)
+        distance = -stop_similarity + self.adjust
+        return fcluster(self.lin_mat, distance, criterion="distance") - 1
+
+
+def _average_linkage_clusters(scr_mx, stop_similarity):
+    # average linkage AHC on a matrix of pairwise similarities, which stops when the
+    # similarity of the closest clusters drops below 'stop_similarity'
+    return AHCTree(scr_mx).cut(stop_similarity)
+
+
+def _cluster_block(args):
+    x, stop_similarity = args
+    # x-vectors are already length-normalized in ahc_clustering_2stage
+    return _average_linkage_clusters(x.dot(x.T), stop_similarity)
+
+
+def ahc_clustering_2stage(
+    x, threshold, block_size=2000, nj=1, calib_size=1000, dtype=np.float64
+):
+    """Two-stage approximation of ahc_clustering for long recordings, which never
+    computes the full NxN similarity matrix. The x-vectors are split into contiguous
+    blocks of 'block_size' x-vectors, which are clustered independently (in parallel if
+    nj > 1). The block-level clusters are then clustered again using average linkage,
+    where the similarity of two clusters is the dot product of their mean x-vectors
+    (i.e. the average pairwise cosine similarity of their length-normalized x-vectors).
+    Both stages use the same threshold, which is calibrated on a random subset of
+    'calib_size' x-vectors.
+    Input:
+        x          - NxD matrix of (transformed and length-normalized) x-vectors
+        threshold  - bias added to the calibrated threshold
+        block_size - number of x-vectors in the blocks clustered in the first stage
+        nj         - number of processes used to cluster the blocks
+        calib_size - number of x-vectors used to calibrate the threshold
+        dtype      - floating point type of the similarity matrices
+    Outputs:
+        labels     - N dimensional vector of zero based cluster ids
+        thr        - calibrated threshold (without the bias)
+    """
+    if len(x) <= block_size:
+        return ahc_clustering(x, threshold, dtype=dtype)
+    x = np.asarray(x, dtype=dtype)
+    x = x / (np.linalg.norm(x, axis=1, keepdims=True) + 1.0e-32)
+    rng = np.random.RandomState(0)  # fixed seed, so that the labels are reproducible
+    calib = np.sort(rng.choice(len(x), min(calib_size, len(x)), replace=False))
+    thr, _ = twoGMMcalib_lin(x[calib].dot(x[calib].T).ravel())
+
+    blocks = [
+        (x[i : i + block_size], thr + threshold)
+        for i in range(0, len(x), block_size)
+    ]
+    if nj > 1:
+        from multiprocessing import Pool
+
+        with Pool(nj) as pool:
+            block_labels = pool.map(_cluster_block, blocks)
+    else:
+        block_labels = list(map(_cluster_block, blocks))
+
+    # make the block-level cluster ids unique across blocks
+    offsets = np.cumsum([0] + [lbls.max() + 1 for lbls in block_labels[:-1]])
+    labels1st = np.concatenate(
+        [lbls + offset for lbls, offset in zip(block_labels, offsets)]
+    )
+    counts = np.bincount(labels1st)
+    means = np.zeros((len(counts), x.shape[1]), dtype=dtype)
+    np.add.at(means, labels1st, x)
+    means /= counts[:, np.newaxis]
+    labels2nd = _average_linkage_clusters(means.dot(means.T), thr + threshold)
+    return labels2nd[labels1st], thr
+
+
+def _pair_scores(x, rows, cols, scoring, diagAC):
+    # scores between x-vectors x[rows] and x[cols] (in the same way as knn_graph)
+    if scoring == "cosine":
+        return np.sum(x[rows] * x[cols], axis=1)
+    Lambda, Gamma, k = _plda_scoring_params(diagAC)
+    return (
+        np.sum(x[rows] * Lambda * x[cols], axis=1)
+        + (x[rows] ** 2).dot(Gamma)
+        + (x[cols] ** 2).dot(Gamma)
+        + k
+    )
+
+
+def _faiss_knn(x, k, scoring, diagAC, hnsw_neighbors=32):
+    import faiss
+
+    if scoring == "cosine":
+        queries = database = x
+    else:
+        # The PLDA score of x-vectors (xi, xj) is (Lambda * xi).xj + Gamma.xj^2 + const(xi),
+        # so the nearest neighbours of xi are found by maximum inner product search of
+        # [Lambda * xi, 1] in the database of [xj, Gamma.xj^2]
+        Lambda, Gamma, _ = _plda_scoring_params(diagAC)
+        queries = np.c_[x * Lambda, np.ones(len(x))]
+        database = np.c_[x, (x ** 2).dot(Gamma)]
+    index = faiss.IndexHNSWFlat(
+        database.shape[1], hnsw_neighbors, faiss.METRIC_INNER_PRODUCT
+    )
+    index.add(np.ascontiguousarray(database, dtype=np.float32))
+    _, neighbors = index.search(np.ascontiguousarray(queries, dtype=np.float32), k)
+    return neighbors
+
+
+def knn_graph(x, k, scoring="cosine", diagAC=None, block_size=2048, index=None):
+    """Builds sparse graph of the k nearest neighbours of each x-vector (including the
+    x-vector itself) without storing the NxN matrix of scores. The neighbours are found
+    by exact search over blocks of 'block_size' x-vectors or, optionally, by an
+    approximate index. The graph is symmetric (i.e. x-vectors i and j are connected
+    if either of them is among the k nearest neighbours of the other) and the edges
+    keep the scores, so that the top-p (p <= k) neighbours in each row are the same as
+    in the dense score matrix. It can be passed instead of the score matrix to
+    Spectral_clustering.NME_SpectralClustering.
+    Input:
+        x          - NxD matrix of x-vectors
+        k          - number of nearest neighbours of each x-vector
+        scoring    - "cosine" for cosine similarity or "plda" for PLDA scores of
+                     x-vectors in the space returned by kaldi_ivector_plda_projection
+        diagAC     - diagonal of the across-class covariance matrix (for "plda")
+        block_size - number of x-vectors scored at once in the exact search
+        index      - None for exact search or "faiss" for approximate search using
+                     faiss HNSW index (faiss needs to be installed)
+    Output:
+        NxN scipy.sparse.csr_matrix with the scores of the nearest neighbours
+    """
+    from scipy.sparse import csr_matrix
+
+    if scoring not in ("cosine", "plda"):
+        raise ValueError(f"Unknown scoring {scoring}, expecting 'cosine' or 'plda'.")
+    N = len(x)
+    k = min(k, N)
+    x = l2_norm(x) if scoring == "cosine" else np.asarray(x)
+    if index == "faiss":
+        neighbors = _faiss_knn(x, k, scoring, diagAC)
+    elif index is None:
+        neighbors = np.empty((N, k), dtype=int)
+        for i in range(0, N, block_size):
+            if scoring == "cosine":
+                scores = x[i : i + block_size].dot(x.T)
+            else:
+                scores = PLDA_scoring_in_LDA_space(x[i : i + block_size], x, diagAC)
+            if k < N:
+                neighbors[i : i + block_size] = np.argpartition(-scores, k - 1, axis=1)[
+                    :, :k
+                ]
+            else:
+                neighbors[i : i + block_size] = np.arange(N)
+    else:
+        raise ValueError(f"Unknown index {index}, expecting None or 'faiss'.")
+
+    # symmetrize the connectivity and (re)compute the scores of all the edges
+    rows = np.repeat(np.arange(N), k)
+    cols = neighbors.ravel()
+    valid = cols >= 0  # faiss returns -1 if it finds less than k neighbours
+    conn = csr_matrix(
+        (np.ones(valid.sum()), (rows[valid], cols[valid])), shape=(N, N)
+    )
+    conn = (conn + conn.T).tocoo()
+    scores = _pair_scores(x, conn.row, conn.col, scoring, diagAC)
+    return csr_matrix((scores, (conn.row, conn.col)), shape=(N, N))
 
 
 def read_xvector_timing_dict(kaldi_segments):
@@ -120,11 +474,9 @@ def read_xvector_timing_dict(kaldi_segments):
     Outputs:
          segs_dict[recording_file_name] = (array_of_xvector_names, array_of_start_and_end_times)
     """
-    segs = np.loadtxt(kaldi_segments, dtype=object)
-    split_by_filename = np.nonzero(segs[1:, 1] != segs[:-1, 1])[0] + 1
+    segs = group_by_recording(read_segments(kaldi_segments))
     return {
-        s[0, 1]: (s[:, 0], s[:, 2:].astype(float))
-        for s in np.split(segs, split_by_filename)
+        reco: (s["segment"], np.c_[s["start"], s["end"]]) for reco, s in segs.items()
     }
 
 
@@ -190,6 +542,59 @@ def segment_to_frame_labels(
     return frms[:max_len]
 
 
+def frame_diarization_error(ref_segments, hyp_segments, frame_rate=100.0):
+    """Frame-level diarization error of hypothesis speaker segments w.r.t. reference
+    segments. Both are converted to frame labels using segment_to_frame_labels, so only
+    one speaker per frame is considered (overlapping segments are split in the middle as
+    in merge_adjacent_labels, segments nested in another one are cut) and no collar is
+    applied. Reference and hypothesis speakers are mapped one-to-one by solving the
+    assignment problem on their frame co-occurrence counts.
+    Input:
+        ref_segments - tuple (starts, ends, labels) of reference speaker segments
+        hyp_segments - tuple (starts, ends, labels) of hypothesis speaker segments
+        frame_rate   - frame rate (in frames per second) used for the scoring
+    Outputs:
+        der, miss, fa, conf - diarization error rate and its missed speech, false alarm
+                              and speaker confusion components as fractions of the
+                              reference speech frames
+    """
+    from scipy.optimize import linear_sum_assignment
+
+    ref_ends, hyp_ends = np.asarray(ref_segments[1]), np.asarray(hyp_segments[1])
+    # both frame label arrays are padded with silence to the same length
+    end_time = max(ref_ends.max(initial=0), hyp_ends.max(initial=0))
+    length = -int(np.rint(frame_rate * end_time))
+    frames = []
+    for starts, ends, labels in (ref_segments, hyp_segments):
+        # speaker labels are mapped to integers, 0 stands for silence
+        _, label_ids = np.unique(labels, return_inverse=True)
+        order = np.argsort(starts, kind="stable")
+        starts, ends, label_ids = (
+            np.asarray(starts, dtype=float)[order],
+            np.asarray(ends, dtype=float)[order],
+            label_ids[order] + 1,
+        )
+        if len(starts) > 0:
+            starts, ends, label_ids = merge_adjacent_labels(starts, ends, label_ids)
+            # segments still overlapping an earlier one (e.g. nested in it) are cut
+            starts = np.maximum(starts, np.r_[0, np.maximum.accumulate(ends)[:-1]])
+            keep = ends > starts
+            starts, ends, label_ids = starts[keep], ends[keep], label_ids[keep]
+        frms = segment_to_frame_labels(starts, ends, label_ids, length, frame_rate, 0)
+        frames.append(frms.astype(int))
+    ref, hyp = frames
+
+    counts = np.zeros((ref.max() + 1, hyp.max() + 1))
+    np.add.at(counts, (ref, hyp), 1)
+    ref_speech = counts[1:].sum()
+    miss = counts[1:, 0].sum()
+    fa = counts[0, 1:].sum()
+    ref_ids, hyp_ids = linear_sum_assignment(counts[1:, 1:], maximize=True)
+    conf = counts[1:, 1:].sum() - counts[1:, 1:][ref_ids, hyp_ids].sum()
+    miss, fa, conf = (err / max(ref_speech, 1) for err in (miss, fa, conf))
+    return miss + fa + conf, miss, fa, conf
+
+
 def get_overlapping_segments(starts, ends, labels, overlap_rttm):
     """
     Given 2nd speaker assignments for segments, keep the regions which are overlapping.
@@ -197,38 +602,22 @@ def get_overlapping_segments(starts, ends, labels, overlap_rttm):
         starts - array of segment start times in seconds
         ends   - array of segment end times in seconds
         labels - array of segment labels (of any type)
-        overlap_rttm: path to the rttm file with the 2nd speaker assignments
+        overlap_rttm: path to the rttm file with the overlap regions, or a tuple of
+                      arrays (starts, ends) with the overlap regions in seconds
     Outputs:
         starts, ends, labels - overlapping segments with speakers from the 2nd speaker assignments
     """
-    overlap_segs = []
-    with open(overlap_rttm, "r") as f:
-        for line in f:
-            parts = line.strip().split()
-            start, dur = float(parts[3]), float(parts[4])
-            overlap_segs.append((start, start + dur))
-    overlap_segs.sort(key=lambda x: x[0])
-    if len(overlap_segs) == 0:
+    if isinstance(overlap_rttm, tuple):
+        overlap_starts, overlap_ends = overlap_rttm
+    else:
+        overlap_segs = read_rttm(overlap_rttm)
+        overlap_starts, overlap_ends = overlap_segs["start"], overlap_segs["end"]
+    if len(overlap_starts) == 0:
         return None, None, None
 
-    orig_segs = np.c_[starts, ends, labels].tolist()
-    orig_segs.sort(key=lambda x: x[0])
-
-    new_segs = []
-    i = j = 0
-    while i < len(orig_segs) and j < len(overlap_segs):
-        lo = max(orig_segs[i][0], overlap_segs[j][0])
-        hi = min(orig_segs[i][1], overlap_segs[j][1])
-        if lo < hi:
-            new_segs.append((lo, hi, orig_segs[i][2]))
-
-        # Remove the interval with the smallest endpoint
-        if orig_segs[i][1] < overlap_segs[j][1]:
-            i += 1
-        else:
-            j += 1
-
-    return np.array(new_segs)[:, 0], np.array(new_segs)[:, 1], np.array(new_segs)[:, 2]
+    starts, ends, index = intersect(starts, ends, overlap_starts, overlap_ends)
+    order = np.argsort(starts, kind="stable")
+    return starts[order], ends[order], np.asarray(labels)[index[order]]
 
 
 def mkdir_p(path):
@@ -264,22 +653,24 @@ def l2_norm(vec_or_matrix):
         )
 
 
-def cos_similarity(x):
+def cos_similarity(x, dtype=np.float64):
     """Compute cosine similarity matrix in CPU & memory sensitive way
 
     Args:
         x (np.ndarray): embeddings, 2D array, embeddings are in rows
+        dtype (np.dtype): floating point type of the computation and of the output
 
     Returns:
         np.ndarray: cosine similarity matrix
 
     """
     assert x.ndim == 2, f"x has {x.ndim} dimensions, it must be matrix"
+    x = np.asarray(x, dtype=dtype)
     x = x / (np.sqrt(np.sum(np.square(x), axis=1, keepdims=True)) + 1.0e-32)
     assert np.allclose(np.ones_like(x[:, 0]), np.sum(np.square(x), axis=1))
     max_n_elm = 200000000
     step = max(max_n_elm // (x.shape[0] * x.shape[0]), 1)
-    retval = np.zeros(shape=(x.shape[0], x.shape[0]), dtype=np.float64)
+    retval = np.zeros(shape=(x.shape[0], x.shape[0]), dtype=dtype)
     x0 = np.expand_dims(x, 0)
     x1 = np.expand_dims(x, 1)
     for i in range(0, x.shape[1], step):
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+# @Authors: Desh Raj
+# @Emails: r.desh26@gmail.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Interval algebra on sets of time intervals (e.g. speech or overlap regions), which
+# are represented by arrays of start and end times. The operations sort the intervals
+# and use binary search (np.searchsorted), so that they take O((N+M)log(M)) time
+# instead of comparing every query interval with every interval of the set.
+
+import numpy as np
+
+
+def normalize(starts, ends):
+    """Returns the union of (possibly overlapping and unsorted) intervals as sorted
+    disjoint intervals. Touching intervals are merged and empty ones are dropped.
+    Input:
+        starts, ends - arrays of interval start and end times
+    Outputs:
+        starts, ends - start and end times of the disjoint intervals
+    """
+    starts, ends = np.asarray(starts, dtype=float), np.asarray(ends, dtype=float)
+    keep = ends > starts
+    starts, ends = starts[keep], ends[keep]
+    if len(starts) == 0:
+        return starts, ends
+    order = np.argsort(starts, kind="stable")
+    starts, ends = starts[order], ends[order]
+    max_ends = np.maximum.accumulate(ends)
+    # a new interval begins where the start is after all the preceding intervals
+    first = np.r_[True, starts[1:] > max_ends[:-1]]
+    last = np.r_[first[1:], True]
+    return starts[first], max_ends[last]
+
+
+def union(starts1, ends1, starts2, ends2):
+    """Returns the union of two sets of intervals as sorted disjoint intervals."""
+    return normalize(np.r_[starts1, starts2], np.r_[ends1, ends2])
+
+
+def intersect(starts, ends, ref_starts, ref_ends):
+    """Intersects each of the query intervals with the set of reference intervals.
+    Input:
+        starts, ends         - arrays of query interval start and end times (the query
+                               intervals can overlap and do not need to be sorted)
+        ref_starts, ref_ends - arrays of reference interval start and end times
+    Outputs:
+        starts, ends - start and end times of the non-empty intersections
+        index        - index of the query interval for each intersection (e.g. to
+                       select the labels of the query intervals)
+    """
+    starts, ends = np.asarray(starts, dtype=float), np.asarray(ends, dtype=float)
+    ref_starts, ref_ends = normalize(ref_starts, ref_ends)
+    # reference intervals first..last-1 overlap the query interval
+    first = np.searchsorted(ref_ends, starts, side="right")
+    last = np.maximum(np.searchsorted(ref_starts, ends, side="left"), first)
+    counts = last - first
+    index = np.repeat(np.arange(len(starts)), counts)
+    ref_index = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    ref_index += np.repeat(first, counts)
+    new_starts = np.maximum(starts[index], ref_starts[ref_index])
+    new_ends = np.minimum(ends[index], ref_ends[ref_index])
+    keep = new_ends > new_starts
+    return new_starts[keep], new_ends[keep], index[keep]
+
+
+def intersection(starts1, ends1, starts2, ends2):
+    """Returns the intersection of two sets of intervals as sorted disjoint intervals."""
+    starts, ends, _ = intersect(*normalize(starts1, ends1), starts2, ends2)
+    return starts, ends
+
+
+def complement(starts, ends, start=0.0, end=None):
+    """Returns the parts of the range [start, end] not covered by the intervals (e.g.
+    the non-speech regions for speech intervals). If end is None, the range ends with
+    the last interval."""
+    starts, ends = normalize(starts, ends)
+    if end is None:
+        end = ends[-1] if len(ends) > 0 else start
+    new_starts = np.r_[start, ends]
+    new_ends = np.r_[starts, end]
+    new_starts, new_ends = np.maximum(new_starts, start), np.minimum(new_ends, end)
+    keep = new_ends > new_starts
+    return new_starts[keep], new_ends[keep]
+
+
+def covered_duration(starts, ends, ref_starts, ref_ends):
+    """Returns array with the duration of each query interval covered by the union of
+    the reference intervals."""
+    starts, ends = np.asarray(starts, dtype=float), np.asarray(ends, dtype=float)
+    ref_starts, ref_ends = normalize(ref_starts, ref_ends)
+    if len(ref_starts) == 0:
+        return np.zeros(len(starts))
+    # cum_dur(t) is the duration of the reference intervals before time t
+    offsets = np.r_[0.0, np.cumsum(ref_ends - ref_starts)]
+
+    def cum_dur(t):
+        i = np.searchsorted(ref_starts, t, side="right") - 1
+        partial = np.clip(t - ref_starts[i], 0, ref_ends[i] - ref_starts[i])
+        return np.where(i >= 0, offsets[i] + partial, 0.0)
+
+    return np.maximum(cum_dur(ends) - cum_dur(starts), 0.0)
+
+
+def coverage(starts, ends, ref_starts, ref_ends):
+    """Returns array with the fraction of each query interval covered by the union of
+    the reference intervals (0 for empty query intervals)."""
+    durs = np.asarray(ends, dtype=float) - np.asarray(starts, dtype=float)
+    covered = covered_duration(starts, ends, ref_starts, ref_ends)
+    return np.divide(covered, durs, out=np.zeros(len(durs)), where=durs > 0)
+
+
+def count_regions(starts, ends, min_count=2):
+    """Returns the regions covered by at least 'min_count' of the (possibly overlapping)
+    intervals, e.g. the overlapped speech regions of the speaker turns in an RTTM file
+    for min_count=2. Intervals touching at a single time point do not overlap."""
+    starts, ends = np.asarray(starts, dtype=float), np.asarray(ends, dtype=float)
+    times = np.r_[ends, starts]
+    deltas = np.r_[-np.ones(len(ends), dtype=int), np.ones(len(starts), dtype=int)]
+    # at equal times, the intervals end before the next ones begin
+    order = np.lexsort((deltas, times))
+    times, counts = times[order], np.cumsum(deltas[order])
+    active = counts >= min_count
+    # region i is between times[i] and times[i+1]
+    new_starts = times[:-1][active[:-1]]
+    new_ends = times[1:][active[:-1]]
+    return normalize(new_starts, new_ends)
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+
+# @Authors: Desh Raj
+# @Emails: r.desh26@gmail.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Readers and writers of the text formats used in the recipes: RTTM files, Kaldi
+# 'segments' files and .lab (VAD) files. The readers return numpy structured arrays and
+# accept lists of files, so that e.g. all the RTTM files of a corpus can be loaded at
+# once and indexed by recording (see group_by_recording). With numpy >= 1.23, whose
+# np.loadtxt parses the text in C, the columns are read by np.loadtxt. Otherwise they
+# are split in Python: if all the lines of a file have the same number of fields, the
+# file is split into tokens at once and the columns are taken as strided slices of the
+# tokens, so that no list of fields is kept per line.
+# The writers format all the lines first and write them with a single call.
+
+import io
+import itertools
+import warnings
+from pathlib import Path
+
+import numpy as np
+
+# np.loadtxt of older numpy versions splits the lines in Python, and is several times
+# slower than _split_columns
+_C_LOADTXT = np.lib.NumpyVersion(np.__version__) >= "1.23.0"
+
+
+def _read_text(files):
+    # files can be a path, an open file, or a list of those
+    if isinstance(files, (list, tuple)):
+        texts = (_read_text(f) for f in files)
+        return "".join(text if text.endswith("\n") else text + "\n" for text in texts)
+    if hasattr(files, "read"):
+        return files.read()
+    with open(files, "r") as f:
+        return f.read()
+
+
+def _read_columns(files, usecols, dtype, comment=None, line_type=None):
+    """Returns the columns 'usecols' (zero based indices) of the whitespace separated
+    text file(s) as a structured array with fields 'dtype' (list of (name, type) pairs,
+    one per column). Empty lines (and lines starting with 'comment') are skipped, as
+    well as the lines whose first field is not 'line_type' (if given)."""
+    if line_type is not None:
+        usecols = (0, *usecols)
+    if _C_LOADTXT:
+        # a single file is read by np.loadtxt directly
+        is_path = isinstance(files, (str, Path))
+        with warnings.catch_warnings():
+            # no warning for files without any lines
+            warnings.simplefilter("ignore", UserWarning)
+            arr = np.loadtxt(
+                files if is_path else io.StringIO(_read_text(files)),
+                dtype=dtype if line_type is None else [("line_type", object), *dtype],
+                comments=comment,
+                usecols=usecols,
+                ndmin=1,
+            )
+        if line_type is None:
+            return arr
+        arr = arr[arr["line_type"] == line_type]
+        return _structured_array([(name, arr[name]) for name, _ in dtype])
+    columns = _split_columns(_read_text(files), usecols, comment)
+    if line_type is not None:
+        types = columns.pop(0)
+        if types.count(line_type) < len(types):
+            keep = [t == line_type for t in types]
+            columns = [list(itertools.compress(column, keep)) for column in columns]
+    return _structured_array(
+        [
+            # numbers are converted by float()/int(), which is faster than np.array
+            (name, np.array(column, dtype=object))
+            if t is object
+            else (name, np.fromiter(map(t, column), dtype=t, count=len(column)))
+            for (name, t), column in zip(dtype, columns)
+        ]
+    )
+
+
+def _split_columns(text, usecols, comment=None):
+    # returns the columns 'usecols' of the text as lists of strings
+    if comment is not None and comment in text:
+        text = "\n".join(
+            line for line in text.splitlines() if not line.lstrip().startswith(comment)
+        )
+    min_width = max(usecols) + 1
+    # number of fields of the non-empty lines (counting them is cheaper than keeping
+    # the fields of each line)
+    widths = set(map(len, map(str.split, text.splitlines()))) - {0}
+    if len(widths) == 1 and min(widths) >= min_width:
+        # all the lines have the same number of fields
+        width = widths.pop()
+        tokens = text.split()
+        return [tokens[i::width] for i in usecols]
+    # otherwise split the lines one by one (without keeping the lists of fields, which
+    # would make the garbage collector slow for large files)
+    columns = [[] for _ in usecols]
+    for line in text.splitlines():
+        fields = line.split()
+        if len(fields) == 0:
+            continue
+        if len(fields) < min_width:
+            raise ValueError(f"Expecting at least {min_width} fields on line: {line}")
+        for column, i in zip(columns, usecols):
+            column.append(fields[i])
+    return columns
+
+
+def _structured_array(columns):
+    # columns is a list of (name, array) pairs; string columns are kept as Python
+    # strings (object fields), which is much faster than fixed width unicode fields
+    columns = [(name, np.asarray(column)) for name, column in columns]
+    num_rows = len(columns[0][1]) if columns else 0
+    arr = np.empty(num_rows, dtype=[(name, column.dtype) for name, column in columns])
+    for name, column in columns:
+        arr[name] = column
+    return arr
+
+
+def read_rttm(rttm_files):
+    """Loads speaker segments from RTTM file(s).
+    Input:
+        rttm_files - path to an RTTM file, an open file or a list of those (e.g. the
+                     RTTM files of all the recordings of a corpus)
+    Output:
+        structured array with fields 'recording', 'channel', 'start', 'end' and
+        'speaker' (one row per SPEAKER line, in the order of the file(s))
+    """
+    segments = _read_columns(
+        rttm_files,
+        (1, 2, 3, 4, 7),
+        [
+            ("recording", object),
+            ("channel", int),
+            ("start", float),
+            ("end", float),
+            ("speaker", object),
+        ],
+        comment=";;",
+        line_type="SPEAKER",
+    )
+    # the column read into 'end' is the duration
+    segments["end"] += segments["start"]
+    return segments
+
+
+def read_segments(segments_files):
+    """Loads Kaldi 'segments' file(s) with lines: <segment> <recording> <start> <end>.
+    Output:
+        structured array with fields 'segment', 'recording', 'start' and 'end'
+    """
+    return _read_columns(
+        segments_files,
+        (0, 1, 2, 3),
+        [("segment", object), ("recording", object), ("start", float), ("end", float)],
+    )
+
+
+def read_lab(lab_files):
+    """Loads .lab file(s) with speech segments on lines: <start> <end> [<label>].
+    Output:
+        structured array with fields 'start' and 'end'
+    """
+    return _read_columns(lab_files, (0, 1), [("start", float), ("end", float)])
+
+
+def group_by_recording(arr, field="recording"):
+    """Splits a structured array (e.g. from read_rttm or read_segments) into a dictionary
+    indexed by recording. The rows of each recording keep their original order."""
+    if len(arr) == 0:
+        return {}
+    keys = arr[field]
+    first = np.r_[0, np.nonzero(keys[1:] != keys[:-1])[0] + 1]
+    if len(set(keys[first])) < len(first):
+        # some recordings are not stored contiguously, so sort them first
+        arr = arr[np.argsort(keys, kind="stable")]
+        keys = arr[field]
+        first = np.r_[0, np.nonzero(keys[1:] != keys[:-1])[0] + 1]
+    return dict(zip(keys[first], np.split(arr, first[1:])))
+
+
+def find_audio_files(in_dir, file_ids, ext=".wav"):
+    """Returns the paths of the audio files of the recordings 'file_ids' (in the same
+    order), looking in 'in_dir' first and then in its subdirectories. Recordings
+    without an audio file are skipped."""
+    in_dir = Path(in_dir)
+    paths, missing = {}, []
+    for file_id in file_ids:
+        path = in_dir / f"{file_id}{ext}"
+        if path.is_file():
+            paths[file_id] = path
+        else:
+            missing.append(file_id)
+    if missing:
+        found = {path.stem: path for path in in_dir.rglob(f"*{ext}")}
+        paths.update({file_id: found[file_id] for file_id in missing if file_id in found})
+    return [paths[file_id] for file_id in file_ids if file_id in paths]
+
+
+def write_rttm(fp, recording, starts, ends, labels, channel=1):
+    """Writes speaker segments of a recording to an open RTTM file."""
+    fp.write(
+        "".join(
+            f"SPEAKER {recording} {channel} {start:7.3f} {end - start:7.3f} "
+            f"<NA> <NA> {label} <NA> <NA>\n"
+            for start, end, label in zip(starts, ends, labels)
+        )
+    )
+
+
+def write_lab(fp, starts, ends, label="sp"):
+    """Writes speech segments to an open .lab file."""
+    fp.write(
+        "".join(
+            f"{start:.3f} {end:.3f} {label}\n" for start, end in zip(starts, ends)
+        )
+    )
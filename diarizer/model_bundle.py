@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+# @Authors: Desh Raj
+# @Emails: r.desh26@gmail.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# The x-vector transform and PLDA model used by the clustering scripts, loaded once
+# per process. The bundle can also be saved as a directory of .npy files, which are
+# memory-mapped when loaded, so that many jobs can share the same model without parsing
+# the HDF5 and Kaldi files again.
+#
+# Usage (export a bundle):
+#   python diarizer/model_bundle.py --xvec-transform transform.h5 --plda-file plda out_dir
+
+import argparse
+import os
+
+import h5py
+import numpy as np
+from scipy.linalg import eigh
+
+from diarizer.diarization_lib import l2_norm, mkdir_p
+from diarizer.kaldi_utils import read_plda
+
+
+class ModelBundle:
+    """
+    Attributes:
+    mean1, lda, mean2 - x-vector transform (see transform)
+    kaldi_plda        - PLDA model (mu, tr, psi) using the kaldi parametrization as
+                        loaded by read_plda, or None if there is no PLDA model
+    plda_mu, plda_tr, plda_psi - PLDA model with diagonalized across-class covariance
+                        as used by VB-HMM (plda_tr whitens within-class covariance and
+                        plda_psi are across-class variances in descending order)
+    """
+
+    def __init__(self, mean1, lda, mean2, kaldi_plda=None):
+        self.mean1, self.lda, self.mean2 = mean1, lda, mean2
+        self.kaldi_plda = kaldi_plda
+        self.plda_mu = self.plda_tr = self.plda_psi = None
+        if kaldi_plda is not None:
+            plda_mu, plda_tr, plda_psi = kaldi_plda
+            W = np.linalg.inv(plda_tr.T.dot(plda_tr))
+            B = np.linalg.inv((plda_tr.T / plda_psi).dot(plda_tr))
+            acvar, wccn = eigh(B, W)
+            self.plda_mu = plda_mu
+            self.plda_psi = acvar[::-1]
+            self.plda_tr = wccn.T[::-1]
+
+    @classmethod
+    def from_files(cls, xvec_transform, plda_file=None):
+        """Loads the bundle from the x-vector transform h5 file and (optionally) the
+        PLDA model file in Kaldi format."""
+        with h5py.File(xvec_transform, "r") as f:
+            mean1 = np.array(f["mean1"])
+            mean2 = np.array(f["mean2"])
+            lda = np.array(f["lda"])
+        kaldi_plda = read_plda(plda_file) if plda_file is not None else None
+        return cls(mean1, lda, mean2, kaldi_plda)
+
+    @classmethod
+    def load(cls, model_dir, mmap_mode="r"):
+        """Loads a bundle saved by save(), memory-mapping the arrays by default."""
+        arrays = {}
+        for name in [
+            "mean1",
+            "lda",
+            "mean2",
+            "kaldi_plda_mu",
+            "kaldi_plda_tr",
+            "kaldi_plda_psi",
+            "plda_tr",
+            "plda_psi",
+        ]:
+            path = os.path.join(model_dir, f"{name}.npy")
+            if os.path.exists(path):
+                arrays[name] = np.load(path, mmap_mode=mmap_mode)
+        bundle = cls.__new__(cls)
+        bundle.mean1, bundle.lda, bundle.mean2 = (
+            arrays["mean1"],
+            arrays["lda"],
+            arrays["mean2"],
+        )
+        bundle.kaldi_plda = bundle.plda_mu = bundle.plda_tr = bundle.plda_psi = None
+        if "kaldi_plda_mu" in arrays:
+            bundle.kaldi_plda = tuple(
+                arrays[f"kaldi_plda_{name}"] for name in ("mu", "tr", "psi")
+            )
+            bundle.plda_mu = arrays["kaldi_plda_mu"]
+            bundle.plda_tr, bundle.plda_psi = arrays["plda_tr"], arrays["plda_psi"]
+        return bundle
+
+    def save(self, model_dir):
+        """Saves the bundle (including the diagonalized PLDA) as .npy files."""
+        mkdir_p(model_dir)
+        arrays = {"mean1": self.mean1, "lda": self.lda, "mean2": self.mean2}
+        if self.kaldi_plda is not None:
+            kaldi_names = ["kaldi_plda_mu", "kaldi_plda_tr", "kaldi_plda_psi"]
+            arrays.update(zip(kaldi_names, self.kaldi_plda))
+            arrays.update(plda_tr=self.plda_tr, plda_psi=self.plda_psi)
+        for name, array in arrays.items():
+            np.save(os.path.join(model_dir, f"{name}.npy"), np.ascontiguousarray(array))
+
+    def transform(self, x, dtype=None):
+        """Centers, length-normalizes, LDA-projects, centers again and length-normalizes
+        x-vectors (in rows of x). With dtype, the computation is done in this type."""
+        mean1, lda, mean2 = self.mean1, self.lda, self.mean2
+        if dtype is not None:
+            x, mean1, lda, mean2 = (
+                np.asarray(arr, dtype=dtype) for arr in (x, mean1, lda, mean2)
+            )
+        return l2_norm(lda.T.dot((l2_norm(x - mean1)).transpose()).transpose() - mean2)
+
+
+def load_model_bundle(xvec_transform, plda_file=None):
+    """Loads the model bundle from a directory saved by ModelBundle.save() or from the
+    x-vector transform h5 file and the PLDA model file."""
+    if os.path.isdir(xvec_transform):
+        return ModelBundle.load(xvec_transform)
+    return ModelBundle.from_files(xvec_transform, plda_file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export x-vector transform and PLDA model as a memory-mappable bundle"
+    )
+    parser.add_argument(
+        "--xvec-transform",
+        required=True,
+        type=str,
+        help="path to x-vector transformation h5 file",
+    )
+    parser.add_argument(
+        "--plda-file",
+        required=False,
+        type=str,
+        default=None,
+        help="File with PLDA model in Kaldi format",
+    )
+    parser.add_argument("out_dir", type=str, help="Output directory of the bundle")
+    args = parser.parse_args()
+
+    ModelBundle.from_files(args.xvec_transform, args.plda_file).save(args.out_dir)
@@ -1,9 +1,16 @@
 #!/usr/local/env/python3
 import argparse
+import os
+from functools import partial
 from pathlib import Path
 
 from pyannote.audio.pipelines import OverlappedSpeechDetection
 
+from diarizer.io_utils import find_audio_files, write_rttm
+from diarizer.parallel import run_sharded, split_list
+from diarizer.vad.energy_gate import EnergyGate
+from diarizer.vad.segmentation import SegmentationScorer, binarize, save_scores
+
 
 def get_args():
     parser = argparse.ArgumentParser(description="Run Pyannote overlap detection.")
@@ -15,7 +22,7 @@ def get_args():
     parser.add_argument(
         "--file-list",
         type=str,
-        help="List of wav files to process.",
+        help="List of recordings (wav file names without extension) to process.",
     )
     parser.add_argument(
         "--out-dir",
@@ -42,30 +49,81 @@ def get_args():
         default=0.0,
         help="Fill non-speech regions shorter than that many seconds.",
     )
+    parser.add_argument(
+        "--score-cache",
+        type=str,
+        default=None,
+        help="If provided, store the speech and overlap frame scores in this directory "
+        "(for tuning with vad/hparam_search.py) and binarize them here instead of "
+        "running the pyannote pipeline.",
+    )
+    parser.add_argument(
+        "--pre-vad",
+        action="store_true",
+        help="Run the segmentation model only on the regions that are not clearly "
+        "silent, according to a cheap energy/spectral flux gate (see "
+        "vad/energy_gate.py). Implies --batched.",
+    )
+    parser.add_argument(
+        "--batched",
+        action="store_true",
+        help="Score the chunks of consecutive recordings in batches (see "
+        "vad/segmentation.py) and binarize the scores here, instead of running the "
+        "pyannote pipeline on each recording.",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=32,
+        help="Number of chunks (from one or more recordings) in each model call "
+        "(with --batched).",
+    )
+    parser.add_argument(
+        "--num-workers",
+        type=int,
+        default=1,
+        help="Number of worker processes; the recordings are split between them.",
+    )
+    parser.add_argument(
+        "--num-threads",
+        type=int,
+        default=None,
+        help="Number of threads per worker. By default, the cores are divided "
+        "between the workers.",
+    )
     return parser.parse_args()
 
 
-def main(in_dir, files, out_dir, HYPER_PARAMETERS):
-    out_dir.mkdir(exist_ok=True, parents=True)
+def main(args, out_dir, HYPER_PARAMETERS, files):
+    if not (args.batched or args.pre_vad or args.score_cache is not None):
+        ovl_pipeline = OverlappedSpeechDetection(segmentation=args.model, device="cpu")
+        ovl_pipeline.instantiate(HYPER_PARAMETERS)
+        for file in files:
+            ovl_out = ovl_pipeline({"audio": file})
+            with open(f"{out_dir}/{Path(file).stem}.rttm", "w") as f:
+                ovl_out.write_rttm(f)
+        return
 
-    ovl_pipeline = OverlappedSpeechDetection(segmentation=args.model, device="cpu")
-    ovl_pipeline.instantiate(HYPER_PARAMETERS)
-
-    for file in in_dir.rglob("*.wav"):
-        file_id = file.stem
-        if file_id not in files:
-            continue
-        ovl_out = ovl_pipeline({"audio": file})
+    scorer = SegmentationScorer(
+        args.model,
+        batch_size=args.batch_size,
+        gate=EnergyGate() if args.pre_vad else None,
+    )
+    for file, speech, overlap, times in scorer.score_files(files):
+        file_id = Path(file).stem
+        if args.score_cache is not None:
+            save_scores(args.score_cache, file_id, speech, overlap, times)
+        starts, ends = binarize(overlap, times, **HYPER_PARAMETERS)
         with open(f"{out_dir}/{file_id}.rttm", "w") as f:
-            ovl_out.write_rttm(f)
+            write_rttm(f, file_id, starts, ends, ["overlap"] * len(starts))
 
 
 if __name__ == "__main__":
     args = get_args()
-    in_dir = Path(args.in_dir)
     with open(args.file_list) as f:
-        files = [line.strip() for line in f]
+        files = find_audio_files(args.in_dir, [line.strip() for line in f])
     out_dir = Path(args.out_dir)
+    out_dir.mkdir(exist_ok=True, parents=True)
 
     HYPER_PARAMETERS = {
         "onset": args.onset,
@@ -74,4 +132,7 @@ if __name__ == "__main__":
         "min_duration_off": args.min_duration_off,
     }
 
-    main(in_dir, files, out_dir, HYPER_PARAMETERS)
+    shards = split_list(
+        files, args.num_workers, weights=[os.path.getsize(f) for f in files]
+    )
+    run_sharded(partial(main, args, out_dir, HYPER_PARAMETERS), shards, args.num_threads)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+# @Authors: Desh Raj
+# @Emails: r.desh26@gmail.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Helpers to split the recordings of a stage across worker processes on one machine.
+# Each worker gets a shard of the file list and a limited number of threads (for
+# numpy/torch), so that the workers do not oversubscribe the cores.
+
+import multiprocessing
+import os
+
+THREAD_ENV_VARS = ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"]
+
+
+def split_list(items, num_shards, weights=None):
+    """Splits 'items' into (at most) 'num_shards' lists with similar total weight (e.g.
+    file sizes), assigning the heaviest items first. Without weights, the items are
+    assigned round robin. The items of each shard keep their input order."""
+    num_shards = max(1, min(num_shards, len(items)))
+    if weights is None:
+        weights = [1] * len(items)
+    order = sorted(range(len(items)), key=lambda i: -weights[i])
+    loads = [0] * num_shards
+    shards = [[] for _ in range(num_shards)]
+    for i in order:
+        shard = loads.index(min(loads))
+        shards[shard].append(i)
+        loads[shard] += weights[i]
+    return [[items[i] for i in sorted(shard)] for shard in shards]
+
+
+def set_num_threads(num_threads):
+    """Limits the number of threads used by torch (if available) in this process."""
+    try:
+        import torch
+
+        torch.set_num_threads(num_threads)
+    except ImportError:
+        pass
+
+
+def run_sharded(func, shards, num_threads=None):
+    """Calls func(shard) for each shard, in a separate process per shard (or in this
+    process if there is a single shard), with at most 'num_threads' threads each (by
+    default, the cores are divided between the shards). Returns the list of results."""
+    if num_threads is None:
+        num_threads = max(1, os.cpu_count() // max(1, len(shards)))
+    if len(shards) <= 1:
+        set_num_threads(num_threads)
+        return [func(shard) for shard in shards]
+    # the thread limits must be in the environment before the workers import numpy
+    saved = {var: os.environ.get(var) for var in THREAD_ENV_VARS}
+    os.environ.update({var: str(num_threads) for var in THREAD_ENV_VARS})
+    try:
+        ctx = multiprocessing.get_context("spawn")
+        with ctx.Pool(
+            len(shards), initializer=set_num_threads, initargs=(num_threads,)
+        ) as pool:
+            return pool.map(func, shards, chunksize=1)
+    finally:
+        for var, value in saved.items():
+            if value is None:
+                os.environ.pop(var, None)
+            else:
+                os.environ[var] = value
@@ -0,0 +1,423 @@
+#!/usr/bin/env python
+
+# @Authors: Desh Raj
+# @Emails: r.desh26@gmail.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# End-to-end diarization in one process: speech activity and overlap detection (one
+# segmentation pass, see vad/segmentation.py), x-vector extraction (xvector/extractor.py)
+# and VBx or spectral clustering (vbx/vbhmm.py, spectral/sclust.py). The models are
+# loaded once, the audio is read once, and the speech regions, overlap regions and
+# x-vectors are passed between the stages in memory. The intermediate files of the
+# recipes (.lab, overlap RTTM, x-vector .ark/.seg) are only written if an artifacts
+# directory is given.
+#
+# Usage:
+#   python diarizer/pipeline.py --in-dir wavs --file-list list --out-rttm-dir out \
+#     --xvec-weights diarizer/models/ResNet101_16kHz/nnet/raw_81.pth \
+#     --xvec-transform diarizer/models/ResNet101_16kHz/transform.h5 \
+#     --plda-file diarizer/models/ResNet101_16kHz/plda
+
+import argparse
+import os
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+
+from diarizer.diarization_lib import PLDAScorer, mkdir_p
+from diarizer.io_utils import find_audio_files, write_lab, write_rttm
+from diarizer.model_bundle import load_model_bundle
+from diarizer.parallel import run_sharded, split_list
+from diarizer.postprocessing import subsegments_to_segments
+from diarizer.spectral.sclust import cluster_spectral, compute_overlap_vector
+from diarizer.vad.energy_gate import EnergyGate
+from diarizer.vad.segmentation import SegmentationScorer, binarize
+from diarizer.vbx.vbhmm import cluster_vbx, labels_to_segments
+from diarizer.xvector.extractor import XVectorExtractor
+
+# defaults of the recipes (see scripts/*/051_diarize_vbx.sh)
+VBX_PARAMS = {
+    "init": "AHC+VB",
+    "threshold": -0.015,
+    "lda_dim": 128,
+    "Fa": 0.4,
+    "Fb": 64,
+    "loopP": 0.65,
+    "init_smoothing": 7.0,
+}
+
+
+class DiarizationPipeline:
+    """
+    Input (of __call__):
+        file - path to an audio file (8kHz or 16kHz)
+    Outputs:
+        starts, ends, labels - speaker segments (as written to the RTTM file)
+    """
+
+    def __init__(
+        self,
+        xvec_weights,
+        xvec_transform,
+        plda_file=None,
+        method="vbx",
+        segmentation_model="pyannote/segmentation",
+        use_auth_token=None,
+        xvec_model="ResNet101",
+        xvec_model_file=None,
+        xvec_backend="pytorch",
+        vad_params=None,
+        ovl_params=None,
+        cluster_params=None,
+        overlap_assignment=True,
+        align_time=None,
+        pre_vad=False,
+        batch_size=32,
+        device="cpu",
+        dtype=np.float64,
+        artifacts_dir=None,
+    ):
+        if method not in ("vbx", "spectral"):
+            raise ValueError(f"Unknown clustering method {method}")
+        self.method = method
+        self.scorer = SegmentationScorer(
+            segmentation_model,
+            use_auth_token=use_auth_token,
+            device=device,
+            batch_size=batch_size,
+            gate=EnergyGate() if pre_vad else None,
+        )
+        self.extractor = XVectorExtractor(
+            weights=xvec_weights,
+            model=xvec_model,
+            model_file=xvec_model_file,
+            backend=xvec_backend,
+            device=device,
+        )
+        self.model = load_model_bundle(xvec_transform, plda_file)
+        if method == "vbx":
+            self.cluster_params = {**VBX_PARAMS, **(cluster_params or {})}
+            self.plda_scorer = None
+        else:
+            self.cluster_params = cluster_params or {}
+            self.plda_scorer = (
+                PLDAScorer(self.model.kaldi_plda)
+                if self.model.kaldi_plda is not None
+                else None
+            )
+        self.vad_params = vad_params or {}
+        self.ovl_params = ovl_params or {}
+        self.overlap_assignment = overlap_assignment
+        self.align_time = align_time
+        self.dtype = dtype
+        self.artifacts_dir = artifacts_dir
+        if artifacts_dir is not None:
+            for name in ["vad", "overlap", "xvectors"]:
+                mkdir_p(os.path.join(artifacts_dir, name))
+
+    def _read_audio(self, files):
+        # reads each recording once: the x-vector extractor uses the samples and the
+        # segmentation model gets the same samples as a waveform
+        import soundfile as sf
+        import torch
+
+        for file in files:
+            signal, sample_rate = sf.read(file)
+            yield {
+                "uri": Path(file).stem,
+                "signal": signal,
+                "waveform": torch.from_numpy(signal.astype(np.float32))[None],
+                "sample_rate": sample_rate,
+            }
+
+    def diarize_files(self, files):
+        """Diarizes the recordings in 'files' (paths to audio files); the chunks of
+        consecutive recordings are batched in the segmentation model.
+        Yields:
+            (file_id, starts, ends, labels) for each recording, in the input order
+        """
+        for audio, speech, overlap, times in self.scorer.score_files(
+            self._read_audio(files)
+        ):
+            file_id = audio["uri"]
+            yield (file_id, *self.diarize(file_id, audio, speech, overlap, times))
+
+    def diarize(self, file_id, audio, speech, overlap, times):
+        """Diarizes a recording given its audio and its speech and overlap scores."""
+        starts, ends = binarize(speech, times, **self.vad_params)
+        if self.align_time is not None:
+            starts = np.round(starts / self.align_time) * self.align_time
+            ends = np.round(ends / self.align_time) * self.align_time
+        overlaps = None
+        if self.overlap_assignment:
+            overlaps = binarize(overlap, times, **self.ovl_params)
+
+        keys, xvecs, seg_starts, seg_ends = self.extractor(
+            file_id, audio["signal"], audio["sample_rate"], np.c_[starts, ends]
+        )
+        seg_starts, seg_ends = np.array(seg_starts), np.array(seg_ends)
+        if self.artifacts_dir is not None:
+            self._write_artifacts(
+                file_id, starts, ends, overlaps, keys, xvecs, seg_starts, seg_ends
+            )
+        if len(xvecs) == 0:
+            return np.zeros(0), np.zeros(0), np.zeros(0, dtype=int)
+
+        if self.method == "vbx":
+            x = self.model.transform(np.array(xvecs), dtype=self.dtype)
+            labels1st, labels2nd = cluster_vbx(
+                x, self.model, dtype=self.dtype, **self.cluster_params
+            )
+            starts, ends, labels = labels_to_segments(
+                seg_starts, seg_ends, labels1st, labels2nd, overlaps
+            )
+            return starts, ends, labels + 1
+
+        x = self.model.transform(np.array(xvecs))
+        labels = cluster_spectral(
+            x,
+            self.plda_scorer,
+            compute_overlap_vector(overlaps, np.c_[seg_starts, seg_ends])
+            if overlaps is not None
+            else None,
+            **self.cluster_params,
+        )
+        return subsegments_to_segments(seg_starts, seg_ends, labels)
+
+    def _write_artifacts(
+        self, file_id, starts, ends, overlaps, keys, xvecs, seg_starts, seg_ends
+    ):
+        # the same files as the recipe stages (see vad/pyannote_vad_overlap.py and
+        # xvector/predict.py), one of each per recording
+        import kaldi_io
+
+        with open(os.path.join(self.artifacts_dir, "vad", f"{file_id}.lab"), "w") as f:
+            write_lab(f, starts, ends)
+        if overlaps is not None:
+            path = os.path.join(self.artifacts_dir, "overlap", f"{file_id}.rttm")
+            with open(path, "w") as f:
+                write_rttm(f, file_id, *overlaps, ["overlap"] * len(overlaps[0]))
+        prefix = os.path.join(self.artifacts_dir, "xvectors", file_id)
+        with open(f"{prefix}.seg", "w") as seg_file, open(f"{prefix}.ark", "wb") as ark:
+            for key, xvector, seg_start, seg_end in zip(
+                keys, xvecs, seg_starts, seg_ends
+            ):
+                seg_file.write(f"{key} {file_id} {seg_start} {seg_end}{os.linesep}")
+                kaldi_io.write_vec_flt(ark, xvector, key=key)
+
+    def __call__(self, file):
+        _, starts, ends, labels = next(self.diarize_files([file]))
+        return starts, ends, labels
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Run speech activity detection, overlap detection, x-vector "
+        "extraction and clustering in one process."
+    )
+    parser.add_argument(
+        "--in-dir", type=str, required=True, help="Directory with the wav files."
+    )
+    parser.add_argument(
+        "--file-list",
+        type=str,
+        required=True,
+        help="List of recordings (wav file names without extension) to process.",
+    )
+    parser.add_argument(
+        "--out-rttm-dir", type=str, required=True, help="Directory for output RTTMs."
+    )
+    parser.add_argument(
+        "--artifacts-dir",
+        type=str,
+        default=None,
+        help="If provided, also write the speech regions (vad/*.lab), overlap regions "
+        "(overlap/*.rttm) and x-vectors (xvectors/*.ark, *.seg) to this directory.",
+    )
+    parser.add_argument(
+        "--method", type=str, default="vbx", choices=["vbx", "spectral"]
+    )
+    parser.add_argument(
+        "--segmentation-model",
+        type=str,
+        default="pyannote/segmentation",
+        help="Segmentation model used for speech activity and overlap detection.",
+    )
+    parser.add_argument("--use-auth-token", type=str, default=None)
+    for task, name in [("vad", "speech"), ("ovl", "overlap")]:
+        parser.add_argument(f"--{task}-onset", type=float, default=0.5)
+        parser.add_argument(f"--{task}-offset", type=float, default=0.5)
+        parser.add_argument(
+            f"--{task}-min-duration-on",
+            type=float,
+            default=0.0,
+            help=f"Remove {name} regions shorter than that many seconds.",
+        )
+        parser.add_argument(
+            f"--{task}-min-duration-off",
+            type=float,
+            default=0.0,
+            help=f"Fill non-{name} regions shorter than that many seconds.",
+        )
+    parser.add_argument(
+        "--align-time",
+        default=None,
+        type=float,
+        help="If provided, make speech start and end times multiples of this value.",
+    )
+    parser.add_argument(
+        "--no-overlap",
+        action="store_true",
+        help="Do not assign second speakers in the detected overlap regions.",
+    )
+    parser.add_argument("--xvec-model", type=str, default="ResNet101")
+    parser.add_argument(
+        "--xvec-weights", type=str, required=True, help="x-vector model weights."
+    )
+    parser.add_argument("--xvec-model-file", type=str, default=None)
+    parser.add_argument(
+        "--xvec-backend", type=str, default="pytorch", choices=["pytorch", "onnx"]
+    )
+    parser.add_argument(
+        "--xvec-transform",
+        type=str,
+        required=True,
+        help="path to x-vector transformation h5 file (or to a model bundle directory "
+        "exported by model_bundle.py, in which case --plda-file is ignored)",
+    )
+    parser.add_argument(
+        "--plda-file",
+        type=str,
+        default=None,
+        help="File with PLDA model in Kaldi format (required for vbx; spectral "
+        "clustering uses cosine similarity without it)",
+    )
+    # VBx options (see vbx/vbhmm.py)
+    parser.add_argument(
+        "--init", type=str, default="AHC+VB", choices=["AHC", "AHC+VB", "random_5"]
+    )
+    parser.add_argument("--threshold", type=float, default=VBX_PARAMS["threshold"])
+    parser.add_argument("--lda-dim", type=int, default=VBX_PARAMS["lda_dim"])
+    parser.add_argument("--Fa", type=float, default=VBX_PARAMS["Fa"])
+    parser.add_argument("--Fb", type=float, default=VBX_PARAMS["Fb"])
+    parser.add_argument("--loopP", type=float, default=VBX_PARAMS["loopP"])
+    parser.add_argument(
+        "--init-smoothing", type=float, default=VBX_PARAMS["init_smoothing"]
+    )
+    parser.add_argument(
+        "--precision", type=str, default="float64", choices=["float32", "float64"]
+    )
+    # spectral clustering options (see spectral/sclust.py)
+    parser.add_argument("--min-neighbors", type=int, default=3)
+    parser.add_argument("--max-neighbors", type=int, default=20)
+    parser.add_argument("--num-speakers", type=int, default=None)
+    parser.add_argument(
+        "--affinity", type=str, default="dense", choices=["dense", "knn", "knn-faiss"]
+    )
+    parser.add_argument(
+        "--pre-vad",
+        action="store_true",
+        help="Run the segmentation model only on the regions that are not clearly "
+        "silent, according to a cheap energy/spectral flux gate (see energy_gate.py).",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=32,
+        help="Number of chunks (from one or more recordings) in each segmentation "
+        "model call.",
+    )
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument(
+        "--num-workers",
+        type=int,
+        default=1,
+        help="Number of worker processes; the recordings are split between them.",
+    )
+    parser.add_argument(
+        "--num-threads",
+        type=int,
+        default=None,
+        help="Number of threads per worker. By default, the cores are divided "
+        "between the workers.",
+    )
+    return parser.parse_args()
+
+
+def main(args, files):
+    if args.method == "vbx":
+        cluster_params = {
+            "init": args.init,
+            "threshold": args.threshold,
+            "lda_dim": args.lda_dim,
+            "Fa": args.Fa,
+            "Fb": args.Fb,
+            "loopP": args.loopP,
+            "init_smoothing": args.init_smoothing,
+        }
+    else:
+        cluster_params = {
+            "min_neighbors": args.min_neighbors,
+            "max_neighbors": args.max_neighbors,
+            "num_speakers": args.num_speakers,
+            "affinity": args.affinity,
+        }
+    pipeline = DiarizationPipeline(
+        args.xvec_weights,
+        args.xvec_transform,
+        plda_file=args.plda_file,
+        method=args.method,
+        segmentation_model=args.segmentation_model,
+        use_auth_token=args.use_auth_token,
+        xvec_model=args.xvec_model,
+        xvec_model_file=args.xvec_model_file,
+        xvec_backend=args.xvec_backend,
+        vad_params={
+            "onset": args.vad_onset,
+            "offset": args.vad_offset,
+            "min_duration_on": args.vad_min_duration_on,
+            "min_duration_off": args.vad_min_duration_off,
+        },
+        ovl_params={
+            "onset": args.ovl_onset,
+            "offset": args.ovl_offset,
+            "min_duration_on": args.ovl_min_duration_on,
+            "min_duration_off": args.ovl_min_duration_off,
+        },
+        cluster_params=cluster_params,
+        overlap_assignment=not args.no_overlap,
+        align_time=args.align_time,
+        pre_vad=args.pre_vad,
+        batch_size=args.batch_size,
+        device=args.device,
+        dtype=np.dtype(args.precision),
+        artifacts_dir=args.artifacts_dir,
+    )
+    for file_id, starts, ends, labels in pipeline.diarize_files(files):
+        print(file_id)
+        with open(os.path.join(args.out_rttm_dir, f"{file_id}.rttm"), "w") as fp:
+            write_rttm(fp, file_id, starts, ends, labels)
+
+
+if __name__ == "__main__":
+    args = get_args()
+    with open(args.file_list) as f:
+        files = find_audio_files(args.in_dir, [line.strip() for line in f])
+    mkdir_p(args.out_rttm_dir)
+
+    shards = split_list(
+        files, args.num_workers, weights=[os.path.getsize(f) for f in files]
+    )
+    run_sharded(partial(main, args), shards, args.num_threads)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+# @Authors: Desh Raj
+# @Emails: r.desh26@gmail.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Conversion of labeled x-vector subsegments (from sliding window diarization) into the
+# speaker segments written to RTTM files (see io_utils.write_rttm), shared by the
+# clustering scripts. The subsegments are given as arrays of start and end times and
+# labels, where the labels are either a vector of speaker ids, a sequence of lists of
+# speaker ids (for subsegments with overlap assignment) or an N x K multi-hot matrix.
+
+import itertools
+
+import numpy as np
+
+from diarizer.intervals import normalize
+
+
+def labels_to_multihot(labels):
+    """Converts the labels of N subsegments to an N x K boolean matrix.
+    Outputs:
+        multihot - N x K matrix, where multihot[i, k] is True if subsegment i has
+                   label values[k]
+        values   - array of the K label values (column ids for multi-hot input)
+    """
+    if isinstance(labels, np.ndarray) and labels.ndim == 2:
+        return labels.astype(bool), np.arange(labels.shape[1])
+    if isinstance(labels, np.ndarray) and labels.dtype != object:
+        values, cols = np.unique(labels, return_inverse=True)
+        multihot = np.zeros((len(labels), len(values)), dtype=bool)
+        multihot[np.arange(len(labels)), cols] = True
+        return multihot, values
+    labels = [label if np.ndim(label) else [label] for label in labels]
+    counts = np.fromiter(map(len, labels), dtype=int, count=len(labels))
+    values, cols = np.unique(list(itertools.chain(*labels)), return_inverse=True)
+    multihot = np.zeros((len(labels), len(values)), dtype=bool)
+    multihot[np.repeat(np.arange(len(labels)), counts), cols] = True
+    return multihot, values
+
+
+def make_contiguous(starts, ends, channels=None):
+    """Splits the overlap of consecutive subsegments (of the same channel) at its
+    midpoint, so that the subsegments become contiguous.
+    Input:
+        starts, ends - arrays of subsegment start and end times
+        channels     - optional array of channel ids; only subsegments of the same
+                       channel are split
+    Outputs:
+        starts, ends - new start and end times (in the order of the input)
+    """
+    starts = np.array(starts, dtype=float)
+    ends = np.array(ends, dtype=float)
+    if channels is None:
+        channels = np.zeros(len(starts), dtype=int)
+    else:
+        _, channels = np.unique(channels, return_inverse=True)
+    order = np.lexsort((starts, channels))
+    s, e, c = starts[order], ends[order], channels[order]
+    split = (c[:-1] == c[1:]) & (e[:-1] > s[1:])
+    mid = (s[1:] + e[:-1]) / 2
+    e[:-1][split] = mid[split]
+    s[1:][split] = mid[split]
+    starts[order], ends[order] = s, e
+    return starts, ends
+
+
+def merge_segments(starts, ends, labels):
+    """Merges overlapping or touching subsegments with the same label.
+    Input:
+        starts, ends - arrays of subsegment start and end times
+        labels       - labels of the subsegments (see labels_to_multihot)
+    Outputs:
+        starts, ends, labels - merged segments (one label per segment) sorted by start
+    """
+    starts = np.asarray(starts, dtype=float)
+    ends = np.asarray(ends, dtype=float)
+    multihot, values = labels_to_multihot(labels)
+    new_starts, new_ends, new_labels = [], [], []
+    for k, label in enumerate(values):
+        s, e = normalize(starts[multihot[:, k]], ends[multihot[:, k]])
+        new_starts.append(s)
+        new_ends.append(e)
+        new_labels.append(np.full(len(s), label))
+    if len(values) == 0:
+        return starts[:0], ends[:0], np.array([], dtype=int)
+    new_starts, new_ends = np.concatenate(new_starts), np.concatenate(new_ends)
+    new_labels = np.concatenate(new_labels)
+    order = np.argsort(new_starts, kind="stable")
+    return new_starts[order], new_ends[order], new_labels[order]
+
+
+def subsegments_to_segments(starts, ends, labels, channels=None):
+    """Makes the subsegments contiguous (see make_contiguous) and merges them into
+    speaker segments (see merge_segments). For multi-channel input, the segments of the
+    same speaker from different channels are merged too."""
+    starts, ends = make_contiguous(starts, ends, channels)
+    return merge_segments(starts, ends, labels)
+
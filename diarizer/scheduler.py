@@ -0,0 +1,407 @@
+#!/usr/bin/env python
+
+# @Authors: Desh Raj
+# @Emails: r.desh26@gmail.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Local job runner for the recipe stages, which can be used on a single machine instead
+# of the "one background job per recording, then wait" loops of the scripts (the
+# recipes themselves still use these loops). A stage command is run once per recording
+# with a bounded number of cores and memory in use: the cost of each job is estimated
+# from the duration of the recording and its speech coverage (from the VAD .lab files),
+# the most expensive jobs are started first (so that a long recording does not end up
+# running alone at the end), and a job is only started if its cores and estimated
+# memory fit in what is left. Failed jobs are retried (with twice the memory estimate,
+# since failures of large recordings are usually out-of-memory kills). The start, end
+# and exit status of every attempt are appended to a progress log. With --cache-dir, the
+# recordings whose outputs are already cached are skipped (see stage_cache.py).
+#
+# Usage (the command is given as separate arguments, in which {file_id}, {list} (a file
+# with the recording name, for the scripts that take a --file-list) and {threads} are
+# replaced; other braces are kept, and shell syntax needs e.g. bash -c '...'):
+#   python diarizer/scheduler.py --stage xvec --in-dir data/ami/dev/audios \
+#     --lab-dir exp/ami/dev/vad --log-dir exp/ami/dev/log/xvec --mem 2G --max-mem 32G -- \
+#     python diarizer/xvector/predict.py --in-file-list {list} ... \
+#     --out-ark-fn exp/ami/dev/xvec/{file_id}.ark --out-seg-fn exp/ami/dev/xvec/{file_id}.seg
+
+import argparse
+import os
+import shlex
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from diarizer.io_utils import read_lab
+from diarizer.parallel import THREAD_ENV_VARS
+from diarizer.stage_cache import StageCache
+
+STAGES = ["vad", "overlap", "xvec", "vbx", "spectral"]
+XVECTOR_SHIFT = 0.24  # seconds between x-vectors (24 frames)
+
+
+def parse_memory(mem):
+    """Converts a memory size such as '2G' or '500M' (as in queue.pl --mem) to bytes."""
+    units = {"K": 2 ** 10, "M": 2 ** 20, "G": 2 ** 30, "T": 2 ** 40}
+    mem = str(mem).strip().upper()
+    if mem and mem[-1] in units:
+        return int(float(mem[:-1]) * units[mem[-1]])
+    return int(float(mem))
+
+
+def format_memory(mem):
+    return f"{mem / 2 ** 30:.1f}G"
+
+
+def total_memory():
+    """Physical memory of the machine in bytes (None if it is not known)."""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def estimate_cost(stage, duration, speech):
+    """
+    Estimates the relative run time and the extra memory (in bytes) of a stage for a
+    recording.
+    Input:
+        stage    - one of STAGES
+        duration - duration of the recording in seconds
+        speech   - duration of the speech regions in seconds
+    Outputs:
+        cost, mem - the detectors scale with the duration and the x-vector extraction
+                    with the speech; clustering scales with the square of the number
+                    of x-vectors, and so does the memory of its similarity matrices
+    """
+    if stage in ("vad", "overlap"):
+        return duration, 0
+    if stage == "xvec":
+        return speech, 0
+    num_xvectors = speech / XVECTOR_SHIFT
+    # a float64 score matrix and the condensed distances of the AHC
+    return num_xvectors ** 2, 12 * num_xvectors ** 2
+
+
+class Job:
+    def __init__(
+        self, name, command, cost=1.0, cores=1, mem=0, log=None, key=None, outputs=()
+    ):
+        self.name = name
+        self.command = command
+        self.cost = cost
+        self.cores = cores
+        self.mem = mem
+        self.log = log
+        # cache key and output files of the job (see stage_cache.py)
+        self.key = key
+        self.outputs = outputs
+        self.attempts = 0
+        self.returncode = None
+
+
+class LocalScheduler:
+    """Runs shell commands (Jobs) in parallel with at most 'max_cores' cores and
+    'max_mem' bytes of estimated memory in use, starting the most expensive jobs first.
+    A job that needs more than the limits on its own is run when nothing else is
+    running. With a StageCache, the jobs whose key is in the cache are not run (their
+    outputs are restored), and the outputs of the successful jobs are cached."""
+
+    def __init__(
+        self,
+        max_cores=None,
+        max_mem=None,
+        max_retries=1,
+        progress_log=None,
+        poll_interval=0.5,
+        cache=None,
+    ):
+        self.max_cores = max_cores or os.cpu_count()
+        self.max_mem = max_mem if max_mem is not None else total_memory()
+        self.max_retries = max_retries
+        self.progress_log = progress_log
+        self.poll_interval = poll_interval
+        self.cache = cache
+
+    def _record(self, job, event, **info):
+        line = " ".join(
+            [time.strftime("%Y-%m-%d %H:%M:%S"), job.name, event]
+            + [f"{key}={value}" for key, value in info.items()]
+        )
+        print(line, file=sys.stderr)
+        if self.progress_log is not None:
+            with open(self.progress_log, "a") as f:
+                f.write(line + "\n")
+
+    def _fits(self, job, cores, mem):
+        if not cores:
+            return True  # nothing is running
+        if cores + job.cores > self.max_cores:
+            return False
+        return self.max_mem is None or mem + job.mem <= self.max_mem
+
+    def _start(self, job):
+        env = dict(os.environ)
+        env.update({var: str(job.cores) for var in THREAD_ENV_VARS})
+        job.attempts += 1
+        self._record(
+            job,
+            "start",
+            attempt=job.attempts,
+            cores=job.cores,
+            mem=format_memory(job.mem),
+        )
+        log = open(job.log, "a") if job.log is not None else subprocess.DEVNULL
+        process = subprocess.Popen(
+            job.command, shell=True, env=env, stdout=log, stderr=subprocess.STDOUT
+        )
+        if job.log is not None:
+            log.close()
+        return process
+
+    def run(self, jobs):
+        """Runs the jobs and returns the list of jobs that failed (after retries)."""
+        if self.cache is not None:
+            cached = [
+                job
+                for job in jobs
+                if job.key is not None and self.cache.fetch(job.key, job.outputs)
+            ]
+            for job in cached:
+                self._record(job, "cached", key=job.key[:12])
+            jobs = [job for job in jobs if job not in cached]
+        queue = sorted(jobs, key=lambda job: -job.cost)
+        running = {}  # process -> (job, start time)
+        failed = []
+        cores, mem = 0, 0
+        while queue or running:
+            # start the most expensive jobs that fit
+            for job in list(queue):
+                if self._fits(job, cores, mem):
+                    queue.remove(job)
+                    running[self._start(job)] = (job, time.time())
+                    cores += job.cores
+                    mem += job.mem
+            time.sleep(self.poll_interval)
+            for process in [p for p in running if p.poll() is not None]:
+                job, start_time = running.pop(process)
+                cores -= job.cores
+                mem -= job.mem
+                job.returncode = process.returncode
+                elapsed = f"{time.time() - start_time:.1f}s"
+                if job.returncode == 0:
+                    self._record(job, "done", attempt=job.attempts, elapsed=elapsed)
+                    if self.cache is not None and job.key is not None:
+                        if not self.cache.store(job.key, job.outputs):
+                            self._record(job, "not_cached", reason="missing_outputs")
+                elif job.attempts <= self.max_retries:
+                    self._record(
+                        job, "retry", returncode=job.returncode, elapsed=elapsed
+                    )
+                    job.mem *= 2
+                    # retried jobs keep their place in the (cost ordered) queue
+                    queue.append(job)
+                    queue.sort(key=lambda job: -job.cost)
+                else:
+                    self._record(
+                        job, "failed", returncode=job.returncode, elapsed=elapsed
+                    )
+                    failed.append(job)
+        return failed
+
+
+def fill_template(template, **values):
+    """Replaces the {name} placeholders of the given names in a string (unlike
+    str.format, other braces, e.g. of awk programs, are kept as they are)."""
+    for name, value in values.items():
+        template = template.replace(f"{{{name}}}", str(value))
+    return template
+
+
+def get_duration(path):
+    import soundfile as sf
+
+    return sf.info(str(path)).duration
+
+
+def get_speech_duration(lab_file):
+    labs = read_lab(lab_file)
+    return float((labs["end"] - labs["start"]).sum())
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Run a stage command for each recording with bounded resources."
+    )
+    parser.add_argument(
+        "--stage",
+        type=str,
+        required=True,
+        choices=STAGES,
+        help="Stage run by the command (used to estimate the cost of the jobs).",
+    )
+    parser.add_argument(
+        "--in-dir", type=str, required=True, help="Directory with the wav files."
+    )
+    parser.add_argument(
+        "--file-list",
+        type=str,
+        default=None,
+        help="List of recordings to process (by default, all the wav files).",
+    )
+    parser.add_argument(
+        "--lab-dir",
+        type=str,
+        default=None,
+        help="Directory with the VAD .lab files, used to estimate the cost of the "
+        "x-vector extraction and clustering jobs (the whole recording is assumed to "
+        "be speech otherwise).",
+    )
+    parser.add_argument(
+        "--log-dir",
+        type=str,
+        required=True,
+        help="Directory for the job logs (<stage>_<file_id>.log) and the progress log.",
+    )
+    parser.add_argument(
+        "--num-threads", type=int, default=1, help="Number of cores used by each job."
+    )
+    parser.add_argument(
+        "--mem", type=str, default="2G", help="Memory used by each job (e.g. 2G)."
+    )
+    parser.add_argument(
+        "--max-cores",
+        type=int,
+        default=None,
+        help="Maximum number of cores in use (by default, all the cores).",
+    )
+    parser.add_argument(
+        "--max-mem",
+        type=str,
+        default=None,
+        help="Maximum estimated memory in use (by default, the physical memory).",
+    )
+    parser.add_argument(
+        "--max-retries",
+        type=int,
+        default=1,
+        help="Number of times a failed job is run again.",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default=None,
+        help="If provided, skip the recordings whose outputs are cached for the same "
+        "command and inputs, and cache the new outputs (see stage_cache.py).",
+    )
+    parser.add_argument(
+        "--inputs",
+        type=str,
+        nargs="*",
+        default=[],
+        help="Input file templates (with {file_id}) of the jobs, for the cache.",
+    )
+    parser.add_argument(
+        "--outputs",
+        type=str,
+        nargs="*",
+        default=[],
+        help="Output file templates (with {file_id}) of the jobs, for the cache.",
+    )
+    parser.add_argument(
+        "--deps",
+        type=str,
+        nargs="*",
+        default=[],
+        help="Other files or directories the outputs depend on, for the cache.",
+    )
+    parser.add_argument(
+        "command",
+        nargs=argparse.REMAINDER,
+        help="Command template, with {file_id}, {list} and {threads} placeholders.",
+    )
+    args = parser.parse_args()
+    if args.command and args.command[0] == "--":
+        args.command = args.command[1:]
+    if not args.command:
+        parser.error("no command given")
+    if args.cache_dir is not None and not args.outputs:
+        parser.error("--cache-dir requires --outputs")
+    return args
+
+
+if __name__ == "__main__":
+    args = get_args()
+    in_dir, log_dir = Path(args.in_dir), Path(args.log_dir)
+    list_dir = log_dir / "lists"
+    list_dir.mkdir(exist_ok=True, parents=True)
+    if args.file_list is not None:
+        with open(args.file_list) as f:
+            file_ids = [line.strip() for line in f if line.strip()]
+    else:
+        file_ids = sorted(path.stem for path in in_dir.glob("*.wav"))
+
+    base_mem = parse_memory(args.mem)
+    cache = StageCache(args.cache_dir) if args.cache_dir is not None else None
+    jobs = []
+    for file_id in file_ids:
+        duration = get_duration(in_dir / f"{file_id}.wav")
+        speech = duration
+        if args.lab_dir is not None:
+            lab_file = Path(args.lab_dir) / f"{file_id}.lab"
+            if lab_file.exists():
+                speech = get_speech_duration(lab_file)
+        cost, mem = estimate_cost(args.stage, duration, speech)
+        list_file = list_dir / f"{file_id}.txt"
+        list_file.write_text(f"{file_id}\n")
+        values = {"file_id": file_id, "list": list_file, "threads": args.num_threads}
+        job_args = [fill_template(arg, **values) for arg in args.command]
+        job_command = " ".join(shlex.quote(arg) for arg in job_args)
+        outputs = [fill_template(path, file_id=file_id) for path in args.outputs]
+        key = None
+        if cache is not None:
+            inputs = [fill_template(path, file_id=file_id) for path in args.inputs]
+            # the arguments, not the quoted command, so that files with spaces or
+            # shell special characters in their names are found
+            key = cache.key(job_args, inputs, outputs, args.deps)
+        jobs.append(
+            Job(
+                file_id,
+                job_command,
+                cost=cost,
+                cores=args.num_threads,
+                mem=base_mem + mem,
+                log=log_dir / f"{args.stage}_{file_id}.log",
+                key=key,
+                outputs=outputs,
+            )
+        )
+    if cache is not None:
+        cache.save_hashes()
+
+    scheduler = LocalScheduler(
+        max_cores=args.max_cores,
+        max_mem=parse_memory(args.max_mem) if args.max_mem is not None else None,
+        max_retries=args.max_retries,
+        progress_log=log_dir / "progress.log",
+        cache=cache,
+    )
+    failed = scheduler.run(jobs)
+    if failed:
+        print(
+            f"{len(failed)} of {len(jobs)} jobs failed: "
+            + " ".join(job.name for job in failed),
+            file=sys.stderr,
+        )
+        sys.exit(1)
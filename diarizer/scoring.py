@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+
+# @Authors: Desh Raj
+# @Emails: r.desh26@gmail.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# In-process diarization scoring: DER (missed speech, false alarm and speaker confusion)
+# and JER, from reference and hypothesis RTTM files or segment arrays, without writing
+# concatenated RTTMs for md-eval.pl/spyder.
+#
+# The speaker activities are converted to frame-level matrices (frames x speakers), so
+# overlapping speech is scored as in md-eval.pl:
+# - the scored region of a recording goes from its first to its last reference segment
+#   (as md-eval.pl without a UEM file), minus +/- collar seconds around the boundaries
+#   of the reference segments,
+# - reference and hypothesis speakers are mapped one-to-one so that their total
+#   overlap (before applying the collars) is maximal,
+# - in each frame with N_ref reference and N_hyp hypothesis speakers, of which N_corr
+#   are mapped to each other, the errors are max(N_ref - N_hyp, 0) (missed),
+#   max(N_hyp - N_ref, 0) (false alarm) and min(N_ref, N_hyp) - N_corr (confusion).
+# JER is computed as in dscore: 1 - intersection / union of the activities of each
+# reference speaker and of the hypothesis speaker it is mapped to (by minimizing the
+# total JER), averaged over the reference speakers (unmapped ones count as 1). It is
+# computed before applying the collars.
+# With times given in milliseconds (as in the rttm/*.tar.gz outputs), --frame-rate 1000
+# gives the md-eval.pl numbers up to rounding.
+#
+# Usage:
+#   python diarizer/scoring.py --ref-rttm exp/ref.rttm \
+#     --hyp-rttm exp/ami/dev/vbx/*.rttm --collar 0.25 --per-file --nj 4
+
+import argparse
+from multiprocessing import Pool
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+from diarizer.diarization_lib import segment_to_frame_labels
+from diarizer.intervals import normalize
+from diarizer.io_utils import group_by_recording, read_rttm
+
+
+def speaker_activity(starts, ends, labels, length, frame_rate=100.0):
+    """
+    Frame-level activities of the speakers of a recording.
+    Input:
+        starts, ends, labels - speaker segments (in seconds); the segments of a speaker
+                               may overlap
+        length               - number of frames
+    Outputs:
+        speakers - sorted speaker labels
+        activity - boolean matrix (frames x speakers)
+    """
+    speakers, label_ids = np.unique(np.asarray(labels), return_inverse=True)
+    starts, ends = np.asarray(starts, dtype=float), np.asarray(ends, dtype=float)
+    activity = np.zeros((length, len(speakers)), dtype=bool)
+    for i in range(len(speakers)):
+        spk_starts, spk_ends = normalize(starts[label_ids == i], ends[label_ids == i])
+        spk_starts = np.maximum(spk_starts, 0)
+        activity[:, i] = segment_to_frame_labels(
+            spk_starts,
+            spk_ends,
+            np.ones(len(spk_starts), dtype=bool),
+            length,
+            frame_rate,
+            False,
+        )
+    return speakers, activity
+
+
+def _region_mask(starts, ends, length, frame_rate):
+    starts, ends = normalize(np.maximum(starts, 0), ends)
+    return segment_to_frame_labels(
+        starts, ends, np.ones(len(starts), dtype=bool), length, frame_rate, False
+    ).astype(bool)
+
+
+def score_recording(ref_segments, hyp_segments, collar=0.0, frame_rate=100.0):
+    """
+    Diarization errors of one recording.
+    Input:
+        ref_segments - tuple (starts, ends, labels) of reference speaker segments
+        hyp_segments - tuple (starts, ends, labels) of hypothesis speaker segments
+        collar       - no-score collar (in seconds) around reference segment boundaries
+        frame_rate   - frame rate (in frames per second) used for the scoring
+    Outputs:
+        errors - array with the scored reference speaker time, missed speaker time,
+                 false alarm time and confusion time (in seconds)
+        jers   - JER of each reference speaker
+    """
+    ref_starts, ref_ends, _ = (np.asarray(a) for a in ref_segments)
+    hyp_ends = np.asarray(hyp_segments[1], dtype=float)
+    if len(ref_starts) == 0:
+        return np.zeros(4), np.zeros(0)
+    end_time = max(ref_ends.max(), hyp_ends.max(initial=0))
+    length = int(np.rint(frame_rate * end_time))
+    _, ref = speaker_activity(*ref_segments, length, frame_rate)
+    _, hyp = speaker_activity(*hyp_segments, length, frame_rate)
+
+    # evaluated region, and scored region without the collars
+    evaluated = _region_mask(
+        ref_starts.min(keepdims=True), ref_ends.max(keepdims=True), length, frame_rate
+    )
+    ref, hyp = ref[evaluated], hyp[evaluated]
+    scored = np.ones(len(ref), dtype=bool)
+    if collar > 0:
+        boundaries = np.r_[ref_starts, ref_ends]
+        no_score = _region_mask(
+            boundaries - collar, boundaries + collar, length, frame_rate
+        )
+        scored = ~no_score[evaluated]
+
+    # speaker mapping maximizing the overlap
+    overlap = ref.T.astype(np.float64) @ hyp
+    ref_ids, hyp_ids = linear_sum_assignment(overlap, maximize=True)
+    jers = jaccard_error(overlap, ref.sum(axis=0), hyp.sum(axis=0))
+
+    ref, hyp = ref[scored], hyp[scored]
+    num_ref = ref.sum(axis=1)
+    num_hyp = hyp.sum(axis=1)
+    num_correct = (ref[:, ref_ids] & hyp[:, hyp_ids]).sum(axis=1)
+    errors = np.array(
+        [
+            num_ref.sum(),
+            np.maximum(num_ref - num_hyp, 0).sum(),
+            np.maximum(num_hyp - num_ref, 0).sum(),
+            (np.minimum(num_ref, num_hyp) - num_correct).sum(),
+        ]
+    )
+    return errors / frame_rate, jers
+
+
+def jaccard_error(overlap, ref_time, hyp_time):
+    """
+    Jaccard error of each reference speaker (with some activity) given the overlap
+    matrix (reference x hypothesis speakers) and the total activity of the speakers.
+    """
+    overlap = overlap[ref_time > 0]
+    ref_time = ref_time[ref_time > 0]
+    jers = np.ones(len(ref_time))
+    if len(hyp_time) == 0:
+        return jers
+    union = ref_time[:, np.newaxis] + hyp_time[np.newaxis, :] - overlap
+    cost = 1 - overlap / union
+    ref_ids, hyp_ids = linear_sum_assignment(cost)
+    jers[ref_ids] = cost[ref_ids, hyp_ids]
+    return jers
+
+
+def _score_task(task):
+    name, ref_segments, hyp_segments, collar, frame_rate = task
+    return name, score_recording(ref_segments, hyp_segments, collar, frame_rate)
+
+
+def score_recordings(refs, hyps, collar=0.0, frame_rate=100.0, nj=1):
+    """
+    Scores the recordings of the reference (recordings missing from the hypothesis have
+    no hypothesis speech, those missing from the reference are not scored).
+    Input:
+        refs, hyps - dict recording -> (starts, ends, labels)
+        nj         - number of processes (recordings are scored in parallel)
+    Outputs:
+        dict recording -> (errors, jers) (see score_recording)
+    """
+    empty = (np.zeros(0), np.zeros(0), np.zeros(0))
+    # the longest recordings first, for a better load balance
+    names = sorted(refs, key=lambda name: -np.max(refs[name][1], initial=0))
+    tasks = [
+        (name, refs[name], hyps.get(name, empty), collar, frame_rate) for name in names
+    ]
+    if nj > 1 and len(tasks) > 1:
+        with Pool(min(nj, len(tasks))) as pool:
+            return dict(pool.imap_unordered(_score_task, tasks))
+    return dict(map(_score_task, tasks))
+
+
+def error_rates(errors, jers):
+    """Returns missed speech, false alarm, confusion, DER and JER in percent from the
+    errors and JERs of score_recording (or their concatenation over recordings)."""
+    scored, miss, fa, conf = errors
+    rates = 100 * np.array([miss, fa, conf, miss + fa + conf]) / max(scored, 1e-6)
+    jer = 100 * np.mean(jers) if len(jers) > 0 else 0.0
+    return np.r_[rates, jer]
+
+
+def total_error_rates(results):
+    """Error rates (see error_rates) over all the recordings of score_recordings."""
+    errors = sum((errors for errors, _ in results.values()), np.zeros(4))
+    jers = np.concatenate([np.zeros(0)] + [jers for _, jers in results.values()])
+    return error_rates(errors, jers)
+
+
+def rttm_segments(rttm_files):
+    """Returns a dict recording -> (starts, ends, speakers) from RTTM file(s)."""
+    return {
+        name: (segs["start"], segs["end"], segs["speaker"])
+        for name, segs in group_by_recording(read_rttm(rttm_files)).items()
+    }
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Compute DER and JER of hypothesis RTTM files."
+    )
+    parser.add_argument(
+        "--ref-rttm", type=str, nargs="+", required=True, help="Reference RTTM file(s)."
+    )
+    parser.add_argument(
+        "--hyp-rttm",
+        type=str,
+        nargs="+",
+        required=True,
+        help="Hypothesis RTTM file(s).",
+    )
+    parser.add_argument(
+        "--collar",
+        type=float,
+        default=0.0,
+        help="No-score collar (in seconds) around reference segment boundaries.",
+    )
+    parser.add_argument(
+        "--frame-rate",
+        type=float,
+        default=100.0,
+        help="Frame rate (in frames per second) used for the scoring.",
+    )
+    parser.add_argument(
+        "--per-file", action="store_true", help="Also print the errors of each file."
+    )
+    parser.add_argument(
+        "--nj", type=int, default=1, help="Number of processes used for the scoring."
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    refs = rttm_segments(args.ref_rttm)
+    hyps = rttm_segments(args.hyp_rttm)
+    results = score_recordings(refs, hyps, args.collar, args.frame_rate, args.nj)
+
+    print(f"{'Recording':<24}{'MS':>8}{'FA':>8}{'Conf.':>8}{'DER':>8}{'JER':>8}")
+    rows = []
+    if args.per_file:
+        rows = [(name, error_rates(*results[name])) for name in sorted(results)]
+    rows.append(("Overall", total_error_rates(results)))
+    for name, rates in rows:
+        print(f"{name:<24}" + "".join(f"{rate:>8.2f}" for rate in rates))
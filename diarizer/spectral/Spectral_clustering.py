@@ -1,33 +1,73 @@
+import itertools
+
 import numpy as np
 import scipy
-from sklearn.cluster import SpectralClustering
+import scipy.sparse
+from sklearn.cluster import KMeans
 
 # NME low-level operations
 # These functions are taken from the Kaldi scripts.
 
+# Returns indices of the p_max largest elements in each row sorted in descending order.
+# The ranking is computed once and sliced for all the p <= p_max in the NME sweep.
+# X_dist can also be a sparse matrix (e.g. from diarization_lib.knn_graph), in which
+# case only the stored elements are ranked.
+def get_kneighbors_ranking(X_dist, p_max):
+    if scipy.sparse.issparse(X_dist):
+        return get_kneighbors_ranking_sparse(X_dist, p_max)
+    N, M = X_dist.shape
+    p_max = min(p_max, M)
+    if p_max < M:
+        top = np.argpartition(-X_dist, p_max - 1, axis=1)[:, :p_max]
+    else:
+        top = np.tile(np.arange(M), (N, 1))
+    order = np.argsort(-np.take_along_axis(X_dist, top, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(top, order, axis=1)
+
+
+def get_kneighbors_ranking_sparse(X_dist, p_max):
+    X_dist = scipy.sparse.csr_matrix(X_dist)
+    N = X_dist.shape[0]
+    nnz = np.diff(X_dist.indptr)
+    p_max = min(p_max, X_dist.shape[1])
+    if nnz.min(initial=p_max) < p_max:
+        raise ValueError(
+            f"Expecting at least {p_max} stored elements in each row of the affinity "
+            f"matrix, got {nnz.min()}. Build the graph with more neighbours."
+        )
+    rows = np.repeat(np.arange(N), nnz)
+    # sort the stored elements by row and by decreasing value within each row
+    order = np.lexsort((-X_dist.data, rows))
+    pos = np.arange(len(order)) - X_dist.indptr[rows]
+    return X_dist.indices[order][pos < p_max].reshape(N, p_max)
+
+
 # Prepares binarized(0/1) affinity matrix with p_neighbors non-zero elements in each row
-def get_kneighbors_conn(X_dist, p_neighbors):
-    X_dist_out = np.zeros_like(X_dist)
-    for i, line in enumerate(X_dist):
-        sorted_idx = np.argsort(line)
-        sorted_idx = sorted_idx[::-1]
-        indices = sorted_idx[:p_neighbors]
-        X_dist_out[indices, i] = 1
+def get_kneighbors_conn(X_dist, p_neighbors, ranking=None):
+    if ranking is None:
+        ranking = get_kneighbors_ranking(X_dist, p_neighbors)
+    N = ranking.shape[0]
+    indices = ranking[:, :p_neighbors]
+    # the neighbours of the i-th embedding are stored in the i-th column
+    rows = indices.ravel()
+    cols = np.repeat(np.arange(N), indices.shape[1])
+    X_dist_out = scipy.sparse.csr_matrix(
+        (np.ones(len(rows)), (rows, cols)), shape=(N, N)
+    )
     return X_dist_out
 
 
 # Thresolds affinity matrix to leave p maximum non-zero elements in each row
 def Threshold(A, p):
-    N = A.shape[0]
-    Ap = np.zeros((N, N))
-    for i in range(N):
-        thr = sorted(A[i, :], reverse=True)[p]
-        Ap[i, A[i, :] > thr] = A[i, A[i, :] > thr]
-    return Ap
+    thr = -np.partition(-A, p, axis=1)[:, p : p + 1]
+    return scipy.sparse.csr_matrix(np.where(A > thr, A, 0.0))
 
 
-# Computes Laplacian of a matrix
+# Computes Laplacian of a (dense or sparse) matrix
 def Laplacian(A):
+    if scipy.sparse.issparse(A):
+        d = np.asarray(A.sum(axis=1)).ravel() - A.diagonal()
+        return (scipy.sparse.diags(d) - A).tocsr()
     d = np.sum(A, axis=1) - np.diag(A)
     D = np.diag(d)
     return D - A
@@ -40,13 +80,15 @@ def Eigengap(S):
 
 
 # Computes parameters of normalized eigenmaps for automatic thresholding selection
-def ComputeNMEParameters(A, p, max_num_clusters):
+def ComputeNMEParameters(A, p, max_num_clusters, ranking=None):
     # p-Neighbour binarization
-    Ap = get_kneighbors_conn(A, p)
+    Ap = get_kneighbors_conn(A, p, ranking)
     # Symmetrization
     Ap = (Ap + np.transpose(Ap)) / 2
     # Laplacian matrix computation
     Lp = Laplacian(Ap)
+    # fixed starting vector, so that the results do not change between runs
+    v0 = np.random.RandomState(0).uniform(-1, 1, Lp.shape[0])
     # Get max_num_clusters+1 smallest eigenvalues
     S = scipy.sparse.linalg.eigsh(
         Lp,
@@ -55,10 +97,17 @@ def ComputeNMEParameters(A, p, max_num_clusters):
         tol=1e-6,
         return_eigenvectors=False,
         mode="buckling",
+        v0=v0,
     )
     # Get largest eigenvalue
     Smax = scipy.sparse.linalg.eigsh(
-        Lp, k=1, which="LA", tol=1e-6, return_eigenvectors=False, mode="buckling"
+        Lp,
+        k=1,
+        which="LA",
+        tol=1e-6,
+        return_eigenvectors=False,
+        mode="buckling",
+        v0=v0,
     )
     # Eigengap computation
     e = Eigengap(S)
@@ -68,6 +117,34 @@ def ComputeNMEParameters(A, p, max_num_clusters):
     return (e, g, k, r)
 
 
+# NME sweep over p = pmin..pmax. Returns list of (p, (e, g, k, r)) tuples. The ranking
+# is shared by all the p values; with nj > 1, the p values are processed in parallel.
+def NME_Sweep(A, pmin, pmax, max_num_clusters, ranking=None, nj=1):
+    if ranking is None:
+        ranking = get_kneighbors_ranking(A, pmax)
+    ps = list(range(pmin, pmax + 1))
+    # the affinity matrix is not needed given the ranking (and is not sent to workers)
+    tasks = [(None, p, max_num_clusters, ranking) for p in ps]
+    if nj <= 1:
+        return list(zip(ps, itertools.starmap(ComputeNMEParameters, tasks)))
+
+    from multiprocessing import Pool
+
+    with Pool(min(nj, len(tasks))) as pool:
+        return list(zip(ps, pool.starmap(ComputeNMEParameters, tasks)))
+
+
+# Selects the p value with the lowest ratio r = p/g in NME sweep results (the first one
+# in case of ties) and the number of clusters (if not given) from its eigengap.
+# Returns (pbest, num_clusters).
+def NME_SelectBest(results, num_clusters=None):
+    pbest, (_, _, kbest, _) = min(results, key=lambda result: result[1][3])
+    num_clusters = num_clusters if num_clusters is not None else (kbest + 1)
+    # Handle some edge cases in AMI SDM
+    num_clusters = 4 if num_clusters == 1 else num_clusters
+    return pbest, num_clusters
+
+
 """
 Performs spectral clustering with Normalized Maximum Eigengap (NME)
 Parameters:
@@ -76,37 +153,110 @@ Parameters:
    max_num_clusters: maximum allowed number of clusters to generate
    pmax: maximum count for matrix binarization (should be at least 2)
    pbest: best count for matrix binarization (if 0, determined automatically)
+   nj: number of processes used for the NME sweep over p
 Returns: cluster assignments for every speaker embedding   
 """
 
 
 def NME_SpectralClustering(
-    A, OLVec, num_clusters=None, max_num_clusters=10, pbest=0, pmin=3, pmax=20
+    A, OLVec, num_clusters=None, max_num_clusters=10, pbest=0, pmin=3, pmax=20, nj=1
 ):
+    # rank the neighbours only once for all the p values
+    ranking = get_kneighbors_ranking(A, max(pmax, pbest))
     if pbest == 0:
         print("Selecting best number of neighbors for affinity matrix thresolding:")
-        rbest = None
-        kbest = None
-        for p in range(pmin, pmax + 1):
-            e, g, k, r = ComputeNMEParameters(A, p, max_num_clusters)
+        results = NME_Sweep(A, pmin, pmax, max_num_clusters, ranking, nj)
+        for p, (e, g, k, r) in results:
             print("p={}, g={}, k={}, r={}, e={}".format(p, g, k, r, e))
-            if rbest is None or rbest > r:
-                rbest = r
-                pbest = p
-                kbest = k
+        pbest, num_clusters = NME_SelectBest(results, num_clusters)
         print("Best number of neighbors is {}".format(pbest))
-        num_clusters = num_clusters if num_clusters is not None else (kbest + 1)
-        # Handle some edge cases in AMI SDM
-        num_clusters = 4 if num_clusters == 1 else num_clusters
-        return NME_SpectralClustering_sklearn(
-            A, OLVec, num_clusters, pbest
-        )
+        return NME_SpectralClustering_fixed(A, OLVec, num_clusters, pbest, ranking)
     if num_clusters is None:
         print("Compute number of clusters to generate:")
-        e, g, k, r = ComputeNMEParameters(A, pbest, max_num_clusters)
+        [(_, (e, g, k, r))] = NME_Sweep(A, pbest, pbest, max_num_clusters, ranking)
         print("Number of clusters to generate is {}".format(k + 1))
-        return NME_SpectralClustering_sklearn(A, OLVec, k + 1, pbest)
-    return NME_SpectralClustering_sklearn(A, OLVec, num_clusters, pbest)
+        return NME_SpectralClustering_fixed(A, OLVec, k + 1, pbest, ranking)
+    return NME_SpectralClustering_fixed(A, OLVec, num_clusters, pbest, ranking)
+
+
+# Computes spectral embedding of a (sparse) affinity matrix, i.e. eigenvectors of the
+# normalized Laplacian for the n_components smallest eigenvalues scaled by the inverse
+# square roots of the degrees (as sklearn.manifold.spectral_embedding)
+def SpectralEmbedding(Ap, n_components):
+    Ap = scipy.sparse.csr_matrix(Ap, copy=True)
+    Ap.setdiag(0)
+    Ap.eliminate_zeros()
+    d = np.asarray(Ap.sum(axis=1)).ravel()
+    dd = np.sqrt(np.where(d > 0, d, 1.0))
+    # the smallest eigenvalues of the normalized Laplacian I - D^-1/2 A D^-1/2 are the
+    # largest ones of D^-1/2 A D^-1/2, which ARPACK finds fast
+    An = scipy.sparse.diags(1.0 / dd) @ Ap @ scipy.sparse.diags(1.0 / dd)
+    N = An.shape[0]
+    if N <= n_components + 1:
+        _, X = scipy.linalg.eigh(An.toarray())
+        X = X[:, N - n_components :]
+    else:
+        v0 = np.random.RandomState(0).uniform(-1, 1, N)
+        _, X = scipy.sparse.linalg.eigsh(An, k=n_components, which="LA", tol=0, v0=v0)
+    X = X[:, ::-1] / dd[:, np.newaxis]
+    # deterministic sign of the eigenvectors
+    signs = np.sign(X[np.abs(X).argmax(axis=0), range(X.shape[1])])
+    return X * signs
+
+
+# Discretizes spectral embedding into cluster assignments by searching for the rotation
+# closest to a discrete partition (Yu and Shi, Multiclass spectral clustering, 2003),
+# as sklearn.cluster.SpectralClustering(assign_labels="discretize"). Embeddings marked
+# in OLVec (overlap segments) are assigned to their 2 best clusters.
+# Returns array of labels, where the labels of overlap segments are [label1, label2].
+def Discretize(vectors, OLVec=None, max_svd_restarts=30, n_iter_max=20, random_state=0):
+    rng = np.random.RandomState(random_state)
+    eps = np.finfo(float).eps
+    n_samples, n_components = vectors.shape
+    overlap = (
+        np.zeros(n_samples, dtype=bool)
+        if OLVec is None or n_components < 2
+        else np.asarray(OLVec) == 1
+    )
+    # rows of the discrete indicator matrix with 1 or 2 non-zero elements
+    rows = np.r_[np.arange(n_samples), np.nonzero(overlap)[0]]
+
+    vectors = vectors / np.linalg.norm(vectors, axis=0) * np.sqrt(n_samples)
+    vectors *= np.where(vectors[0] != 0, -np.sign(vectors[0]), 1.0)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + eps
+
+    for _ in range(max_svd_restarts):
+        # initialize rotation with the most orthogonal embeddings
+        rotation = np.zeros((n_components, n_components))
+        rotation[:, 0] = vectors[rng.randint(n_samples)]
+        c = np.zeros(n_samples)
+        for j in range(1, n_components):
+            c += np.abs(vectors.dot(rotation[:, j - 1]))
+            rotation[:, j] = vectors[c.argmin()]
+
+        last_objective_value = 0.0
+        for n_iter in range(n_iter_max + 1):
+            t_discrete = vectors.dot(rotation)
+            top2 = np.argsort(-t_discrete, axis=1)[:, :2]
+            cols = np.r_[top2[:, 0], top2[overlap, 1]]
+            vectors_discrete = scipy.sparse.csr_matrix(
+                (np.ones(len(rows)), (rows, cols)), shape=(n_samples, n_components)
+            )
+            try:
+                U, S, Vh = np.linalg.svd(vectors_discrete.T @ vectors)
+            except np.linalg.LinAlgError:
+                print("SVD did not converge, randomizing and trying again")
+                break
+            ncut_value = 2.0 * (n_samples - S.sum())
+            if abs(ncut_value - last_objective_value) < eps or n_iter == n_iter_max:
+                labels = np.empty(n_samples, dtype=object)
+                labels[:] = list(top2[:, 0])
+                for i in np.nonzero(overlap)[0]:
+                    labels[i] = list(top2[i])
+                return labels
+            last_objective_value = ncut_value
+            rotation = Vh.T.dot(U.T)
+    raise np.linalg.LinAlgError("SVD did not converge")
 
 
 """
@@ -116,26 +266,135 @@ Parameters:
    OLVec: 0/1 vector denoting which segments are overlap segments
    num_clusters: number of clusters to generate
    pbest: best count for matrix binarization
-Returns: cluster assignments for every speaker embedding   
+   ranking: neighbours of each embedding as returned by get_kneighbors_ranking (optional)
+Returns: cluster assignments for every speaker embedding (pairs of cluster assignments
+   for the overlap segments)
 """
 
 
-def NME_SpectralClustering_sklearn(A, OLVec, num_clusters, pbest):
+def NME_SpectralClustering_fixed(A, OLVec, num_clusters, pbest, ranking=None):
     print("Number of speakers is {}".format(num_clusters))
     # Ap = Threshold(A, pbest)
-    Ap = get_kneighbors_conn(A, pbest)  # thresholded and binarized
-    Ap = (Ap + np.transpose(Ap)) / 2
+    Ap = get_kneighbors_conn(A, pbest, ranking)  # thresholded and binarized
+    Ap = (Ap + Ap.T) / 2
+    maps = SpectralEmbedding(Ap, num_clusters)
     if OLVec is not None:
-        model = SpectralClustering(
-            n_clusters=num_clusters,
-            affinity="precomputed",
-            random_state=0,
-            assign_labels="discretize_ol",
-            overlap_vector=OLVec,
-        )
-    else:
-        model = SpectralClustering(
-            n_clusters=num_clusters, affinity="precomputed", random_state=0
+        return Discretize(maps, OLVec)
+    model = KMeans(n_clusters=num_clusters, random_state=0, n_init=10)
+    return model.fit_predict(maps)
+
+
+# Landmark-based approximation of NME spectral clustering (Chen and Cai, Large scale
+# spectral clustering with landmark-based representation, AAAI 2011) for long
+# recordings. Each embedding is connected to its p most similar landmarks (instead of
+# its p nearest embeddings), so only NxM affinities to M << N landmarks are needed.
+
+# Selects num_landmarks representative points as k-means centroids of (a random subset
+# of) the embeddings
+def SelectLandmarks(X, num_landmarks, samples_per_landmark=10, random_state=0):
+    N = X.shape[0]
+    if N <= num_landmarks:
+        return X.copy()
+    rng = np.random.RandomState(random_state)
+    subset = rng.choice(N, min(N, num_landmarks * samples_per_landmark), replace=False)
+    model = KMeans(
+        n_clusters=num_landmarks, n_init=1, max_iter=20, random_state=random_state
+    )
+    return model.fit(X[subset]).cluster_centers_
+
+
+def CosineSimilarity(X, Y):
+    X = X / np.linalg.norm(X, axis=1, keepdims=True)
+    Y = Y / np.linalg.norm(Y, axis=1, keepdims=True)
+    return X.dot(Y.T)
+
+
+# Returns indices of the p_max most similar landmarks for each embedding. The NxM
+# affinities are computed in blocks of block_size rows, so that they never need to
+# be stored
+def get_landmark_ranking(X, landmarks, p_max, similarity, block_size=10000):
+    return np.concatenate(
+        [
+            get_kneighbors_ranking(similarity(X[i : i + block_size], landmarks), p_max)
+            for i in range(0, X.shape[0], block_size)
+        ]
+    )
+
+
+# Computes k smallest eigenvalues (and eigenvectors) of the normalized Laplacian of
+# graph W = Z D^-1 Z^T, where Z is NxM binary matrix connecting each embedding to its p
+# most similar landmarks and D are the landmark degrees. Since all the rows of W sum
+# to p, the eigenvalues are 1 - s^2 / p, where s are the singular values of Z D^-1/2,
+# which are obtained from the MxM matrix D^-1/2 Z^T Z D^-1/2.
+def LandmarkEigenpairs(ranking, p, num_landmarks, k):
+    N = ranking.shape[0]
+    Z = scipy.sparse.csr_matrix(
+        (np.ones(N * p), (np.repeat(np.arange(N), p), ranking[:, :p].ravel())),
+        shape=(N, num_landmarks),
+    )
+    d = np.asarray(Z.sum(axis=0)).ravel()
+    Z = Z @ scipy.sparse.diags(1.0 / np.sqrt(np.where(d > 0, d, 1.0)))
+    s2, V = scipy.linalg.eigh((Z.T @ Z).toarray())
+    s2, V = np.clip(s2[::-1], 0, None), V[:, ::-1]
+    S = 1.0 - s2 / p
+    # W has rank at most M, its other eigenvalues are zero
+    Smax = 1.0 if N > num_landmarks else S.max()
+    k = min(k, num_landmarks)
+    X = Z @ V[:, :k] / np.sqrt(np.maximum(s2[:k], 1e-10))
+    return S[:k], Smax, X
+
+
+"""
+Performs landmark-based spectral clustering with Normalized Maximum Eigengap (NME)
+Parameters:
+   X: matrix of speaker embeddings (in rows)
+   OLVec: 0/1 vector denoting which segments are overlap segments
+   num_clusters: number of clusters to generate (if None, determined automatically)
+   max_num_clusters: maximum allowed number of clusters to generate
+   pmin, pmax: range of the number of landmarks each embedding is connected to
+   num_landmarks: number of landmarks
+   similarity: function computing matrix of similarities between two sets of
+      embeddings (cosine similarity by default)
+Returns: cluster assignments for every speaker embedding (pairs of cluster assignments
+   for the overlap segments)
+"""
+
+
+def NME_LandmarkSpectralClustering(
+    X,
+    OLVec,
+    num_clusters=None,
+    max_num_clusters=10,
+    pmin=3,
+    pmax=20,
+    num_landmarks=500,
+    similarity=CosineSimilarity,
+):
+    landmarks = SelectLandmarks(X, num_landmarks)
+    num_landmarks = landmarks.shape[0]
+    ranking = get_landmark_ranking(X, landmarks, pmax, similarity)
+    print("Selecting best number of landmarks for affinity matrix thresolding:")
+    rbest = None
+    for p in range(pmin, min(pmax, num_landmarks) + 1):
+        S, Smax, U = LandmarkEigenpairs(
+            ranking, p, num_landmarks, max_num_clusters + 1
         )
-    labels = model.fit_predict(Ap)
-    return labels
+        e = Eigengap(S)
+        g = np.max(e[:max_num_clusters]) / (Smax + 1e-10)
+        r = p / g
+        k = np.argmax(e[:max_num_clusters])
+        print("p={}, g={}, k={}, r={}, e={}".format(p, g, k, r, e))
+        if rbest is None or rbest > r:
+            rbest, pbest, kbest, Ubest = r, p, k, U
+    print("Best number of landmarks is {}".format(pbest))
+    num_clusters = num_clusters if num_clusters is not None else (kbest + 1)
+    # Handle some edge cases in AMI SDM
+    num_clusters = 4 if num_clusters == 1 else num_clusters
+    print("Number of speakers is {}".format(num_clusters))
+    if num_clusters > Ubest.shape[1]:
+        _, _, Ubest = LandmarkEigenpairs(ranking, pbest, num_landmarks, num_clusters)
+    maps = Ubest[:, :num_clusters]
+    if OLVec is not None:
+        return Discretize(maps, OLVec)
+    model = KMeans(n_clusters=num_clusters, random_state=0, n_init=10)
+    return model.fit_predict(maps)
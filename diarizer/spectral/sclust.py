@@ -23,77 +23,110 @@
 # IEEE Spoken Language Technology (SLT) Workshop 2021
 
 import argparse
+import functools
 import os
 import itertools
-from collections import namedtuple
 
-import h5py
 import kaldi_io
 import numpy as np
-from scipy.linalg import eigh
 
 from diarizer.diarization_lib import (
     read_xvector_timing_dict,
-    l2_norm,
     cos_similarity,
-    kaldi_ivector_plda_scoring_dense,
+    knn_graph,
+    PLDAScorer,
+    PLDA_scoring_in_LDA_space,
     mkdir_p,
 )
-from diarizer.kaldi_utils import read_plda
-from diarizer.spectral.Spectral_clustering import NME_SpectralClustering
+from diarizer.intervals import covered_duration
+from diarizer.io_utils import read_rttm, write_rttm
+from diarizer.model_bundle import load_model_bundle
+from diarizer.postprocessing import subsegments_to_segments
+from diarizer.spectral.Spectral_clustering import (
+    CosineSimilarity,
+    NME_SpectralClustering,
+    NME_LandmarkSpectralClustering,
+)
 
 
-Segment = namedtuple("Segment", ["start", "end", "labels"])
+def compute_overlap_vector(overlap_rttm, segments, frac=0.5):
+    """Returns vector with 1 for the subsegments which have at least 'frac' fraction
+    lying in the overlap regions of the overlap RTTM (and 0 for the others), or a
+    vector of -1 if there is no overlap RTTM. The overlap regions can also be given
+    directly as a tuple of arrays (starts, ends)."""
+    if overlap_rttm is None:
+        return -1 * np.ones(len(segments))
+    if isinstance(overlap_rttm, tuple):
+        overlap_starts, overlap_ends = overlap_rttm
+    else:
+        overlap_segs = read_rttm(overlap_rttm)
+        overlap_starts, overlap_ends = overlap_segs["start"], overlap_segs["end"]
+    starts, ends = np.asarray(segments, dtype=float).reshape(-1, 2).T
+    total_ovl = covered_duration(starts, ends, overlap_starts, overlap_ends)
+    return (total_ovl >= frac * (ends - starts)).astype(float)
 
 
-def write_output(fp, out_labels, starts, ends):
-    for label, seg_start, seg_end in zip(out_labels, starts, ends):
-        fp.write(
-            f"SPEAKER {file_name} 1 {seg_start:03f} {seg_end - seg_start:03f} "
-            f"<NA> <NA> {int(label + 1)} <NA> <NA>{os.linesep}"
+def cluster_spectral(
+    x,
+    scorer=None,
+    overlaps=None,
+    min_neighbors=3,
+    max_neighbors=20,
+    num_speakers=None,
+    affinity="dense",
+    landmark_threshold=5000,
+    num_landmarks=500,
+    nj=1,
+):
+    """
+    Spectral clustering of the (transformed) x-vectors of one recording.
+    Input:
+        x        - x-vectors (in rows) after ModelBundle.transform
+        scorer   - PLDAScorer, or None to use cosine similarity
+        overlaps - vector from compute_overlap_vector, or None
+        (the other parameters are those of the command line options)
+    Outputs:
+        labels - cluster labels of the x-vectors (as expected by
+                 postprocessing.subsegments_to_segments)
+    """
+    if 0 < landmark_threshold < len(x):
+        # Landmark-based clustering only needs similarities to the landmarks
+        if scorer is not None:
+            x, acvar = scorer.project(x)
+            similarity = functools.partial(PLDA_scoring_in_LDA_space, diagAC=acvar)
+        else:
+            similarity = CosineSimilarity
+        return NME_LandmarkSpectralClustering(
+            x,
+            overlaps,
+            pmin=min_neighbors,
+            pmax=max_neighbors,
+            num_clusters=num_speakers,
+            num_landmarks=num_landmarks,
+            similarity=similarity,
         )
 
-
-def compute_overlap_vector(overlap_rttm, segments):
-    if overlap_rttm is not None:
-        overlap_segs = []
-        with open(overlap_rttm, "r") as f:
-            for line in f.readlines():
-                parts = line.strip().split()
-                overlap_segs.append(
-                    (float(parts[3]), float(parts[3]) + float(parts[4]))
-                )
-        ol_vec = np.zeros(len(segments))
-        overlap_segs.sort(key=lambda x: x[0])
-        for i, segment in enumerate(segments):
-            start_time, end_time = segment
-            is_overlap = get_overlap_decision(overlap_segs, (start_time, end_time))
-            if is_overlap:
-                ol_vec[i] = 1
+    # Compute pairwise similarity matrix
+    index = "faiss" if affinity == "knn-faiss" else None
+    if scorer is not None:
+        # compute PLDA affinity matrix
+        if affinity == "dense":
+            scr_mx = scorer.score_dense(x)
+        else:
+            scr_mx = scorer.score_knn(x, max_neighbors, index=index)
+    elif affinity == "dense":
+        scr_mx = cos_similarity(x)
     else:
-        ol_vec = -1 * np.ones(len(segments))
-    return ol_vec
+        scr_mx = knn_graph(x, max_neighbors, index=index)
 
-
-def get_overlap_decision(overlap_segs, subsegment, frac=0.5):
-    """Returns true if at least 'frac' fraction of the subsegment lies
-    in the overlap_segs."""
-    start_time = subsegment[0]
-    end_time = subsegment[1]
-    dur = end_time - start_time
-    total_ovl = 0
-
-    for seg in overlap_segs:
-        cur_start, cur_end = seg
-        if cur_start >= end_time:
-            break
-        ovl_start = max(start_time, cur_start)
-        ovl_end = min(end_time, cur_end)
-        ovl_time = max(0, ovl_end - ovl_start)
-
-        total_ovl += ovl_time
-
-    return total_ovl >= frac * dur
+    return NME_SpectralClustering(
+        scr_mx,
+        overlaps,
+        pmin=min_neighbors,
+        pmax=max_neighbors,
+        num_clusters=num_speakers,
+        nj=nj,
+    )
 
 
 if __name__ == "__main__":
@@ -129,7 +162,8 @@ if __name__ == "__main__":
         "--xvec-transform",
         required=True,
         type=str,
-        help="path to x-vector transformation h5 file",
+        help="path to x-vector transformation h5 file (or to a model bundle directory "
+        "exported by model_bundle.py, in which case --plda-file is ignored)",
     )
     parser.add_argument(
         "--plda-file",
@@ -158,6 +192,56 @@ if __name__ == "__main__":
         default=None,
         help="Number of speakers in the recording",
     )
+    parser.add_argument(
+        "--nj",
+        required=False,
+        type=int,
+        default=1,
+        help="Number of processes used for the sweep over the number of neighbors",
+    )
+    parser.add_argument(
+        "--affinity",
+        required=False,
+        type=str,
+        default="dense",
+        choices=["dense", "knn", "knn-faiss"],
+        help="dense computes the full similarity matrix, knn only keeps the scores of the "
+        "max-neighbors nearest neighbours of each x-vector (found by exact search, or by "
+        "approximate search with faiss for knn-faiss), see diarization_lib.knn_graph",
+    )
+    parser.add_argument(
+        "--landmark-threshold",
+        required=False,
+        type=int,
+        default=5000,
+        help="Recordings with more x-vectors than this are clustered with landmark-based "
+        "spectral clustering, which does not need the full similarity matrix "
+        "(0 to always use the full similarity matrix)",
+    )
+    parser.add_argument(
+        "--num-landmarks",
+        required=False,
+        type=int,
+        default=500,
+        help="Number of landmarks for landmark-based spectral clustering",
+    )
+    parser.add_argument(
+        "--precision",
+        required=False,
+        type=str,
+        default="float64",
+        choices=["float32", "float64"],
+        help="Floating point type of the dense PLDA score matrix (float32 halves its "
+        "memory)",
+    )
+    parser.add_argument(
+        "--max-pca-samples",
+        required=False,
+        type=int,
+        default=None,
+        help="If provided, the PCA of the PLDA scoring is estimated on a random subset "
+        "of this many x-vectors for longer recordings",
+    )
 
     args = parser.parse_args()
     assert args.max_neighbors > 1
@@ -165,6 +249,16 @@ if __name__ == "__main__":
     # segments file with x-vector timing information
     segs_dict = read_xvector_timing_dict(args.segments_file)
 
+    # x-vector transform and PLDA are loaded once for all the recordings
+    model = load_model_bundle(args.xvec_transform, args.plda_file)
+    scorer = None
+    if model.kaldi_plda is not None:
+        scorer = PLDAScorer(
+            model.kaldi_plda,
+            dtype=np.dtype(args.precision).type,
+            max_pca_samples=args.max_pca_samples,
+        )
+
     # Open ark file with x-vectors and in each iteration of the following for-loop
     # read a batch of x-vectors corresponding to one recording
     arkit = kaldi_io.read_vec_flt_ark(args.xvec_ark_file)
@@ -176,19 +270,7 @@ if __name__ == "__main__":
         seg_names, xvecs = zip(*segs)
         x = np.array(xvecs)
 
-        with h5py.File(args.xvec_transform, "r") as f:
-            mean1 = np.array(f["mean1"])
-            mean2 = np.array(f["mean2"])
-            lda = np.array(f["lda"])
-            x = l2_norm(lda.T.dot((l2_norm(x - mean1)).transpose()).transpose() - mean2)
-
-        # Compute pairwise similarity matrix
-        if args.plda_file is not None:
-            # compute PLDA affinity matrix
-            kaldi_plda = read_plda(args.plda_file)
-            scr_mx = kaldi_ivector_plda_scoring_dense(kaldi_plda, x)
-        else:
-            scr_mx = cos_similarity(x)
+        x = model.transform(x)
 
         overlaps = (
             compute_overlap_vector(args.overlap_rttm, segs_dict[file_name][1])
@@ -196,77 +278,25 @@ if __name__ == "__main__":
             else None
         )
 
-        labels = NME_SpectralClustering(
-            scr_mx,
+        labels = cluster_spectral(
+            x,
+            scorer,
             overlaps,
-            pmin=args.min_neighbors,
-            pmax=args.max_neighbors,
-            num_clusters=args.num_speakers,
+            min_neighbors=args.min_neighbors,
+            max_neighbors=args.max_neighbors,
+            num_speakers=args.num_speakers,
+            affinity=args.affinity,
+            landmark_threshold=args.landmark_threshold,
+            num_landmarks=args.num_landmarks,
+            nj=args.nj,
         )
 
-        # Create list of overlapping subsegments
-        subsegments = []
-        for time, label in zip(segs_dict[file_name][1], labels):
-            label = [label] if isinstance(label, np.integer) else label
-            subsegments.append(Segment(*time, label))
-
-        subsegments = sorted(subsegments, key=lambda x: x.start)
-
-        # At this point the subsegments are overlapping, since we got them from a
-        # sliding window diarization method. We make them contiguous here
-        new_segs = []
-        for i, seg in enumerate(subsegments):
-            # If it is last segment in recording or last contiguous segment, add it to new_segs
-            if i == len(subsegments) - 1 or seg.end <= subsegments[i + 1].start:
-                new_segs.append(Segment(seg.start, seg.end, seg.labels))
-            # Otherwise split overlapping interval between current and next segment
-            else:
-                avg = (subsegments[i + 1].start + seg.end) / 2
-                new_segs.append(Segment(seg.start, avg, seg.labels))
-                subsegments[i + 1] = subsegments[i + 1]._replace(start=avg)
-
-        # Merge contiguous segments of the same label
-        merged_segs = []
-        running_labels = {}  # {label: (start_time, end_time)}
-        for i, seg in enumerate(new_segs):
-            # If running labels are not present in current segment, add those segments
-            # to merged_segs list and delete those entries
-            for label in list(running_labels.keys()):
-                if label not in seg.labels:
-                    merged_segs.append(
-                        Segment(
-                            running_labels[label][0], running_labels[label][1], label
-                        )
-                    )
-                    del running_labels[label]
-            # Now add/update labels in running_labels based on current segment
-            for label in seg.labels:
-                if label in running_labels:
-                    # If already present, just update end time
-                    start_time = running_labels[label][0]
-                    running_labels[label] = (start_time, seg.end)
-                else:
-                    # Otherwise make a new entry
-                    running_labels[label] = (seg.start, seg.end)
-            # If it is the last segment in utterance or last contiguous segment, add it to merged_segs
-            # and delete from running_labels
-            if i == len(new_segs) - 1 or seg.end < new_segs[i + 1].start:
-                # Case when it is last segment or if next segment is after some gap
-                for label in list(running_labels):
-                    merged_segs.append(
-                        Segment(
-                            running_labels[label][0], running_labels[label][1], label
-                        )
-                    )
-                    del running_labels[label]
+        # The subsegments are overlapping, since we got them from a sliding window
+        # diarization method. We make them contiguous and merge contiguous segments
+        # of the same label.
+        start, end = segs_dict[file_name][1].T
+        starts, ends, out_labels = subsegments_to_segments(start, end, labels)
 
         mkdir_p(args.out_rttm_dir)
-        rttm_str = "SPEAKER {file} 1 {start:.03f} {duration:.03f} <NA> <NA> {label} <NA> <NA>\n"
         with open(os.path.join(args.out_rttm_dir, f"{file_name}.rttm"), "w") as fp:
-            for seg in merged_segs:
-                duration = seg.end - seg.start
-                fp.write(
-                    "SPEAKER {0} 1 {1:7.3f} {2:7.3f} <NA> <NA> {3} <NA> <NA>\n".format(
-                        file_name, seg.start, duration, seg.labels
-                    )
-                )
+            write_rttm(fp, file_name, starts, ends, out_labels)
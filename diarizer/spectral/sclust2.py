@@ -21,75 +21,35 @@
 import argparse
 import os
 import itertools
-from collections import namedtuple
 
-import h5py
 import kaldi_io
 import numpy as np
-from scipy.linalg import eigh
 
 from diarizer.diarization_lib import (
     read_xvector_timing_dict,
-    l2_norm,
     cos_similarity,
-    kaldi_ivector_plda_scoring_dense,
     mkdir_p,
+    PLDAScorer,
 )
-from diarizer.kaldi_utils import read_plda
+from diarizer.intervals import covered_duration
+from diarizer.io_utils import read_rttm, write_rttm
+from diarizer.model_bundle import load_model_bundle
+from diarizer.postprocessing import subsegments_to_segments
 from diarizer.spectral.Spectral_clustering import NME_SpectralClustering
 
 
-Segment = namedtuple("Segment", ["channel", "start", "end", "label"])
-
-
-def write_output(fp, out_labels, starts, ends):
-    for label, seg_start, seg_end in zip(out_labels, starts, ends):
-        fp.write(
-            f"SPEAKER {file_name} 1 {seg_start:03f} {seg_end - seg_start:03f} "
-            f"<NA> <NA> {int(label + 1)} <NA> <NA>{os.linesep}"
-        )
-
-
-def compute_overlap_vector(overlap_rttm, segments):
-    if overlap_rttm is not None:
-        overlap_segs = []
-        with open(overlap_rttm, "r") as f:
-            for line in f.readlines():
-                parts = line.strip().split()
-                overlap_segs.append(
-                    (float(parts[3]), float(parts[3]) + float(parts[4]))
-                )
-        ol_vec = np.zeros(len(segments))
-        overlap_segs.sort(key=lambda x: x[0])
-        for i, segment in enumerate(segments):
-            start_time, end_time = segment
-            is_overlap = get_overlap_decision(overlap_segs, (start_time, end_time))
-            if is_overlap:
-                ol_vec[i] = 1
-    else:
-        ol_vec = -1 * np.ones(len(segments))
-    return ol_vec
-
-
-def get_overlap_decision(overlap_segs, subsegment, frac=0.5):
-    """Returns true if at least 'frac' fraction of the subsegment lies
-    in the overlap_segs."""
-    start_time = subsegment[0]
-    end_time = subsegment[1]
-    dur = end_time - start_time
-    total_ovl = 0
-
-    for seg in overlap_segs:
-        cur_start, cur_end = seg
-        if cur_start >= end_time:
-            break
-        ovl_start = max(start_time, cur_start)
-        ovl_end = min(end_time, cur_end)
-        ovl_time = max(0, ovl_end - ovl_start)
-
-        total_ovl += ovl_time
-
-    return total_ovl >= frac * dur
+def compute_overlap_vector(overlap_rttm, segments, frac=0.5):
+    """Returns vector with 1 for the subsegments which have at least 'frac' fraction
+    lying in the overlap regions of the overlap RTTM (and 0 for the others), or a
+    vector of -1 if there is no overlap RTTM."""
+    if overlap_rttm is None:
+        return -1 * np.ones(len(segments))
+    overlap_segs = read_rttm(overlap_rttm)
+    starts, ends = np.asarray(segments, dtype=float).reshape(-1, 2).T
+    total_ovl = covered_duration(
+        starts, ends, overlap_segs["start"], overlap_segs["end"]
+    )
+    return (total_ovl >= frac * (ends - starts)).astype(float)
 
 
 if __name__ == "__main__":
@@ -117,7 +77,8 @@ if __name__ == "__main__":
         "--xvec-transform",
         required=True,
         type=str,
-        help="path to x-vector transformation h5 file",
+        help="path to x-vector transformation h5 file (or to a model bundle directory "
+        "exported by model_bundle.py, in which case --plda-file is ignored)",
     )
     parser.add_argument(
         "--plda-file",
@@ -146,6 +107,13 @@ if __name__ == "__main__":
         default=None,
         help="Number of speakers in the recording",
     )
+    parser.add_argument(
+        "--nj",
+        required=False,
+        type=int,
+        default=1,
+        help="Number of processes used for the sweep over the number of neighbors",
+    )
 
     # For now only 2 streams are supported
 
@@ -156,6 +124,10 @@ if __name__ == "__main__":
     # indexed by file name
     segs_dict = read_xvector_timing_dict(args.segments_file)
 
+    # x-vector transform and PLDA are loaded once for all the recordings
+    model = load_model_bundle(args.xvec_transform, args.plda_file)
+    scorer = PLDAScorer(model.kaldi_plda) if model.kaldi_plda is not None else None
+
     # Open ark file with x-vectors and in each iteration of the following for-loop
     # read a batch of x-vectors corresponding to one recording
     arkit = kaldi_io.read_vec_flt_ark(args.xvec_ark_file)
@@ -169,17 +141,12 @@ if __name__ == "__main__":
         seg_names, xvecs = zip(*segs)
         x = np.array(xvecs)
 
-        with h5py.File(args.xvec_transform, "r") as f:
-            mean1 = np.array(f["mean1"])
-            mean2 = np.array(f["mean2"])
-            lda = np.array(f["lda"])
-            x = l2_norm(lda.T.dot((l2_norm(x - mean1)).transpose()).transpose() - mean2)
+        x = model.transform(x)
 
         # Compute pairwise similarity matrix
-        if args.plda_file is not None:
+        if scorer is not None:
             # compute PLDA affinity matrix
-            kaldi_plda = read_plda(args.plda_file)
-            scr_mx = kaldi_ivector_plda_scoring_dense(kaldi_plda, x)
+            scr_mx = scorer.score_dense(x)
         else:
             scr_mx = cos_similarity(x)
 
@@ -189,66 +156,16 @@ if __name__ == "__main__":
             pmin=args.min_neighbors,
             pmax=args.max_neighbors,
             num_clusters=args.num_speakers,
+            nj=args.nj,
         )
 
-        # Create list of overlapping subsegments
-        subsegments = []
-        for seg_name, time, label in zip(
-            segs_dict[file_name][0], segs_dict[file_name][1], labels
-        ):
-            channel = seg_name.rsplit("_", 2)[1]
-            subsegments.append(Segment(channel, *time, label))
-
-        # We sort the subsegments first by channel and then start time so that all segments of
-        # 1 channel are in sequential order followed by all segments of 2 channel and so on.
-        subsegments = sorted(subsegments, key=lambda x: (x.channel, x.start))
-
-        # At this point the subsegments are overlapping, since we got them from a
-        # sliding window diarization method. We make them contiguous here.
-        contiguous_segs = []
-        for i, seg in enumerate(subsegments):
-            # If it is last segment in channel or last contiguous segment, add it to new_segs
-            if (
-                i == len(subsegments) - 1
-                or seg.channel != subsegments[i + 1].channel
-                or seg.end <= subsegments[i + 1].start
-            ):
-                contiguous_segs.append(
-                    Segment(seg.channel, seg.start, seg.end, seg.label)
-                )
-            # Otherwise split overlapping interval between current and next segment
-            else:
-                avg = (subsegments[i + 1].start + seg.end) / 2
-                contiguous_segs.append(Segment(seg.channel, seg.start, avg, seg.label))
-                subsegments[i + 1] = subsegments[i + 1]._replace(start=avg)
-
-        # At this point, we have contiguous subsegments for each channel. But the
-        # speaker segments across channels may still overlap. We merge cross-channel
-        # segments of the same speaker now.
-        segs_by_speaker = {
-            spk: list(segs)
-            for spk, segs in itertools.groupby(
-                sorted(contiguous_segs, key=lambda x: (x.label, x.start)),
-                lambda x: x.label,
-            )
-        }
-        merged_segs = []
-        for spk, segs in segs_by_speaker.items():
-            merged_segs.append(segs[0])
-            for i, seg in enumerate(segs[1:]):
-                # If start time is before the end time of previous segment, then combine segments
-                if float(seg.start) <= float(merged_segs[-1].end):
-                    merged_segs[-1] = merged_segs[-1]._replace(end=seg.end)
-                else:
-                    merged_segs.append(seg)
+        # The subsegments are overlapping, since we got them from a sliding window
+        # diarization method. We make them contiguous in each channel and merge the
+        # segments of the same speaker (also across channels).
+        start, end = segs_dict[file_name][1].T
+        channels = [seg_name.rsplit("_", 2)[1] for seg_name in segs_dict[file_name][0]]
+        starts, ends, out_labels = subsegments_to_segments(start, end, labels, channels)
 
         mkdir_p(args.out_rttm_dir)
-        rttm_str = "SPEAKER {file} 1 {start:.03f} {duration:.03f} <NA> <NA> {label} <NA> <NA>\n"
         with open(os.path.join(args.out_rttm_dir, f"{file_name}.rttm"), "w") as fp:
-            for seg in merged_segs:
-                duration = seg.end - seg.start
-                fp.write(
-                    "SPEAKER {0} 1 {1:7.3f} {2:7.3f} <NA> <NA> {3} <NA> <NA>\n".format(
-                        file_name, seg.start, duration, seg.label
-                    )
-                )
+            write_rttm(fp, file_name, starts, ends, out_labels)
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+
+# @Authors: Desh Raj
+# @Emails: r.desh26@gmail.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Content-addressed cache of the outputs of the recipe stages. The key of a job is the
+# hash of its command line and of the contents of its input files (audio, .lab, .ark,
+# ...), of the files and input directories that appear in the command (the script,
+# model weights, PLDA, --in-lab-dir, ...) and of extra dependencies (e.g. a model
+# directory). An input directory is not hashed as a whole if the job declares its files
+# in it with --inputs. After a successful run, the outputs are copied to the cache; if
+# a job with the same key is run again, its outputs are copied back instead.
+# Interrupted runs thus resume with the recordings that were not finished, and since
+# the key of a stage depends on the contents of the outputs of the previous stage, a
+# parameter change only recomputes the stages whose inputs actually changed.
+#
+# The hashes of the files are remembered by (path, size, modification time), so large
+# audio files are only read once.
+#
+# Usage (one job, e.g. inside the $train_cmd loops of the recipes):
+#   python diarizer/stage_cache.py --cache-dir exp/cache \
+#     --outputs exp/ami/dev/vbx/${filename}.rttm -- \
+#     python diarizer/vbx/vbhmm.py --xvec-ark-file exp/ami/dev/xvec/${filename}.ark ...
+# (see also the --cache-dir option of scheduler.py)
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+
+class StageCache:
+    def __init__(self, cache_dir):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(exist_ok=True, parents=True)
+        self.hash_file = self.cache_dir / "file_hashes.json"
+        self.file_hashes = {}
+        if self.hash_file.exists():
+            try:
+                with open(self.hash_file) as f:
+                    self.file_hashes = json.load(f)
+            except ValueError:
+                pass  # a partially written file is rebuilt
+
+    def file_hash(self, path):
+        """Returns the sha256 of the contents of a file (or, for a directory, of the
+        names and contents of its files, except compiled Python files), or 'missing'
+        if it does not exist."""
+        path = Path(path)
+        if path.is_dir():
+            h = hashlib.sha256()
+            files = path.rglob("*")
+            for sub in sorted(p for p in files if p.is_file() and p.suffix != ".pyc"):
+                h.update(f"{sub.relative_to(path)} {self.file_hash(sub)}\n".encode())
+            return h.hexdigest()
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return "missing"
+        name = str(path.resolve())
+        size_mtime = [stat.st_size, stat.st_mtime_ns]
+        cached = self.file_hashes.get(name)
+        if cached is not None and cached[:2] == size_mtime:
+            return cached[2]
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        self.file_hashes[name] = size_mtime + [h.hexdigest()]
+        return h.hexdigest()
+
+    def save_hashes(self):
+        """Saves the remembered file hashes (atomically, so that concurrent jobs at
+        worst lose each other's entries)."""
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.file_hashes, f)
+        os.replace(tmp, self.hash_file)
+
+    def key(self, command, inputs=(), outputs=(), deps=()):
+        """
+        Returns the cache key of a job.
+        Input:
+            command - command line (string or list of arguments)
+            inputs  - input files of the job
+            outputs - output files (they are excluded from the files of the command)
+            deps    - other files or directories the outputs depend on
+        """
+        args = command.split() if isinstance(command, str) else list(command)
+        outputs = {os.path.abspath(path) for path in outputs}
+        # the files of the command line (script, models, inputs given as arguments)
+        command_files = [
+            arg
+            for arg in args
+            if os.path.isfile(arg) and os.path.abspath(arg) not in outputs
+        ]
+        # the directories of the command line (e.g. --in-lab-dir) are hashed as a whole,
+        # unless they contain outputs (output directories) or declared inputs (then only
+        # those inputs are hashed, so that a job does not depend on the other files)
+        declared = list(outputs) + [os.path.abspath(path) for path in inputs]
+        command_dirs = [
+            arg
+            for arg in args
+            if os.path.isdir(arg)
+            and not any(
+                path.startswith(os.path.join(os.path.abspath(arg), ""))
+                for path in declared
+            )
+        ]
+        h = hashlib.sha256()
+        h.update(f"command {' '.join(args)}\n".encode())
+        for kind, paths in [
+            ("input", inputs),
+            ("command_file", command_files),
+            ("command_dir", command_dirs),
+            ("dep", deps),
+        ]:
+            for path in paths:
+                h.update(f"{kind} {self.file_hash(path)}\n".encode())
+        return h.hexdigest()
+
+    def _entry(self, key):
+        return self.cache_dir / key[:2] / key
+
+    def fetch(self, key, outputs):
+        """Copies the cached outputs of the key to 'outputs' and returns True, or
+        returns False if the key is not in the cache."""
+        entry = self._entry(key)
+        if not (entry / "done").exists():
+            return False
+        for i, path in enumerate(outputs):
+            Path(path).absolute().parent.mkdir(exist_ok=True, parents=True)
+            # copy to a new file, so that the cache does not share the output inode
+            tmp = f"{path}.tmp{os.getpid()}"
+            shutil.copyfile(entry / str(i), tmp)
+            os.replace(tmp, path)
+        return True
+
+    def store(self, key, outputs):
+        """Copies the outputs to the cache under the key. Returns False (and stores
+        nothing) if an output is missing."""
+        entry = self._entry(key)
+        if (entry / "done").exists():
+            return True
+        if not all(os.path.isfile(path) for path in outputs):
+            return False
+        entry.parent.mkdir(exist_ok=True, parents=True)
+        # the entry is filled in a temporary directory and moved in place at once
+        tmp = Path(tempfile.mkdtemp(dir=entry.parent))
+        for i, path in enumerate(outputs):
+            shutil.copyfile(path, tmp / str(i))
+        (tmp / "done").write_text(
+            "".join(f"{i} {path}\n" for i, path in enumerate(outputs))
+        )
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            shutil.rmtree(tmp)  # stored by a concurrent job
+        return True
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Run a command, or copy its outputs from the cache if it was "
+        "already run with the same inputs."
+    )
+    parser.add_argument("--cache-dir", type=str, required=True)
+    parser.add_argument(
+        "--inputs",
+        type=str,
+        nargs="*",
+        default=[],
+        help="Input files that are not given as arguments of the command (e.g. the "
+        "files read from an input directory).",
+    )
+    parser.add_argument(
+        "--outputs", type=str, nargs="+", required=True, help="Output files."
+    )
+    parser.add_argument(
+        "--deps",
+        type=str,
+        nargs="*",
+        default=[],
+        help="Other files or directories the outputs depend on (e.g. a model "
+        "directory, or the diarizer package to invalidate on code changes).",
+    )
+    parser.add_argument("command", nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+    if args.command and args.command[0] == "--":
+        args.command = args.command[1:]
+    if not args.command:
+        parser.error("no command given")
+    return args
+
+
+if __name__ == "__main__":
+    args = get_args()
+    cache = StageCache(args.cache_dir)
+    key = cache.key(args.command, args.inputs, args.outputs, args.deps)
+    if cache.fetch(key, args.outputs):
+        print(f"Cache hit ({key[:12]}), outputs restored", file=sys.stderr)
+        cache.save_hashes()
+        sys.exit(0)
+    returncode = subprocess.call(args.command)
+    if returncode == 0 and not cache.store(key, args.outputs):
+        print("Some outputs are missing, not caching them", file=sys.stderr)
+    cache.save_hashes()
+    sys.exit(returncode)
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+
+# @Authors: Desh Raj
+# @Emails: r.desh26@gmail.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Cheap energy and spectral flux based gate, used before the neural VAD to skip the
+# clearly silent parts of long (far-field) recordings. A frame is a speech candidate if
+# its energy is well above the noise floor of the recording, or if its spectral flux
+# is high compared to the flux of the low energy frames (which catches quiet speech in
+# stationary noise). The candidate frames are padded and merged into regions, and the
+# segmentation model is only run on these regions (see SegmentationScorer).
+#
+# When run as a script, reports the fraction of audio (and of model chunks) that the
+# gate keeps and the reference speech it misses, for tuning the gate on a corpus.
+
+import argparse
+import os
+
+import numpy as np
+
+from diarizer.intervals import covered_duration, normalize
+from diarizer.xvector.features import framing
+
+
+class EnergyGate:
+    """Returns candidate speech regions of a signal.
+    Input (of __call__):
+        signal      - vector of samples
+        sample_rate - sampling rate of the signal
+    Outputs:
+        starts, ends - arrays of region start and end times (in seconds)
+    """
+
+    def __init__(
+        self,
+        frame_length=0.032,
+        frame_shift=0.016,
+        margin=6.0,
+        floor_percentile=10,
+        flux_factor=3.0,
+        pad=0.5,
+        min_gap=5.0,
+    ):
+        # margin is in dB above the noise floor (the 'floor_percentile' percentile of
+        # the frame energies); gaps shorter than min_gap are not skipped, since each
+        # region costs at least one model chunk
+        self.frame_length = frame_length
+        self.frame_shift = frame_shift
+        self.margin = margin
+        self.floor_percentile = floor_percentile
+        self.flux_factor = flux_factor
+        self.pad = pad
+        self.min_gap = min_gap
+
+    def frame_features(self, signal, sample_rate, block_size=2048):
+        """Returns the log energy (in dB) and the spectral flux of each frame. The
+        frames are processed in blocks, so that the temporary arrays stay small."""
+        window = int(round(self.frame_length * sample_rate))
+        shift = int(round(self.frame_shift * sample_rate))
+        frames = framing(np.asarray(signal, dtype=np.float32), window, shift)
+        hanning = np.hanning(window).astype(np.float32)
+        energy = np.empty(len(frames))
+        flux = np.zeros(len(frames))
+        prev = None
+        for i in range(0, len(frames), block_size):
+            block = frames[i : i + block_size]
+            block = block - block.mean(axis=1, keepdims=True)
+            energy[i : i + len(block)] = np.einsum("ij,ij->i", block, block) / window
+            spec = np.log1p(np.abs(np.fft.rfft(block * hanning, axis=1)))
+            if prev is not None:
+                spec = np.r_[prev, spec]
+            diff = np.maximum(spec[1:] - spec[:-1], 0).mean(axis=1)
+            flux[i + (prev is None) : i + len(block)] = diff
+            prev = spec[-1:]
+        return 10 * np.log10(energy + 1e-10), flux
+
+    def __call__(self, signal, sample_rate):
+        duration = len(signal) / sample_rate
+        if len(signal) < self.frame_length * sample_rate:
+            return np.array([0.0]), np.array([duration])
+        energy, flux = self.frame_features(signal, sample_rate)
+        threshold = np.percentile(energy, self.floor_percentile) + self.margin
+        quiet = energy <= threshold
+        active = ~quiet
+        if quiet.sum() > 1:
+            noise_flux = flux[quiet]
+            active |= flux > noise_flux.mean() + self.flux_factor * noise_flux.std()
+        starts = np.nonzero(active)[0] * self.frame_shift
+        starts, ends = normalize(
+            starts - self.pad, starts + self.frame_length + self.pad
+        )
+        # fill the short gaps
+        if len(starts) > 0:
+            first = np.r_[True, starts[1:] - ends[:-1] >= self.min_gap]
+            last = np.r_[first[1:], True]
+            starts, ends = starts[first], ends[last]
+        return np.maximum(starts, 0.0), np.minimum(ends, duration)
+
+
+def num_chunks(duration, chunk_duration, chunk_step):
+    """Number of sliding chunks (with a padded last chunk) for a region duration."""
+    duration = np.asarray(duration, dtype=float)
+    full = np.floor(np.maximum(duration - chunk_duration, 0) / chunk_step) + (
+        duration >= chunk_duration
+    )
+    last = (duration < chunk_duration) | (
+        (duration - chunk_duration) % chunk_step > 1e-6
+    )
+    return np.where(duration > 0, full + last, 0).astype(int)
+
+
+if __name__ == "__main__":
+    import soundfile as sf
+
+    from diarizer.io_utils import find_audio_files, group_by_recording, read_rttm
+
+    parser = argparse.ArgumentParser(
+        description="Report the compute saved and the speech missed by the energy gate."
+    )
+    parser.add_argument("--in-dir", type=str, required=True, help="Directory with wavs.")
+    parser.add_argument(
+        "--file-list", type=str, required=True, help="List of recordings to process."
+    )
+    parser.add_argument(
+        "--ref-rttm", type=str, nargs="+", required=True, help="Reference RTTM file(s)."
+    )
+    parser.add_argument("--margin", type=float, default=6.0)
+    parser.add_argument("--flux-factor", type=float, default=3.0)
+    parser.add_argument("--pad", type=float, default=0.5)
+    parser.add_argument("--min-gap", type=float, default=5.0)
+    parser.add_argument(
+        "--chunk-duration",
+        type=float,
+        default=5.0,
+        help="Chunk duration of the segmentation model (to count the model calls).",
+    )
+    parser.add_argument("--chunk-step", type=float, default=0.5)
+    args = parser.parse_args()
+
+    gate = EnergyGate(
+        margin=args.margin,
+        flux_factor=args.flux_factor,
+        pad=args.pad,
+        min_gap=args.min_gap,
+    )
+    with open(args.file_list) as f:
+        files = find_audio_files(args.in_dir, [line.strip() for line in f])
+    refs = group_by_recording(read_rttm(args.ref_rttm))
+
+    totals = np.zeros(6)
+    print(
+        f"{'recording':<30} {'dur[s]':>8} {'kept':>6} {'chunks':>6} "
+        f"{'speech[s]':>9} {'missed':>6}"
+    )
+    for file in files:
+        file_id = os.path.splitext(os.path.basename(file))[0]
+        signal, sample_rate = sf.read(file)
+        if signal.ndim > 1:
+            signal = signal.mean(axis=1)
+        duration = len(signal) / sample_rate
+        starts, ends = gate(signal, sample_rate)
+        segs = refs.get(file_id)
+        ref_starts, ref_ends = normalize(
+            *((segs["start"], segs["end"]) if segs is not None else ([], []))
+        )
+        speech = (ref_ends - ref_starts).sum()
+        missed = speech - covered_duration(ref_starts, ref_ends, starts, ends).sum()
+        chunks = num_chunks(ends - starts, args.chunk_duration, args.chunk_step).sum()
+        all_chunks = num_chunks(duration, args.chunk_duration, args.chunk_step)
+        stats = [duration, (ends - starts).sum(), all_chunks, chunks, speech, missed]
+        totals += stats
+        print(
+            f"{file_id:<30} {duration:>8.1f} {stats[1] / duration:>6.1%} "
+            f"{chunks / max(all_chunks, 1):>6.1%} {speech:>9.1f} "
+            f"{missed / max(speech, 1e-6):>6.2%}"
+        )
+    duration, kept, all_chunks, chunks, speech, missed = totals
+    print(
+        f"{'TOTAL':<30} {duration:>8.1f} {kept / max(duration, 1e-6):>6.1%} "
+        f"{chunks / max(all_chunks, 1):>6.1%} {speech:>9.1f} "
+        f"{missed / max(speech, 1e-6):>6.2%}"
+    )
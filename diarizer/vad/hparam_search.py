@@ -0,0 +1,174 @@
+#!/usr/local/env/python3
+# Grid search of the VAD (or overlap detection) hyperparameters on cached segmentation
+# scores (see the --score-cache option of pyannote_vad.py, overlap/pyannote_overlap.py
+# and pyannote_vad_overlap.py). For each onset/offset pair, the scores are thresholded
+# once and the min-duration post-processing and the missed/false alarm times are
+# computed on the resulting regions, so the model is never run again. As in md-eval.pl
+# (without a UEM file), only the time from the first to the last reference segment of
+# each recording is scored, minus +/- --collar seconds around the reference segment
+# boundaries. The results are written in the format of hp_search.log (see
+# local/plot_hparams.py).
+import argparse
+import itertools
+import sys
+from pathlib import Path
+
+import numpy as np
+
+from diarizer.intervals import (
+    complement,
+    count_regions,
+    covered_duration,
+    intersection,
+    normalize,
+)
+from diarizer.io_utils import group_by_recording, read_rttm
+from diarizer.vad.segmentation import binarize, load_scores, postprocess
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Tune VAD/overlap detection hyperparameters on cached scores."
+    )
+    parser.add_argument(
+        "--score-cache",
+        type=str,
+        required=True,
+        help="Directory with the cached segmentation scores.",
+    )
+    parser.add_argument(
+        "--ref-rttm",
+        type=str,
+        nargs="+",
+        required=True,
+        help="Reference RTTM file(s) with the speaker segments.",
+    )
+    parser.add_argument(
+        "--task",
+        type=str,
+        default="vad",
+        choices=["vad", "ovl"],
+        help="Tune speech activity (vad) or overlap (ovl) detection.",
+    )
+    parser.add_argument("--onset", type=float, nargs="+", default=[0.5])
+    parser.add_argument("--offset", type=float, nargs="+", default=[0.5])
+    parser.add_argument("--min-duration-on", type=float, nargs="+", default=[0.0])
+    parser.add_argument("--min-duration-off", type=float, nargs="+", default=[0.0])
+    parser.add_argument(
+        "--collar",
+        type=float,
+        default=0.0,
+        help="No-score collar (in seconds) around reference segment boundaries, as the "
+        "-c option of md-eval.pl.",
+    )
+    parser.add_argument(
+        "--log",
+        type=str,
+        default=None,
+        help="Output file (in hp_search.log format). By default, print to stdout.",
+    )
+    return parser.parse_args()
+
+
+def load_references(rttm_files, file_ids, task, collar=0.0):
+    """Returns the reference speech (or overlap) regions and the scored regions of each
+    recording, as a tuple (starts, ends, scored_starts, scored_ends)."""
+    refs = group_by_recording(read_rttm(rttm_files))
+    references = {}
+    for file_id in file_ids:
+        segs = refs.get(file_id)
+        starts, ends = (segs["start"], segs["end"]) if segs is not None else ([], [])
+        starts, ends = np.asarray(starts, dtype=float), np.asarray(ends, dtype=float)
+        if task == "ovl":
+            starts, ends = count_regions(starts, ends, min_count=2)
+        if len(starts) == 0:
+            # recordings without reference segments are not scored
+            references[file_id] = (np.zeros(0),) * 4
+            continue
+        # from the first to the last reference segment, without the collars
+        boundaries = np.r_[starts, ends]
+        scored = complement(
+            boundaries - collar, boundaries + collar, starts.min(), ends.max()
+        )
+        references[file_id] = (*intersection(starts, ends, *scored), *scored)
+    return references
+
+
+def grid_search(scores, references, onsets, offsets, min_durations_on, min_durations_off):
+    """Computes missed and false alarm times for all the hyperparameter combinations.
+    Input:
+        scores     - dict of (frame scores, frame times) indexed by recording
+        references - dict of reference (starts, ends, scored_starts, scored_ends)
+                     indexed by recording (see load_references)
+    Output:
+        list of (onset, offset, min_duration_on, min_duration_off, missed, false_alarm)
+        with the missed and false alarm times in seconds
+    """
+    results = []
+    for onset, offset in itertools.product(onsets, offsets):
+        regions = {
+            file_id: binarize(y, times, onset, offset)
+            for file_id, (y, times) in scores.items()
+        }
+        for min_on, min_off in itertools.product(min_durations_on, min_durations_off):
+            missed, false_alarm = 0.0, 0.0
+            for file_id, (starts, ends) in regions.items():
+                starts, ends = postprocess(starts, ends, min_on, min_off)
+                ref_starts, ref_ends, scored_starts, scored_ends = references[file_id]
+                starts, ends = intersection(starts, ends, scored_starts, scored_ends)
+                hit = covered_duration(starts, ends, ref_starts, ref_ends).sum()
+                missed += (ref_ends - ref_starts).sum() - hit
+                false_alarm += (ends - starts).sum() - hit
+            results.append((onset, offset, min_on, min_off, missed, false_alarm))
+    return results
+
+
+def write_log(f, results, scored_time):
+    # same lines as printed in the tuning loop of the recipes (md-eval output), with
+    # scored_time the total duration of the scored regions
+    for onset, offset, min_on, min_off, missed, false_alarm in results:
+        f.write(
+            f"Onset: {onset} Offset: {offset} Min_duration_on: {min_on} "
+            f"Min_duration_off: {min_off}\n"
+            f" MISSED SPEECH = {missed:.2f} secs ( {100 * missed / scored_time:.1f} "
+            "percent of scored time)\n"
+            f" FALARM SPEECH = {false_alarm:.2f} secs ( "
+            f"{100 * false_alarm / scored_time:.1f} percent of scored time)\n"
+        )
+
+
+if __name__ == "__main__":
+    args = get_args()
+    score_cache = Path(args.score_cache)
+    file_ids = sorted(path.stem for path in score_cache.glob("*.npy"))
+
+    scores = {}
+    for file_id in file_ids:
+        speech, overlap, times = load_scores(score_cache, file_id)
+        y = speech if args.task == "vad" else overlap
+        scores[file_id] = (np.asarray(y, dtype=np.float32), times)
+    references = load_references(args.ref_rttm, file_ids, args.task, args.collar)
+    scored_time = sum(
+        (ends - starts).sum() for _, _, starts, ends in references.values()
+    )
+
+    results = grid_search(
+        scores,
+        references,
+        args.onset,
+        args.offset,
+        args.min_duration_on,
+        args.min_duration_off,
+    )
+    if args.log is None:
+        write_log(sys.stdout, results, scored_time)
+    else:
+        with open(args.log, "w") as f:
+            write_log(f, results, scored_time)
+
+    best = min(results, key=lambda r: r[4] + r[5])
+    print(
+        f"Best: onset={best[0]} offset={best[1]} min_duration_on={best[2]} "
+        f"min_duration_off={best[3]} error={100 * (best[4] + best[5]) / scored_time:.2f}%",
+        file=sys.stderr,
+    )
@@ -1,9 +1,18 @@
 #!/usr/local/env/python3
 import argparse
+import os
+from functools import partial
 from pathlib import Path
 
+import numpy as np
+
 from pyannote.audio.pipelines import VoiceActivityDetection
 
+from diarizer.io_utils import find_audio_files, write_lab
+from diarizer.parallel import run_sharded, split_list
+from diarizer.vad.energy_gate import EnergyGate
+from diarizer.vad.segmentation import SegmentationScorer, binarize, save_scores
+
 
 def get_args():
     parser = argparse.ArgumentParser(
@@ -17,7 +26,7 @@ def get_args():
     parser.add_argument(
         "--file-list",
         type=str,
-        help="List of wav files to process.",
+        help="List of recordings (wav file names without extension) to process.",
     )
     parser.add_argument(
         "--out-dir",
@@ -56,36 +65,98 @@ def get_args():
         type=float,
         help="If provided, make start and end times multiples of this value.",
     )
+    parser.add_argument(
+        "--score-cache",
+        type=str,
+        default=None,
+        help="If provided, store the speech and overlap frame scores in this directory "
+        "(for tuning with hparam_search.py) and binarize them here instead of running "
+        "the pyannote pipeline.",
+    )
+    parser.add_argument(
+        "--pre-vad",
+        action="store_true",
+        help="Run the segmentation model only on the regions that are not clearly "
+        "silent, according to a cheap energy/spectral flux gate (see energy_gate.py). "
+        "Implies --batched.",
+    )
+    parser.add_argument(
+        "--batched",
+        action="store_true",
+        help="Score the chunks of consecutive recordings in batches (see "
+        "segmentation.py) and binarize the scores here, instead of running the "
+        "pyannote pipeline on each recording.",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=32,
+        help="Number of chunks (from one or more recordings) in each model call "
+        "(with --batched).",
+    )
+    parser.add_argument(
+        "--num-workers",
+        type=int,
+        default=1,
+        help="Number of worker processes; the recordings are split between them.",
+    )
+    parser.add_argument(
+        "--num-threads",
+        type=int,
+        default=None,
+        help="Number of threads per worker. By default, the cores are divided "
+        "between the workers.",
+    )
     return parser.parse_args()
 
 
-def main(args, in_dir, files, out_dir, HYPER_PARAMETERS):
-    out_dir.mkdir(exist_ok=True, parents=True)
-
+def pipeline_segments(args, HYPER_PARAMETERS, files):
     vad_pipeline = VoiceActivityDetection(
         segmentation=args.model, device="cpu", use_auth_token=args.use_auth_token
     )
     vad_pipeline.instantiate(HYPER_PARAMETERS)
-
-    for file in in_dir.rglob("*.wav"):
-        file_id = file.stem
-        if file_id not in files:
-            continue
+    for file in files:
         vad_out = vad_pipeline({"audio": file})
+        timeline = vad_out.get_timeline()
+        starts = np.array([segment.start for segment in timeline])
+        ends = np.array([segment.end for segment in timeline])
+        yield Path(file).stem, starts, ends
+
+
+def batched_segments(args, HYPER_PARAMETERS, files):
+    scorer = SegmentationScorer(
+        args.model,
+        use_auth_token=args.use_auth_token,
+        batch_size=args.batch_size,
+        gate=EnergyGate() if args.pre_vad else None,
+    )
+    for file, speech, overlap, times in scorer.score_files(files):
+        file_id = Path(file).stem
+        if args.score_cache is not None:
+            save_scores(args.score_cache, file_id, speech, overlap, times)
+        starts, ends = binarize(speech, times, **HYPER_PARAMETERS)
+        yield file_id, starts, ends
+
+
+def main(args, out_dir, HYPER_PARAMETERS, files):
+    if args.batched or args.pre_vad or args.score_cache is not None:
+        segments = batched_segments(args, HYPER_PARAMETERS, files)
+    else:
+        segments = pipeline_segments(args, HYPER_PARAMETERS, files)
+    for file_id, starts, ends in segments:
+        if args.align_time is not None:
+            starts = np.round(starts / args.align_time) * args.align_time
+            ends = np.round(ends / args.align_time) * args.align_time
         with open(f"{out_dir}/{file_id}.lab", "w") as f:
-            for start, end in vad_out.get_timeline():
-                if args.align_time is not None:
-                    start = round(start / args.align_time) * args.align_time
-                    end = round(end / args.align_time) * args.align_time
-                f.write(f"{start:.3f} {end:.3f} sp\n")
+            write_lab(f, starts, ends)
 
 
 if __name__ == "__main__":
     args = get_args()
-    in_dir = Path(args.in_dir)
     with open(args.file_list) as f:
-        files = [line.strip() for line in f]
+        files = find_audio_files(args.in_dir, [line.strip() for line in f])
     out_dir = Path(args.out_dir)
+    out_dir.mkdir(exist_ok=True, parents=True)
 
     HYPER_PARAMETERS = {
         "onset": args.onset,
@@ -94,4 +165,7 @@ if __name__ == "__main__":
         "min_duration_off": args.min_duration_off,
     }
 
-    main(args, in_dir, files, out_dir, HYPER_PARAMETERS)
+    shards = split_list(
+        files, args.num_workers, weights=[os.path.getsize(f) for f in files]
+    )
+    run_sharded(partial(main, args, out_dir, HYPER_PARAMETERS), shards, args.num_threads)
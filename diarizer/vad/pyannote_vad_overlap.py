@@ -0,0 +1,171 @@
+#!/usr/local/env/python3
+# Joint speech activity and overlap detection: the pyannote segmentation model is run
+# once per recording and both the speech (.lab) and the overlap (RTTM) regions are
+# obtained from the same frame scores (see segmentation.py). This replaces running
+# pyannote_vad.py and overlap/pyannote_overlap.py separately when the same model is
+# used for both.
+import argparse
+import os
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+
+from diarizer.io_utils import find_audio_files, write_lab, write_rttm
+from diarizer.parallel import run_sharded, split_list
+from diarizer.vad.energy_gate import EnergyGate
+from diarizer.vad.segmentation import SegmentationScorer, binarize, save_scores
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Run Pyannote speech activity and overlap detection."
+    )
+    parser.add_argument(
+        "--in-dir",
+        type=str,
+        help="Path to the input directory containing the wav files.",
+    )
+    parser.add_argument(
+        "--file-list",
+        type=str,
+        help="List of recordings (wav file names without extension) to process.",
+    )
+    parser.add_argument(
+        "--vad-out-dir",
+        type=str,
+        help="Path to the output directory where the label (.lab) files will be written.",
+    )
+    parser.add_argument(
+        "--ovl-out-dir",
+        type=str,
+        help="Path to the output directory where the overlap RTTM files will be written.",
+    )
+    parser.add_argument(
+        "--model",
+        type=str,
+        default="pyannote/segmentation",
+        help="Path to the model. If not provided, we use the pretrained model from HuggingFace.",
+    )
+    parser.add_argument(
+        "--use-auth-token",
+        type=str,
+        default=None,
+        help="HuggingFace auth token to use the model from HuggingFace.",
+    )
+    for task, name in [("vad", "speech"), ("ovl", "overlap")]:
+        parser.add_argument(
+            f"--{task}-onset", type=float, default=0.5, help=f"Onset threshold ({name})."
+        )
+        parser.add_argument(
+            f"--{task}-offset",
+            type=float,
+            default=0.5,
+            help=f"Offset threshold ({name}).",
+        )
+        parser.add_argument(
+            f"--{task}-min-duration-on",
+            type=float,
+            default=0.0,
+            help=f"Remove {name} regions shorter than that many seconds.",
+        )
+        parser.add_argument(
+            f"--{task}-min-duration-off",
+            type=float,
+            default=0.0,
+            help=f"Fill non-{name} regions shorter than that many seconds.",
+        )
+    parser.add_argument(
+        "--align-time",
+        default=None,
+        type=float,
+        help="If provided, make speech start and end times multiples of this value.",
+    )
+    parser.add_argument(
+        "--score-cache",
+        type=str,
+        default=None,
+        help="If provided, also store the speech and overlap frame scores in this "
+        "directory (for tuning with hparam_search.py).",
+    )
+    parser.add_argument(
+        "--pre-vad",
+        action="store_true",
+        help="Run the segmentation model only on the regions that are not clearly "
+        "silent, according to a cheap energy/spectral flux gate (see energy_gate.py).",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=32,
+        help="Number of chunks (from one or more recordings) in each model call.",
+    )
+    parser.add_argument(
+        "--num-workers",
+        type=int,
+        default=1,
+        help="Number of worker processes; the recordings are split between them.",
+    )
+    parser.add_argument(
+        "--num-threads",
+        type=int,
+        default=None,
+        help="Number of threads per worker. By default, the cores are divided "
+        "between the workers.",
+    )
+    return parser.parse_args()
+
+
+def main(args, vad_out_dir, ovl_out_dir, VAD_PARAMS, OVL_PARAMS, files):
+    scorer = SegmentationScorer(
+        args.model,
+        use_auth_token=args.use_auth_token,
+        batch_size=args.batch_size,
+        gate=EnergyGate() if args.pre_vad else None,
+    )
+    for file, speech, overlap, times in scorer.score_files(files):
+        file_id = Path(file).stem
+        if args.score_cache is not None:
+            save_scores(args.score_cache, file_id, speech, overlap, times)
+
+        starts, ends = binarize(speech, times, **VAD_PARAMS)
+        if args.align_time is not None:
+            starts = np.round(starts / args.align_time) * args.align_time
+            ends = np.round(ends / args.align_time) * args.align_time
+        with open(f"{vad_out_dir}/{file_id}.lab", "w") as f:
+            write_lab(f, starts, ends)
+
+        starts, ends = binarize(overlap, times, **OVL_PARAMS)
+        with open(f"{ovl_out_dir}/{file_id}.rttm", "w") as f:
+            write_rttm(f, file_id, starts, ends, ["overlap"] * len(starts))
+
+
+if __name__ == "__main__":
+    args = get_args()
+    with open(args.file_list) as f:
+        files = find_audio_files(args.in_dir, [line.strip() for line in f])
+    vad_out_dir, ovl_out_dir = Path(args.vad_out_dir), Path(args.ovl_out_dir)
+    vad_out_dir.mkdir(exist_ok=True, parents=True)
+    ovl_out_dir.mkdir(exist_ok=True, parents=True)
+
+    VAD_PARAMS = {
+        "onset": args.vad_onset,
+        "offset": args.vad_offset,
+        "min_duration_on": args.vad_min_duration_on,
+        "min_duration_off": args.vad_min_duration_off,
+    }
+    OVL_PARAMS = {
+        "onset": args.ovl_onset,
+        "offset": args.ovl_offset,
+        "min_duration_on": args.ovl_min_duration_on,
+        "min_duration_off": args.ovl_min_duration_off,
+    }
+
+    shards = split_list(
+        files, args.num_workers, weights=[os.path.getsize(f) for f in files]
+    )
+    run_sharded(
+        partial(main, args, vad_out_dir, ovl_out_dir, VAD_PARAMS, OVL_PARAMS),
+        shards,
+        args.num_threads,
+    )
@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+
+# @Authors: Desh Raj
+# @Emails: r.desh26@gmail.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Frame-level speech and overlap scores from a single pass of a pyannote segmentation
+# model. The model is run on sliding chunks of the recording and outputs, for each
+# chunk, frame scores for a few (local) speakers. As in the VoiceActivityDetection and
+# OverlappedSpeechDetection pipelines of pyannote.audio, the speech score of a frame is
+# the maximum over the speakers and the overlap score is the second highest score; the
+# chunk scores are then averaged over the overlapping chunks. Both are computed from
+# the same model outputs here, so VAD and overlap detection cost one inference pass.
+# The aggregated scores can be cached (as float16 .npy files, which are loaded with
+# memory mapping) so that the thresholds can be tuned without running the model again
+# (see hparam_search.py).
+
+from pathlib import Path
+
+import numpy as np
+
+
+def speech_scores(chunk_scores):
+    """Returns C x F x 1 speech scores from C x F x K chunk scores (K speakers)."""
+    return np.max(chunk_scores, axis=-1, keepdims=True)
+
+
+def overlap_scores(chunk_scores):
+    """Returns C x F x 1 overlap scores (second highest speaker score) from C x F x K
+    chunk scores (K speakers)."""
+    return np.partition(chunk_scores, -2, axis=-1)[..., -2:-1]
+
+
+def aggregate(chunk_scores, offsets, num_frames=None):
+    """Averages the scores of overlapping chunks.
+    Input:
+        chunk_scores - C x F x K scores of C chunks with F frames each (NaN for missing
+                       scores)
+        offsets      - index of the first frame of each chunk in the output
+        num_frames   - number of output frames (by default, up to the last chunk end)
+    Output:
+        T x K scores (NaN for frames not covered by any chunk)
+    """
+    num_chunks, chunk_frames, dim = chunk_scores.shape
+    offsets = np.asarray(offsets, dtype=int)
+    if num_frames is None:
+        num_frames = offsets.max() + chunk_frames if num_chunks > 0 else 0
+    index = (offsets[:, np.newaxis] + np.arange(chunk_frames)).ravel()
+    keep = index < num_frames
+    index = index[keep]
+    mask = ~np.isnan(chunk_scores.reshape(-1, dim)[keep])
+    scores = np.where(mask, chunk_scores.reshape(-1, dim)[keep], 0.0)
+    counts = np.zeros((num_frames, dim))
+    total = np.zeros((num_frames, dim))
+    for k in range(dim):
+        counts[:, k] = np.bincount(index, weights=mask[:, k], minlength=num_frames)
+        total[:, k] = np.bincount(index, weights=scores[:, k], minlength=num_frames)
+    average = total / np.maximum(counts, 1e-12)
+    average[counts == 0] = np.nan
+    return average
+
+
+def hysteresis(scores, onset=0.5, offset=0.5):
+    """Returns boolean vector with the active frames after hysteresis thresholding: an
+    inactive frame becomes active if its score is above 'onset' and an active frame
+    becomes inactive if its score is below 'offset' (as in pyannote's Binarize). The
+    state machine is evaluated without a loop over frames: frames that set the state
+    regardless of the previous one are located first, and the remaining frames either
+    keep the state or (for onset < offset) toggle it."""
+    scores = np.asarray(scores)
+    up, down = scores > onset, scores < offset
+    is_set = up != down
+    is_set[0] = True
+    toggles = np.cumsum(up & down)
+    # index of the last frame that set the state, for every frame
+    last_set = np.maximum.accumulate(np.where(is_set, np.arange(len(scores)), 0))
+    value = np.where(is_set, up, False)
+    value[0] = up[0]
+    flips = (toggles - toggles[last_set]) % 2 == 1
+    return value[last_set] != flips
+
+
+def binarize(
+    scores,
+    times,
+    onset=0.5,
+    offset=0.5,
+    min_duration_on=0.0,
+    min_duration_off=0.0,
+):
+    """Converts frame scores to active regions with hysteresis thresholding, with the
+    same conventions as pyannote.audio.utils.signal.Binarize: a region starts at a
+    frame with score above 'onset' and ends at the next frame with score below
+    'offset'; then gaps shorter than 'min_duration_off' are filled and regions shorter
+    than 'min_duration_on' are removed.
+    Input:
+        scores - vector of frame scores
+        times  - vector of frame times (e.g. frame middles)
+    Outputs:
+        starts, ends - arrays of region start and end times
+    """
+    if len(scores) == 0:
+        return np.zeros(0), np.zeros(0)
+    active = hysteresis(scores, onset, offset)
+    changes = np.nonzero(active[1:] != active[:-1])[0] + 1
+    bounds = np.r_[0 if active[0] else [], changes, len(active) - 1 if active[-1] else []]
+    starts, ends = np.asarray(times)[bounds.astype(int)].reshape(-1, 2).T
+    return postprocess(starts, ends, min_duration_on, min_duration_off)
+
+
+def postprocess(starts, ends, min_duration_on=0.0, min_duration_off=0.0):
+    """Fills gaps shorter than 'min_duration_off' between the (sorted, disjoint) regions
+    and then removes regions shorter than 'min_duration_on'."""
+    starts, ends = starts[ends > starts], ends[ends > starts]
+    if min_duration_off > 0.0 and len(starts) > 0:
+        first = np.r_[True, starts[1:] - ends[:-1] >= min_duration_off]
+        last = np.r_[first[1:], True]
+        starts, ends = starts[first], ends[last]
+    if min_duration_on > 0.0:
+        keep = ends - starts >= min_duration_on
+        starts, ends = starts[keep], ends[keep]
+    return starts, ends
+
+
+class SegmentationScorer:
+    """Runs a pyannote segmentation model on recordings and returns the aggregated
+    speech and overlap frame scores from the same chunk outputs. The sliding chunks of
+    consecutive recordings are batched together, so that short recordings (or the
+    last chunks of a recording) do not result in small model calls. With a gate, only
+    the candidate speech regions of each recording are scored."""
+
+    def __init__(
+        self,
+        model="pyannote/segmentation",
+        use_auth_token=None,
+        device="cpu",
+        batch_size=32,
+        step=None,
+        gate=None,
+    ):
+        import torch
+        from pyannote.audio.pipelines.utils import get_model
+
+        self.model = get_model(model, use_auth_token=use_auth_token)
+        self.model.eval()
+        self.device = torch.device(device)
+        self.model.to(self.device)
+        self.batch_size = batch_size
+        # optional function returning candidate speech regions (see energy_gate.py);
+        # the model is then only run on these regions
+        self.gate = gate
+        self.frames = self.model.introspection.frames
+        # same chunking as pyannote.audio.Inference (10% step by default)
+        self.duration = self.model.specifications.duration
+        self.step = 0.1 * self.duration if step is None else step
+        sample_rate = self.model.audio.sample_rate
+        self.window_size = int(round(self.duration * sample_rate))
+        self.step_size = int(round(self.step * sample_rate))
+
+    def num_chunks(self, num_samples):
+        """Number of chunks of a recording (the last one is zero padded)."""
+        num_chunks = 0
+        if num_samples >= self.window_size:
+            num_chunks = (num_samples - self.window_size) // self.step_size + 1
+        has_last_chunk = (num_samples < self.window_size) or (
+            num_samples - self.window_size
+        ) % self.step_size > 0
+        return num_chunks + has_last_chunk
+
+    def frame_layout(self, num_chunks):
+        """Returns the output frame index of the first frame of each chunk, the number
+        of output frames and the output frame times (middles), following
+        pyannote.audio.Inference.aggregate."""
+        step, duration = self.frames.step, self.frames.duration
+        # index of the frame (of the whole recording) closest to the chunk boundaries
+        offsets = np.rint(np.arange(num_chunks) * self.step / step).astype(int)
+        num_frames = int(np.rint((self.duration + (num_chunks - 1) * self.step) / step)) + 1
+        times = np.arange(num_frames) * step + 0.5 * duration
+        return offsets, num_frames, times
+
+    def _infer(self, pieces):
+        # pieces is a list of (waveform, first chunk, number of chunks)
+        import torch
+        import torch.nn.functional as F
+
+        batch = []
+        for waveform, first, count in pieces:
+            for i in range(first, first + count):
+                start = i * self.step_size
+                chunk = waveform[:, start : start + self.window_size]
+                batch.append(F.pad(chunk, (0, self.window_size - chunk.shape[1])))
+        with torch.no_grad():
+            outputs = self.model(torch.stack(batch).to(self.device))
+        return outputs.cpu().numpy()
+
+    def _parts(self, file):
+        # Returns the parts of a recording to run the model on, as dictionaries with
+        # the waveform and the offset of the part in the recording: the whole recording
+        # or, with a gate, its candidate speech regions. The file can also be given in
+        # memory, as a dictionary with the "waveform" (channel, time) and "sample_rate".
+        waveform, sample_rate = self.model.audio(
+            file if isinstance(file, dict) else {"audio": file}
+        )
+        regions = [(0, waveform.shape[1])]
+        if self.gate is not None:
+            starts, ends = self.gate(waveform.numpy().mean(axis=0), sample_rate)
+            starts, ends = np.rint(starts * sample_rate), np.rint(ends * sample_rate)
+            regions = list(zip(starts, ends))
+            # without candidate regions, the recording is returned with zero scores
+            regions = [(0, 0)] if not regions else regions
+        parts = []
+        for start, end in regions:
+            part = waveform[:, int(start) : int(end)]
+            parts.append(
+                {
+                    "file": file,
+                    "num_samples": waveform.shape[1],
+                    "offset": int(start) / sample_rate,
+                    "waveform": part,
+                    "num_chunks": self.num_chunks(part.shape[1]) if end > start else 0,
+                    "outputs": [],
+                    "num_scored": 0,
+                }
+            )
+        parts[-1]["last"] = True
+        return parts
+
+    def score_files(self, files):
+        """Scores the recordings in 'files' (paths to audio files, or dictionaries with
+        the "waveform" and "sample_rate"), batching the chunks of consecutive recordings.
+        Yields:
+            (file, speech, overlap, times) for each recording, in the input order (see
+            __call__)
+        """
+        pending = []
+        num_unscored = 0
+        files = iter(files)
+        while True:
+            file = next(files, None)
+            if file is not None:
+                parts = self._parts(file)
+                pending.extend(parts)
+                num_unscored += sum(part["num_chunks"] for part in parts)
+            while num_unscored >= self.batch_size or (file is None and num_unscored):
+                pieces, needed = [], self.batch_size
+                for part in pending:
+                    count = min(part["num_chunks"] - part["num_scored"], needed)
+                    if count > 0:
+                        pieces.append((part, part["num_scored"], count))
+                        part["num_scored"] += count
+                        needed -= count
+                    if needed == 0:
+                        break
+                outputs = self._infer(
+                    [(part["waveform"], first, n) for part, first, n in pieces]
+                )
+                for part, _, count in pieces:
+                    part["outputs"].append(outputs[:count])
+                    outputs = outputs[count:]
+                    num_unscored -= count
+            # return the recordings whose parts have all been scored
+            done = 0
+            for i, part in enumerate(pending):
+                if part["num_scored"] < part["num_chunks"]:
+                    break
+                if part.get("last", False):
+                    yield self._aggregate(pending[done : i + 1])
+                    done = i + 1
+            del pending[:done]
+            if file is None:
+                break
+
+    def _aggregate(self, parts):
+        # aggregates the chunk scores of each part and places them in the frames of the
+        # whole recording (frames outside the parts get zero scores)
+        _, num_frames, times = self.frame_layout(
+            self.num_chunks(parts[0]["num_samples"])
+        )
+        speech, overlap = np.zeros(num_frames), np.zeros(num_frames)
+        for part in parts:
+            if part["num_chunks"] == 0:
+                continue
+            chunk_scores = np.concatenate(part["outputs"])
+            offsets, part_frames, _ = self.frame_layout(len(chunk_scores))
+            first = int(np.rint(part["offset"] / self.frames.step))
+            last = min(first + part_frames, num_frames)
+            speech[first:last] = aggregate(
+                speech_scores(chunk_scores), offsets, part_frames
+            )[: last - first, 0]
+            overlap[first:last] = aggregate(
+                overlap_scores(chunk_scores), offsets, part_frames
+            )[: last - first, 0]
+        return parts[0]["file"], speech, overlap, times
+
+    def __call__(self, audio):
+        """Input:
+            audio - path to an audio file (or dictionary, see score_files)
+        Outputs:
+            speech, overlap - vectors of speech and overlap frame scores
+            times           - vector of frame times
+        """
+        _, speech, overlap, times = next(self.score_files([audio]))
+        return speech, overlap, times
+
+
+def save_scores(cache_dir, file_id, speech, overlap, times):
+    """Stores the speech and overlap frame scores of a recording in 'cache_dir' as a
+    T x 2 float16 array (<file_id>.npy), with the frame start time and step in
+    <file_id>.frames."""
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(exist_ok=True, parents=True)
+    np.save(cache_dir / f"{file_id}.npy", np.c_[speech, overlap].astype(np.float16))
+    step = times[1] - times[0] if len(times) > 1 else 0.0
+    with open(cache_dir / f"{file_id}.frames", "w") as f:
+        f.write(f"{float(times[0])!r} {float(step)!r}\n")
+
+
+def load_scores(cache_dir, file_id):
+    """Loads the scores stored by save_scores (memory mapped).
+    Outputs:
+        speech, overlap - vectors of speech and overlap frame scores
+        times           - vector of frame times
+    """
+    cache_dir = Path(cache_dir)
+    scores = np.load(cache_dir / f"{file_id}.npy", mmap_mode="r")
+    with open(cache_dir / f"{file_id}.frames") as f:
+        start, step = map(float, f.read().split())
+    return scores[:, 0], scores[:, 1], start + np.arange(len(scores)) * step
@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+
+# @Authors: Desh Raj
+# @Emails: r.desh26@gmail.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Streaming speech activity and overlap detection. The audio is fed in chunks of any
+# size (e.g. as it arrives from a live meeting), the segmentation model is run on each
+# sliding window as soon as the window is complete, and the window scores are added to
+# running sums. A frame is final once no later window covers it; the final frames are
+# binarized incrementally and the speech and overlap regions are returned as soon as
+# they can no longer change. The results are the same as for the whole recording
+# (segmentation.SegmentationScorer and segmentation.binarize), and the delay is bounded
+# by the window duration plus min_duration_off.
+#
+# When run as a script, simulates a live stream for each recording and writes the
+# regions to the .lab and overlap RTTM files as soon as they are final.
+
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+from diarizer.vad.segmentation import hysteresis, overlap_scores, speech_scores
+
+
+class StreamingBinarizer:
+    """Incremental version of segmentation.binarize: scores are added in order with
+    update(), which returns the regions that are final."""
+
+    def __init__(self, onset=0.5, offset=0.5, min_duration_on=0.0, min_duration_off=0.0):
+        self.onset = onset
+        self.offset = offset
+        self.min_duration_on = min_duration_on
+        self.min_duration_off = min_duration_off
+        self.reset()
+
+    def reset(self):
+        self.is_active = None  # no frames yet
+        self.start = None  # start of the current region (if active)
+        self.last_time = None
+        self.pending = None  # region that may still be merged with the next one
+
+    def _add_region(self, start, end, starts, ends):
+        # merges the region with the pending one (if the gap is too short), and moves
+        # the pending region to the output otherwise
+        if end <= start:
+            return
+        if self.pending is not None and start - self.pending[1] < self.min_duration_off:
+            self.pending = (self.pending[0], end)
+            return
+        self._emit(starts, ends)
+        self.pending = (start, end)
+
+    def _emit(self, starts, ends):
+        if self.pending is not None:
+            if self.pending[1] - self.pending[0] >= self.min_duration_on:
+                starts.append(self.pending[0])
+                ends.append(self.pending[1])
+            self.pending = None
+
+    def update(self, scores, times):
+        """Adds frame scores (with their times) and returns the final regions as
+        arrays of start and end times."""
+        starts, ends = [], []
+        if len(scores) > 0:
+            scores = np.asarray(scores)
+            if self.is_active is None:
+                active = hysteresis(scores, self.onset, self.offset)
+                was_active = np.r_[False, active[:-1]]
+            else:
+                # the state before the first frame is set with a virtual frame
+                virtual = np.inf if self.is_active else -np.inf
+                active = hysteresis(np.r_[virtual, scores], self.onset, self.offset)[1:]
+                was_active = np.r_[self.is_active, active[:-1]]
+            for i in np.nonzero(active != was_active)[0]:
+                if active[i]:
+                    self.start = times[i]
+                else:
+                    self._add_region(self.start, times[i], starts, ends)
+            self.is_active = active[-1]
+            self.last_time = times[-1]
+        # the pending region is final if the gap after it is already long enough
+        if self.pending is not None:
+            next_start = self.start if self.is_active else self.last_time
+            if next_start - self.pending[1] >= self.min_duration_off:
+                self._emit(starts, ends)
+        return np.array(starts, dtype=float), np.array(ends, dtype=float)
+
+    def flush(self):
+        """Closes the current region (at the last frame) and returns the remaining
+        regions."""
+        starts, ends = [], []
+        if self.is_active:
+            self._add_region(self.start, self.last_time, starts, ends)
+        self._emit(starts, ends)
+        self.reset()
+        return np.array(starts, dtype=float), np.array(ends, dtype=float)
+
+
+class StreamingDetector:
+    """Streaming speech and overlap detection with the model and the chunking of a
+    segmentation.SegmentationScorer.
+    Input (of update):
+        samples - vector with the next audio samples (at the sample rate of the model)
+    Outputs:
+        speech, overlap - (starts, ends) of the speech and overlap regions that became
+                          final (each region is returned once)
+    """
+
+    def __init__(self, scorer, vad_params=None, ovl_params=None):
+        self.scorer = scorer
+        self.speech_binarizer = StreamingBinarizer(**(vad_params or {}))
+        self.overlap_binarizer = StreamingBinarizer(**(ovl_params or {}))
+        self.reset()
+
+    def reset(self):
+        self.buffer = np.zeros(0, dtype=np.float32)
+        self.buffer_start = 0  # index of the first buffered sample
+        self.num_samples = 0
+        self.num_windows = 0  # number of windows already scored
+        # running sums and counts (speech, overlap) of the frames that are not final
+        self.first_frame = 0
+        self.sums = np.zeros((0, 2))
+        self.counts = np.zeros((0, 2))
+        self.speech_binarizer.reset()
+        self.overlap_binarizer.reset()
+
+    def _window_offset(self, k):
+        # index of the first frame of window k (see SegmentationScorer.frame_layout)
+        return int(np.rint(k * self.scorer.step / self.scorer.frames.step))
+
+    def _score_windows(self, num_windows):
+        # scores windows self.num_windows, ..., num_windows-1 and adds their scores
+        import torch
+
+        if num_windows <= self.num_windows:
+            return
+        step_size = self.scorer.step_size
+        first_sample = self.num_windows * step_size - self.buffer_start
+        waveform = torch.from_numpy(self.buffer[np.newaxis, first_sample:])
+        count = num_windows - self.num_windows
+        outputs = []
+        for i in range(0, count, self.scorer.batch_size):
+            n = min(self.scorer.batch_size, count - i)
+            outputs.append(self.scorer._infer([(waveform, i, n)]))
+        chunk_scores = np.concatenate(outputs)
+        chunk_scores = np.concatenate(
+            [speech_scores(chunk_scores), overlap_scores(chunk_scores)], axis=-1
+        )
+        chunk_frames = chunk_scores.shape[1]
+        last = self._window_offset(num_windows - 1) + chunk_frames - self.first_frame
+        if last > len(self.sums):
+            self.sums = np.r_[self.sums, np.zeros((last - len(self.sums), 2))]
+            self.counts = np.r_[self.counts, np.zeros((last - len(self.counts), 2))]
+        for k, scores in zip(range(self.num_windows, num_windows), chunk_scores):
+            start = self._window_offset(k) - self.first_frame
+            mask = ~np.isnan(scores)
+            self.sums[start : start + chunk_frames] += np.where(mask, scores, 0.0)
+            self.counts[start : start + chunk_frames] += mask
+        self.num_windows = num_windows
+        # drop the samples that no later window needs
+        keep_from = num_windows * step_size - self.buffer_start
+        self.buffer = self.buffer[keep_from:]
+        self.buffer_start += keep_from
+
+    def _finalize(self, num_final):
+        # binarizes the frames up to num_final (exclusive) and drops them
+        num = num_final - self.first_frame
+        if num <= 0:
+            return (np.zeros(0), np.zeros(0)), (np.zeros(0), np.zeros(0))
+        if num > len(self.sums):
+            self.sums = np.r_[self.sums, np.zeros((num - len(self.sums), 2))]
+            self.counts = np.r_[self.counts, np.zeros((num - len(self.counts), 2))]
+        average = self.sums[:num] / np.maximum(self.counts[:num], 1e-12)
+        average[self.counts[:num] == 0] = np.nan
+        frames = self.scorer.frames
+        times = (self.first_frame + np.arange(num)) * frames.step + 0.5 * frames.duration
+        speech = self.speech_binarizer.update(average[:, 0], times)
+        overlap = self.overlap_binarizer.update(average[:, 1], times)
+        self.sums, self.counts = self.sums[num:], self.counts[num:]
+        self.first_frame = num_final
+        return speech, overlap
+
+    def update(self, samples):
+        self.buffer = np.r_[self.buffer, np.asarray(samples, dtype=np.float32)]
+        self.num_samples += len(samples)
+        window_size, step_size = self.scorer.window_size, self.scorer.step_size
+        num_windows = 0
+        if self.num_samples >= window_size:
+            num_windows = (self.num_samples - window_size) // step_size + 1
+        self._score_windows(num_windows)
+        # frames before the start of the next window are final
+        return self._finalize(self._window_offset(self.num_windows))
+
+    def flush(self):
+        """Scores the end of the stream (with a zero padded last window) and returns
+        the remaining regions. The detector is then reset for a new stream."""
+        num_windows = self.scorer.num_chunks(self.num_samples)
+        self._score_windows(num_windows)
+        _, num_frames, _ = self.scorer.frame_layout(num_windows)
+        speech, overlap = self._finalize(num_frames)
+        speech = [np.r_[a, b] for a, b in zip(speech, self.speech_binarizer.flush())]
+        overlap = [np.r_[a, b] for a, b in zip(overlap, self.overlap_binarizer.flush())]
+        self.reset()
+        return tuple(speech), tuple(overlap)
+
+
+if __name__ == "__main__":
+    import soundfile as sf
+
+    from diarizer.io_utils import find_audio_files, write_lab, write_rttm
+    from diarizer.vad.segmentation import SegmentationScorer
+
+    parser = argparse.ArgumentParser(
+        description="Run streaming speech activity and overlap detection."
+    )
+    parser.add_argument("--in-dir", type=str, help="Directory with the wav files.")
+    parser.add_argument("--file-list", type=str, help="List of recordings to process.")
+    parser.add_argument("--vad-out-dir", type=str, help="Output directory for .lab files.")
+    parser.add_argument(
+        "--ovl-out-dir", type=str, help="Output directory for overlap RTTM files."
+    )
+    parser.add_argument("--model", type=str, default="pyannote/segmentation")
+    parser.add_argument("--use-auth-token", type=str, default=None)
+    parser.add_argument(
+        "--step",
+        type=float,
+        default=None,
+        help="Step between windows in seconds (by default, 10%% of the window).",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=float,
+        default=1.0,
+        help="Duration (in seconds) of the audio chunks fed to the detector.",
+    )
+    for task, name in [("vad", "speech"), ("ovl", "overlap")]:
+        parser.add_argument(
+            f"--{task}-onset", type=float, default=0.5, help=f"Onset threshold ({name})."
+        )
+        parser.add_argument(
+            f"--{task}-offset",
+            type=float,
+            default=0.5,
+            help=f"Offset threshold ({name}).",
+        )
+        parser.add_argument(
+            f"--{task}-min-duration-on",
+            type=float,
+            default=0.0,
+            help=f"Remove {name} regions shorter than that many seconds.",
+        )
+        parser.add_argument(
+            f"--{task}-min-duration-off",
+            type=float,
+            default=0.0,
+            help=f"Fill non-{name} regions shorter than that many seconds.",
+        )
+    args = parser.parse_args()
+
+    scorer = SegmentationScorer(
+        args.model, use_auth_token=args.use_auth_token, step=args.step
+    )
+    detector = StreamingDetector(
+        scorer,
+        vad_params={
+            "onset": args.vad_onset,
+            "offset": args.vad_offset,
+            "min_duration_on": args.vad_min_duration_on,
+            "min_duration_off": args.vad_min_duration_off,
+        },
+        ovl_params={
+            "onset": args.ovl_onset,
+            "offset": args.ovl_offset,
+            "min_duration_on": args.ovl_min_duration_on,
+            "min_duration_off": args.ovl_min_duration_off,
+        },
+    )
+    vad_out_dir, ovl_out_dir = Path(args.vad_out_dir), Path(args.ovl_out_dir)
+    vad_out_dir.mkdir(exist_ok=True, parents=True)
+    ovl_out_dir.mkdir(exist_ok=True, parents=True)
+    with open(args.file_list) as f:
+        files = find_audio_files(args.in_dir, [line.strip() for line in f])
+
+    for file in files:
+        file_id = file.stem
+        print(file_id)
+        signal, sample_rate = sf.read(file, dtype="float32")
+        assert sample_rate == scorer.model.audio.sample_rate
+        if signal.ndim > 1:
+            signal = signal.mean(axis=1)
+        chunk_size = int(args.chunk_size * sample_rate)
+        with open(vad_out_dir / f"{file_id}.lab", "w") as f_lab, open(
+            ovl_out_dir / f"{file_id}.rttm", "w"
+        ) as f_rttm:
+            for i in range(0, len(signal) + chunk_size, chunk_size):
+                if i < len(signal):
+                    speech, overlap = detector.update(signal[i : i + chunk_size])
+                else:
+                    speech, overlap = detector.flush()
+                write_lab(f_lab, *speech)
+                write_rttm(f_rttm, file_id, *overlap, ["overlap"] * len(overlap[0]))
+                f_lab.flush()
+                f_rttm.flush()
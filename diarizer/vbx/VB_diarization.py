@@ -48,6 +48,8 @@ def VB_diarization(
     minDur=1,
     Fa=1.0,
     Fb=1.0,
+    dtype=np.float64,
+    spkPrior=None,
 ):
 
     """
@@ -78,6 +80,14 @@ def VB_diarization(
                   in a chain share the same output distribution
     Fa          - scale sufficient statistics collected using UBM
     Fb          - speaker regularization coefficient Fb (controls final # of speaker)
+    dtype       - floating point type used for the features, the speaker models, the
+                  per-frame log-likelihoods and posteriors (e.g. np.float32 to halve the
+                  memory traffic on long recordings). The forward-backward messages,
+                  the speaker priors and the ELBO are always computed in float64.
+    spkPrior    - tuple (a, invL) with S x R means and S x R x R covariance matrices of
+                  Gaussian priors on the speaker factors, e.g. the speaker posteriors
+                  from previously processed frames. If None, standard normal priors are
+                  used as in the paper.
 
     Outputs:
     gamma  - S x T matrix of posteriors attribution each frame to one of S possible
@@ -91,6 +101,7 @@ def VB_diarization(
 
     nframes, D = X.shape  # feature dimensionality
     R = V.shape[0]  # subspace rank
+    X, m, iE, V = (np.asarray(arr, dtype=dtype) for arr in (X, m, iE, V))
 
     if pi is None:
         pi = np.ones(maxSpeakers) / maxSpeakers
@@ -101,12 +112,13 @@ def VB_diarization(
         # initialize gamma from flat Dirichlet prior with concentration parameter alphaQInit
         gamma = np.random.gamma(alphaQInit, size=(nframes, maxSpeakers))
         gamma = gamma / gamma.sum(1, keepdims=True)
+    gamma = gamma.astype(dtype, copy=False)
 
     # calculate UBM mixture frame posteriors (i.e. per-frame zero order statistics)
     G = -0.5 * (
         np.sum((X - m).dot(iE) * (X - m), axis=1) - logdet(iE) + D * np.log(2 * np.pi)
     )
-    LL = np.sum(G)  # total log-likelihood as calculated using UBM
+    LL = np.sum(G, dtype=np.float64)  # total log-likelihood as calculated using UBM
     VtiEV = V.dot(iE).dot(V.T)
     VtiEF = (X - m).dot(iE.dot(V).T)
 
@@ -114,6 +126,17 @@ def VB_diarization(
     if ref is not None:
         Li[-1] += [DER(gamma, ref), DER(gamma, ref, xentropy=True)]
 
+    # Means and precision matrices of the priors on the speaker factors
+    if spkPrior is None:
+        a0 = np.zeros((maxSpeakers, R))
+        iL0 = np.broadcast_to(np.eye(R, dtype=dtype), (maxSpeakers, R, R))
+        ld0 = np.zeros(maxSpeakers)  # log-determinants of the prior covariances
+    else:
+        a0, invL0 = spkPrior
+        iL0 = np.linalg.inv(invL0).astype(dtype)
+        ld0 = np.array([logdet(invL0[sid]) for sid in range(maxSpeakers)])
+    iL0a0 = np.matmul(iL0, a0[:, :, np.newaxis].astype(dtype))
+
     tr = np.eye(minDur * maxSpeakers, k=1)
     ip = np.zeros(minDur * maxSpeakers)
     for i in range(maxIters):
@@ -125,9 +148,9 @@ def VB_diarization(
             :, :, np.newaxis
         ]  # eq. (35) except for \Lambda_s^{-1} for all 's'
         invLs = np.linalg.inv(
-            np.eye(R)[np.newaxis, :, :] + Ns * VtiEV[np.newaxis, :, :] * Fa / Fb
+            iL0 + Ns * VtiEV[np.newaxis, :, :] * Fa / Fb
         )  # eq. (34) inverse
-        a = np.matmul(invLs, VtiEFs).squeeze(axis=-1) * Fa / Fb  # eq. (35)
+        a = np.matmul(invLs, VtiEFs * Fa / Fb + iL0a0).squeeze(axis=-1)  # eq. (35)
         # eq. (29) except for the prior term \ln \pi_s. Our prior is given by HMM
         # transition probability matrix. Instead of eq. (30), we need to use
         # forward-backward algorithm to calculate per-frame speaker posteriors,
@@ -142,13 +165,18 @@ def VB_diarization(
             ).sum(axis=(1, 2))
         )
 
+        # -KL{q(Y)||p(Y)}, which reduces to the expression in eq. (37) for the standard
+        # normal priors
         for sid in range(maxSpeakers):
+            a_diff = (a[sid] - a0[sid]).astype(np.float64)
             L += (
                 Fb
                 * 0.5
                 * (
-                    logdet(invLs[sid])
-                    - np.sum(np.diag(invLs[sid]) + a[sid] ** 2, 0)
+                    logdet(invLs[sid].astype(np.float64))
+                    - ld0[sid]
+                    - np.sum(iL0[sid] * invLs[sid], dtype=np.float64)
+                    - a_diff.dot(iL0[sid]).dot(a_diff)
                     + R
                 )
             )
@@ -185,7 +213,7 @@ def VB_diarization(
 
         # per-frame speaker posteriors (analogue to eq. (30)), obtained by summing
         # HMM state posteriors corresponding to each speaker
-        gamma = gamma.reshape(len(gamma), maxSpeakers, minDur).sum(axis=2)
+        gamma = gamma.reshape(len(gamma), maxSpeakers, minDur).sum(axis=2).astype(dtype)
 
         # if reference is provided, report DER, cross-entropy and plot the figures
         if ref is not None:
@@ -237,41 +265,48 @@ def VB_diarization_coupled(
 
     """
     Inputs:
-    X           - K x T x D array, with K streams, each containing T frames and D dimensional x-vectors
-    m           - C x D array of GMM component means
-    iE          - C x D array of GMM component inverse covariance matrix diagonals
-    V           - R x C x D array of eigenvoices
-    pi          - speaker pair priors, if any used for initialization
-    gamma       - frame posteriors for K streams, if any used for initialization
-    maxSpeakers - maximum number of speakers expected in the utterance
-    maxIters    - maximum number of algorithm iterations
-    epsilon     - stop iterating, if obj. fun. improvement is less than epsilon
-    loopProb    - probability of not switching speakers between frames
-    alphaQInit  - Dirichlet concentration parameter for initializing gamma
-    Fa          - scale sufficient statistics collected using UBM
-    Fb          - speaker regularization coefficient Fb (controls final # of speaker)
+    X            - K x T x D array, with K streams, each containing T frames and D dimensional x-vectors
+    m            - C x D array of GMM component means
+    iE           - C x D array of GMM component inverse covariance matrix diagonals
+    V            - R x C x D array of eigenvoices
+    pi           - speaker tuple priors (not supported, must be None)
+    gamma        - K x T x S frame posteriors for K streams, if any used for initialization
+    maxSpeakers  - maximum number of speakers expected in the utterance
+    maxIters     - maximum number of algorithm iterations
+    epsilon      - stop iterating, if obj. fun. improvement is less than epsilon
+    loopProbSame - probability of not leaving a state where all streams have the same speaker
+    loopProbDiff - probability of not leaving a state with different speakers in the streams
+    alphaQInit   - Dirichlet concentration parameter for initializing gamma
+    Fa           - scale sufficient statistics collected using UBM
+    Fb           - speaker regularization coefficient Fb (controls final # of speaker)
 
     Outputs:
-    gamma   - K x S x T matrix of posteriors attribution each frame to one of S possible
+    gamma   - K x T x S matrix of posteriors attribution each frame to one of S possible
              speakers, where S is given by opts.maxSpeakers, for each of the K streams
-    pi - S x S matrix vector of ML learned priors for speaker pairs. Ideally, these
-         should allow to estimate # of speaker in the utterance as the
-         probabilities of the redundant speakers should converge to zero.
-    Li - values of auxiliary function (and DER and frame cross-entropy between gamma
-         and reference if 'ref' is provided) over iterations.
+    pi - S^K dimensional vector of ML learned priors for speaker tuples (stream 0 is the
+         most significant index). Ideally, these should allow to estimate # of speaker
+         in the utterance as the probabilities of the redundant speakers should converge
+         to zero.
+    Li - values of auxiliary function over iterations.
     """
 
     K, nframes, D = X.shape  # feature dimensionality
     R = V.shape[0]  # subspace rank
+    S = maxSpeakers
+    nstates = S ** K  # one HMM state per speaker tuple
+
+    # Speaker assigned to each stream in every state (K x S^K) and the indices of
+    # the "same" states, i.e. the states where all K streams have the same speaker.
+    spk_of_state = np.indices((S,) * K).reshape(K, nstates)
+    same = np.ravel_multi_index((np.arange(S),) * K, (S,) * K)
 
     if pi is None:
-        # Initial probabilities are 0.1 for speaker pairs and 1 for single speakers
-        pi = np.ones(maxSpeakers ** K) * 0.1
-        for i in range(maxSpeakers):
-            pi[i * (maxSpeakers + 1)] = 1.0
+        # Initial probabilities are 0.1 for mixed tuples and 1 for single speakers
+        pi = np.ones(nstates) * 0.1
+        pi[same] = 1.0
         pi /= pi.sum()
     else:
-        ValueError("Initial speaker pair probabilities not supported")
+        raise ValueError("Initial speaker tuple probabilities not supported")
 
     if gamma is None:
         # initialize gamma from flat Dirichlet prior with concentration parameter alphaQInit
@@ -293,43 +328,38 @@ def VB_diarization_coupled(
 
     Li = [[LL * Fa]]  # for the 0-th iteration,
 
-    tr = np.eye(maxSpeakers ** K)  # transition matrix
-    # Construct transition probability matrix with 'maxSpeaker^2' speaker pairs.
+    # The transition probability matrix over the S^K speaker tuples is never formed
+    # explicitly, since it only has the following block structure. This is the key
+    # part of the coupled VBx where it differs from original VBx:
+    # - for same-speaker states, self-loop probability is 'loopProbSame' and the
+    # transition probability to other states is given by vector '(1-loopProbSame) * pi'
+    # - for mixed-speaker states, self-loop probability is 'loopProbDiff' and the
+    # remaining '1-loopProbDiff' is split equally among the same-speaker states of the
+    # speakers in the current tuple, and 0 for every other state. This encodes the
+    # constraint that 2 different speakers cannot start or stop speaking at the same time.
+    # See forward_backward_coupled() for how these blocks are used.
     # Note that here we remove the 'minDur' parameter to keep the code simple.
-    # This is the key part of the coupled VBx where it differs from original VBx:
-    # - for same-speaker pair states, self-loop probability is 'loopProbSame'
-    # - for different-speaker pair states, self-loop probability is 'loopProbDiff'
-    # - for same-speaker pair states, the transition probability to other states
-    # is given by vector '(1-loopProb) * pi'
-    # - for mix-speaker pairs, the transition probability to same-speaker pairs
-    # for the speakers in the current pair is given by '(1-loopProb) * 0.5', and
-    # 0 for every other state. This encodes the constraint that 2 different speakers
-    # cannot start or stop speaking at the same time.
-    for i in range(maxSpeakers ** K):
-        if i % (maxSpeakers+1) == 0:  # same speaker pair
-            tr[i, :] = (1 - loopProbSame) * pi
-        else:  # mix speaker pair
-            tr[i, i % maxSpeakers] = (1 - loopProbDiff) * 0.5
-            tr[i, i // maxSpeakers] = (1 - loopProbDiff) * 0.5
-    for i in range(maxSpeakers ** K):
-        if i % (maxSpeakers + 1) == 0:  # same speaker pair
-            tr[i, i] += loopProbSame
-        else:  # mix speaker pair
-            tr[i, i] += loopProbDiff
-    tr /= tr.sum(axis=1, keepdims=True)
-    ip = np.zeros(maxSpeakers ** K)  # initial state probabilities
-    
+    spk_in_state = np.zeros((S, nstates))
+    spk_in_state[spk_of_state, np.arange(nstates)] = 1.0
+    is_same = np.zeros(nstates, dtype=bool)
+    is_same[same] = True
+    loop = np.where(is_same, loopProbSame, loopProbDiff)
+    jump = (1 - loopProbSame) * pi
+    mix_to_same = spk_in_state * (1 - loopProbDiff) / spk_in_state.sum(axis=0)
+    mix_to_same[:, same] = 0.0
+    tr = (loop, jump, is_same, mix_to_same, same)
+
     for i in range(maxIters):
         L = 0  # objective function (37) (i.e. VB lower-bound on the evidence)
 
-        # First we fix q(Z_1, Z_2) and update q(Y). Since Y does not depend on the
+        # First we fix q(Z_1, ..., Z_K) and update q(Y). Since Y does not depend on the
         # stream, we will stack the streams and use the whole as a matrix for the
         # update equations.
         Ns = np.sum(gamma.reshape((K * nframes, maxSpeakers)), axis=0)[
             :, np.newaxis, np.newaxis
         ]  # bracket in eq. (34) for all 's'
         VtiEFs = gamma.reshape((K * nframes, maxSpeakers)).T.dot(
-            VtiEF.reshape((K * nframes, D))
+            VtiEF.reshape((K * nframes, R))
         )[
             :, :, np.newaxis
         ]  # eq. (35) except for \Lambda_s^{-1} for all 's'
@@ -344,7 +374,7 @@ def VB_diarization_coupled(
         # where 'lls' plays role of HMM output log-probabilities
         lls = Fa * (
             G.reshape((K * nframes))[:, np.newaxis]
-            + VtiEF.reshape((K * nframes, D)).dot(a.T)
+            + VtiEF.reshape((K * nframes, R)).dot(a.T)
             - 0.5
             * (
                 (invLs + np.matmul(a[:, :, np.newaxis], a[:, np.newaxis, :]))
@@ -363,17 +393,16 @@ def VB_diarization_coupled(
                 )
             )
         ip = pi
-        # per-frame HMM state posteriors. Note that we can have linear chain of minDur states
-        # for each speaker.
-        # lls has shape K x T x S. We need to reshape it to T x S**K where S**K is obtained
-        # by the outer sum of all streams.
-        lls_new = lls[0]
-        for k in range(1, K):
-            lls_new = np.stack(
-                [np.add.outer(lls_new[t], lls[k, t]) for t in range(nframes)], axis=0
-            )
-            lls_new = lls_new.reshape((nframes, maxSpeakers ** (k + 1)))
-        gamma, tll, lf, lb = forward_backward(lls_new, tr, ip)
+        # lls has shape K x T x S. The output log-probability of a speaker tuple is the
+        # sum of the per-stream log-probabilities of its speakers, which we get for all
+        # the S^K tuples at once by broadcasting the streams against each other.
+        lls_joint = np.zeros((nframes,) + (S,) * K)
+        for k in range(K):
+            shape = [nframes] + [1] * K
+            shape[k + 1] = S
+            lls_joint = lls_joint + lls[k].reshape(shape)
+        lls_joint = lls_joint.reshape((nframes, nstates))
+        gamma, tll, lf, lb = forward_backward_coupled(lls_joint, tr, ip)
 
         # Right after updating q(Z), tll is E{log p(X|,Y,Z)} - KL{q(Z)||p(Z)}.
         # L now contains -KL{q(Y)||p(Y)}. Therefore, L+ttl is correct value for ELBO.
@@ -387,21 +416,22 @@ def VB_diarization_coupled(
             pi = gamma[0, :] + np.exp(
                 logsumexp(lf[:-1, :], axis=1)[:, np.newaxis]
                 + lb[1:, :]
-                + lls_new[1:]
-                + np.log(np.dot(tr, pi))
+                + lls_joint[1:]
+                + np.log(_coupled_backward_step(pi, tr))
                 - tll
             ).sum(axis=0)
         pi = pi / pi.sum()
 
-        # per-frame speaker posteriors (analogue to eq. (30)) --- for this, we sum over
-        # all pairs in which the speaker exists. Currently only implemented for K=2
-        gamma_new = np.zeros((K, nframes, maxSpeakers))
-        for i in range(maxSpeakers):
-            gamma_new[0, :, i] = gamma[:, i * maxSpeakers : (i + 1) * maxSpeakers].sum(
-                axis=1
-            )
-            gamma_new[1, :, i] = gamma[:, i::maxSpeakers].sum(axis=1)
-        gamma = gamma_new
+        # per-frame speaker posteriors (analogue to eq. (30)) --- for each stream, we
+        # sum over all tuples in which the speaker is assigned to that stream.
+        gamma = gamma.reshape((nframes,) + (S,) * K)
+        gamma = np.stack(
+            [
+                gamma.sum(axis=tuple(j + 1 for j in range(K) if j != k))
+                for k in range(K)
+            ],
+            axis=0,
+        )
 
         if i > 0 and L - Li[-2][0] < epsilon:
             if L - Li[-1][0] < 0:
@@ -417,7 +447,7 @@ def VB_diarization_coupled(
 # calculating DER. If expected=TRUE, posteriors in gamma are used to calculated
 # "expected" DER.
 def DER(gamma, ref, expected=True, xentropy=False):
-    from itertools import permutations
+    from scipy.optimize import linear_sum_assignment
 
     if not expected:
         # replace probabilities in gamma by zeros and ones
@@ -428,20 +458,20 @@ def DER(gamma, ref, expected=True, xentropy=False):
     err_mx = np.empty((ref.max() + 1, gamma.shape[1]))
     for s in range(err_mx.shape[0]):
         tmpq = gamma[ref == s, :]
-        err_mx[s] = (-np.log(tmpq) if xentropy else tmpq).sum(0)
-
-    if err_mx.shape[0] < err_mx.shape[1]:
-        err_mx = err_mx.T
+        with np.errstate(divide="ignore"):
+            err_mx[s] = (-np.log(tmpq) if xentropy else tmpq).sum(0)
 
-    # try all alignments (permutations) of reference and detected speaker
-    # could be written in more efficient way using dynamic programing
-    acc = [
-        err_mx[perm[: err_mx.shape[1]], range(err_mx.shape[1])].sum()
-        for perm in permutations(range(err_mx.shape[0]))
-    ]
+    # find the best alignment of reference and detected speakers as a solution of
+    # the (rectangular) assignment problem instead of trying all the permutations
     if xentropy:
-        return min(acc) / float(len(ref))
-    return (len(ref) - max(acc)) / float(len(ref))
+        # infinite costs are replaced by a cost larger than any finite alignment,
+        # so that they are only used if there is no finite alignment
+        finite = np.isfinite(err_mx)
+        cost = np.where(finite, err_mx, err_mx[finite].sum() + 1.0)
+        ref_ids, hyp_ids = linear_sum_assignment(cost)
+        return err_mx[ref_ids, hyp_ids].sum() / float(len(ref))
+    ref_ids, hyp_ids = linear_sum_assignment(err_mx, maximize=True)
+    return (len(ref) - err_mx[ref_ids, hyp_ids].sum()) / float(len(ref))
 
 
 ###############################################################################
@@ -477,8 +507,9 @@ def forward_backward(lls, tr, ip):
     """
     with np.errstate(divide="ignore"):  # too close to 0 values do not change the result
         ltr = np.log(tr)
-    lfw = np.empty_like(lls)
-    lbw = np.empty_like(lls)
+    # log-domain messages are accumulated in double precision whatever the type of lls
+    lfw = np.empty(lls.shape)
+    lbw = np.empty(lls.shape)
     lfw[:] = -np.inf
     lbw[:] = -np.inf
     with np.errstate(divide="ignore"):  # too close to 0 values do not change the result
@@ -494,3 +525,64 @@ def forward_backward(lls, tr, ip):
     tll = logsumexp(lfw[-1])
     pi = np.exp(lfw + lbw - tll)
     return pi, tll, lfw, lbw
+
+
+def forward_backward_coupled(lls, tr, ip):
+    """
+    Same as forward_backward(), but for the transition matrix of VB_diarization_coupled,
+    which is given by its blocks instead of a dense S^K x S^K matrix. Each step then
+    costs O(S^(K+1)) instead of O(S^(2K)).
+    Inputs:
+        lls - matrix of per-frame log HMM state output probabilities
+        tr  - tuple (loop, jump, is_same, mix_to_same, same) with the self-loop
+              probabilities of all states, the probabilities of jumping from a
+              same-speaker state to every state, the mask of same-speaker states, the
+              S x S^K probabilities of moving from each mixed-speaker state to the
+              same-speaker state of each speaker and the indices of same-speaker states
+        ip  - vector of initial state probabilities (i.e. statrting in the state)
+    Outputs:
+        pi  - matrix of per-frame state occupation posteriors
+        tll - total (forward) log-likelihood
+        lfw - log forward probabilities
+        lfw - log backward probabilities
+    """
+    lfw = np.empty_like(lls)
+    lbw = np.empty_like(lls)
+    with np.errstate(divide="ignore"):  # too close to 0 values do not change the result
+        lfw[0] = lls[0] + np.log(ip)
+        lbw[-1] = 0.0
+
+        # The messages are propagated in the linear domain, after scaling them by their
+        # maximum, since all the transitions are mixtures of few structured terms.
+        for i in range(1, len(lls)):
+            scale = lfw[i - 1].max()
+            lfw[i] = (
+                lls[i]
+                + scale
+                + np.log(_coupled_forward_step(np.exp(lfw[i - 1] - scale), tr))
+            )
+
+        for i in reversed(range(len(lls) - 1)):
+            lbw[i] = lls[i + 1] + lbw[i + 1]
+            scale = lbw[i].max()
+            lbw[i] = scale + np.log(_coupled_backward_step(np.exp(lbw[i] - scale), tr))
+
+    tll = logsumexp(lfw[-1])
+    pi = np.exp(lfw + lbw - tll)
+    return pi, tll, lfw, lbw
+
+
+def _coupled_forward_step(alpha, tr):
+    # alpha.dot(tr) for the block-structured transition matrix
+    loop, jump, is_same, mix_to_same, same = tr
+    out = loop * alpha + jump * alpha[is_same].sum()
+    out[same] += mix_to_same.dot(alpha)
+    return out
+
+
+def _coupled_backward_step(beta, tr):
+    # tr.dot(beta) for the block-structured transition matrix
+    loop, jump, is_same, mix_to_same, same = tr
+    out = loop * beta + mix_to_same.T.dot(beta[same])
+    out[is_same] += jump.dot(beta)
+    return out
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+
+# @Authors: Desh Raj
+# @Emails: r.desh26@gmail.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Incremental version of the AHC+VB recipe in vbhmm.py, which consumes the x-vectors
+# of a recording in chunks. VB is only re-run on a sliding window of the most recent
+# x-vectors. The x-vectors that slide out of the window are absorbed into the speaker
+# models: their statistics are turned into the Gaussian priors on the speaker factors
+# (i.e. the speaker posteriors 'a' and 'invLs' given these x-vectors), which are used
+# together with the speaker priors 'pi' by the VB on the next window.
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from scipy.special import softmax
+
+from diarizer.diarization_lib import ahc_clustering, merge_adjacent_labels
+from diarizer.vbx.VB_diarization import VB_diarization
+
+
+class OnlineVBx:
+    """
+    Inputs:
+    plda           - tuple (mu, tr, psi) of PLDA model with diagonalized across-class
+                     covariance (as computed in vbhmm.py)
+    lda_dim        - x-vectors are reduced to this dimensionality for VB-HMM
+    threshold      - bias of the AHC threshold used to initialize speakers in new chunks
+    Fa, Fb, loopP  - parameters of VB-HMM (see VB_diarization.VB_diarization)
+    init_smoothing - smoothing of the hard AHC assignments used to initialize VB-HMM
+    lookback       - maximum number of x-vectors VB is run on in each update
+    delay          - number of most recent x-vectors whose labels are not final yet
+    maxIters       - maximum number of VB iterations in each update
+    epsilon        - stop VB iterations, if ELBO improvement is less than epsilon
+    """
+
+    def __init__(
+        self,
+        plda,
+        lda_dim,
+        threshold,
+        Fa,
+        Fb,
+        loopP,
+        init_smoothing=5.0,
+        lookback=400,
+        delay=40,
+        maxIters=40,
+        epsilon=1e-6,
+    ):
+        assert 0 <= delay <= lookback, "Expecting 0 <= delay <= lookback"
+        self.plda_mu, self.plda_tr, plda_psi = plda
+        self.lda_dim = lda_dim
+        self.threshold = threshold
+        self.Fa = Fa
+        self.Fb = Fb
+        self.loopP = loopP
+        self.init_smoothing = init_smoothing
+        self.lookback = lookback
+        self.delay = delay
+        self.maxIters = maxIters
+        self.epsilon = epsilon
+        self.sV = np.sqrt(plda_psi[:lda_dim])
+        self.reset()
+
+    def reset(self):
+        """Forget all speakers and x-vectors, e.g. before a new recording."""
+        R = self.lda_dim
+        self.pi = np.zeros(0)
+        self.spk_ids = np.zeros(0, dtype=int)  # output labels of the speaker models
+        self.next_id = 0
+        # x-vectors in the current window, their timing and speaker posteriors
+        self.x = np.zeros((0, self.plda_tr.shape[1]))
+        self.fea = np.zeros((0, R))
+        self.times = np.zeros((0, 2))
+        self.gamma = np.zeros((0, 0))
+        self.num_final = 0  # number of x-vectors at the start of window already emitted
+        # zero and first order statistics of the x-vectors absorbed into the models
+        self.N = np.zeros(0)
+        self.VtiEFs = np.zeros((0, R))
+        # finalized last speaker turn, which may still continue
+        self.tail = (np.zeros(0), np.zeros(0), np.zeros(0, dtype=int))
+
+    @property
+    def num_speakers(self):
+        return len(self.pi)
+
+    def speaker_priors(self):
+        """Returns the speaker posteriors (a, invLs) given the absorbed x-vectors,
+        which are used as priors on the speaker factors for the current window."""
+        # V is diagonal and iE is identity for the PLDA based VB-HMM
+        VtiEV = self.sV ** 2
+        invLs = 1.0 / (1.0 + self.N[:, np.newaxis] * VtiEV * self.Fa / self.Fb)
+        a = invLs * self.VtiEFs * self.Fa / self.Fb
+        return a, invLs[:, :, np.newaxis] * np.eye(self.lda_dim)
+
+    def update(self, x, starts, ends):
+        """Adds a chunk of x-vectors and re-runs VB-HMM on the current window.
+        Input:
+            x            - NxD matrix of transformed and length-normalized x-vectors
+            starts, ends - start and end times of the x-vectors in seconds
+        Outputs:
+            starts, ends, labels - speaker segments which became final
+        """
+        if len(x) > 0:
+            self._add_chunk(x, starts, ends)
+            self._run_vb()
+        return self._finalize(len(self.x) - self.delay)
+
+    def flush(self):
+        """Finalizes all the remaining x-vectors (e.g. at the end of recording)."""
+        starts, ends, labels = self._finalize(len(self.x))
+        starts, ends, labels = (
+            np.r_[new, tail] for new, tail in zip((starts, ends, labels), self.tail)
+        )
+        self.tail = (np.zeros(0), np.zeros(0), np.zeros(0, dtype=int))
+        return starts, ends, labels
+
+    def _add_chunk(self, x, starts, ends):
+        fea = (x - self.plda_mu).dot(self.plda_tr.T)[:, : self.lda_dim]
+        num_old = len(self.x)
+        self.x = np.r_[self.x, x]
+        self.fea = np.r_[self.fea, fea]
+        self.times = np.r_[self.times, np.c_[starts, ends]]
+
+        # Initialize speakers of the x-vectors, whose labels are not final yet, by AHC
+        # on the whole window. AHC clusters are mapped one-to-one to the speakers the
+        # x-vectors from the previous updates are assigned to. The other clusters start
+        # new speakers (e.g. when a new speaker appears or when AHC splits a speaker VB
+        # merged in a short early window), which VB drops again if they duplicate a
+        # known speaker. The x-vectors from the previous updates are re-initialized
+        # too, as VB could not split a merged speaker starting from its own posteriors.
+        # Only the final x-vectors keep their posteriors, which keeps the speakers of
+        # the emitted labels in place.
+        labels, _ = ahc_clustering(self.x, self.threshold)
+        cluster_occupancy = np.zeros((labels.max() + 1, self.num_speakers))
+        np.add.at(cluster_occupancy, labels[:num_old], self.gamma)
+        clusters, spks = linear_sum_assignment(-cluster_occupancy)
+        spk_map = np.full(len(cluster_occupancy), -1)
+        spk_map[clusters] = spks
+        spk_map[cluster_occupancy.max(axis=1, initial=0) == 0] = -1
+        known = spk_map >= 0
+        spk_map[~known] = self.num_speakers + np.arange(np.sum(~known))
+        self._add_speakers(np.sum(~known))
+
+        num_final = self.num_final
+        qinit = np.zeros((len(self.x) - num_final, self.num_speakers))
+        qinit[range(len(qinit)), spk_map[labels[num_final:]]] = 1.0
+        self.gamma = np.r_[
+            self.gamma[:num_final], softmax(qinit * self.init_smoothing, axis=1)
+        ]
+
+    def _add_speakers(self, num):
+        if num == 0:
+            return
+        # new speakers get the same prior as an average known speaker
+        self.pi = np.r_[self.pi, np.full(num, 1.0 / (self.num_speakers + num))]
+        self.pi /= self.pi.sum()
+        self.spk_ids = np.r_[self.spk_ids, self.next_id + np.arange(num)]
+        self.next_id += num
+        self.gamma = np.c_[self.gamma, np.zeros((len(self.gamma), num))]
+        self.N = np.r_[self.N, np.zeros(num)]
+        self.VtiEFs = np.r_[self.VtiEFs, np.zeros((num, self.lda_dim))]
+
+    def _run_vb(self):
+        q, _, _ = VB_diarization(
+            self.fea,
+            np.zeros(self.lda_dim),
+            np.eye(self.lda_dim),
+            np.diag(self.sV),
+            pi=self.pi,
+            gamma=self.gamma,
+            maxIters=self.maxIters,
+            epsilon=self.epsilon,
+            loopProb=self.loopP,
+            Fa=self.Fa,
+            Fb=self.Fb,
+            spkPrior=self.speaker_priors(),
+        )
+        # The speaker priors estimated by VB only reflect the current window, where
+        # the speakers from earlier parts of the recording may not be active. Instead,
+        # the priors are re-estimated from all the x-vectors seen so far. Speakers,
+        # which have (almost) no x-vectors assigned, are dropped, so that the number
+        # of speaker models does not grow with the length of the recording.
+        occupancy = self.N + q.sum(axis=0)
+        keep = occupancy > 0.5
+        self.gamma, self.pi = q[:, keep], occupancy[keep] / occupancy[keep].sum()
+        self.spk_ids, self.N, self.VtiEFs = (
+            self.spk_ids[keep],
+            self.N[keep],
+            self.VtiEFs[keep],
+        )
+
+    def _finalize(self, num_final):
+        # Emit labels of x-vectors which left the delay interval
+        num_final = max(num_final, self.num_final)
+        new = slice(self.num_final, num_final)
+        starts = np.r_[self.tail[0], self.times[new, 0]]
+        ends = np.r_[self.tail[1], self.times[new, 1]]
+        if self.num_speakers > 0:
+            new_labels = self.spk_ids[self.gamma[new].argmax(axis=1)]
+        else:
+            # no x-vectors were added since the last reset
+            new_labels = np.zeros(0, dtype=int)
+        labels = np.r_[self.tail[2], new_labels]
+        self.num_final = num_final
+
+        # Absorb x-vectors which slide out of the window into the speaker models
+        num_absorb = max(len(self.x) - self.lookback, 0)
+        if num_absorb > 0:
+            old = slice(0, num_absorb)
+            self.N += self.gamma[old].sum(axis=0)
+            self.VtiEFs += self.gamma[old].T.dot(self.fea[old] * self.sV)
+            self.x, self.fea = self.x[num_absorb:], self.fea[num_absorb:]
+            self.times, self.gamma = self.times[num_absorb:], self.gamma[num_absorb:]
+            self.num_final -= num_absorb
+
+        if len(labels) == 0:
+            return starts, ends, labels.astype(int)
+        # The last speaker turn can continue in the next update, so it is kept back
+        # (with its start already adjusted w.r.t. the previous turn)
+        starts, ends, labels = merge_adjacent_labels(starts, ends, labels)
+        self.tail = (starts[-1:], ends[-1:], labels[-1:])
+        return starts[:-1], ends[:-1], labels[:-1]
@@ -35,34 +35,187 @@ import argparse
 import os
 import itertools
 
-import fastcluster
-import h5py
 import kaldi_io
 import numpy as np
-from scipy.cluster.hierarchy import fcluster
-from scipy.spatial.distance import squareform
 from scipy.special import softmax
-from scipy.linalg import eigh
 
 from diarizer.diarization_lib import (
     read_xvector_timing_dict,
-    l2_norm,
-    cos_similarity,
-    twoGMMcalib_lin,
+    ahc_clustering,
+    ahc_clustering_2stage,
     merge_adjacent_labels,
     get_overlapping_segments,
     mkdir_p,
 )
-from diarizer.kaldi_utils import read_plda
+from diarizer.io_utils import write_rttm
+from diarizer.model_bundle import load_model_bundle
 from diarizer.vbx.VB_diarization import VB_diarization
 
 
-def write_output(fp, out_labels, starts, ends):
-    for label, seg_start, seg_end in zip(out_labels, starts, ends):
-        fp.write(
-            f"SPEAKER {file_name} 1 {seg_start:03f} {seg_end - seg_start:03f} "
-            f"<NA> <NA> {int(label + 1)} <NA> <NA>{os.linesep}"
+def cluster_vbx(
+    x,
+    model,
+    init,
+    threshold,
+    lda_dim,
+    Fa,
+    Fb,
+    loopP,
+    init_smoothing=5.0,
+    ahc_block_size=0,
+    nj=1,
+    dtype=np.float64,
+):
+    """
+    AHC and/or VB-HMM clustering of the (transformed) x-vectors of one recording.
+    Input:
+        x     - x-vectors (in rows) after ModelBundle.transform
+        model - ModelBundle with the PLDA model
+        (the other parameters are those of the command line options)
+    Outputs:
+        labels1st - speaker label of each x-vector
+        labels2nd - second most likely speaker of each x-vector (for overlap
+                    assignment), or None if not available (only AHC+VB with more
+                    than one speaker provides it)
+    """
+    plda_psi = model.plda_psi
+    plda_tr = model.plda_tr.astype(dtype)
+    plda_mu = model.plda_mu.astype(dtype)
+    labels2nd = None
+
+    if init == "AHC" or init.endswith("VB") or init.startswith("random_"):
+        if init.startswith("AHC"):
+            # Kaldi-like AHC of x-vectors; output "labels" is an integer vector
+            # of speaker (cluster) ids
+            if ahc_block_size > 0:
+                labels1st, _ = ahc_clustering_2stage(
+                    x, threshold, block_size=ahc_block_size, nj=nj, dtype=dtype
+                )
+            else:
+                labels1st, _ = ahc_clustering(x, threshold, dtype=dtype)
+        if init.endswith("VB"):
+            q = vb_resegment(
+                x,
+                model,
+                labels1st,
+                lda_dim,
+                Fa,
+                Fb,
+                loopP,
+                init_smoothing=init_smoothing,
+                dtype=dtype,
+            )
+            labels1st, labels2nd = posterior_labels(q)
+        if init.startswith("random_"):
+            MAX_SPKS = 10
+            prev_L = -float("inf")
+            random_iterations = int(init.split("_")[1])
+            np.random.seed(3)  # for reproducibility
+            for _ in range(random_iterations):
+                q_init = np.random.normal(
+                    size=(x.shape[0], MAX_SPKS), loc=0.5, scale=0.01
+                )
+                q_init = softmax(q_init * init_smoothing, axis=1)
+                fea = (x - plda_mu).dot(plda_tr.T)[:, :lda_dim]
+                sm = np.zeros(lda_dim)
+                siE = np.ones(lda_dim)
+                sV = np.sqrt(plda_psi[:lda_dim])
+                q_tmp, sp, L = VB_diarization(
+                    fea,
+                    sm,
+                    np.diag(siE),
+                    np.diag(sV),
+                    pi=None,
+                    gamma=q_init,
+                    maxSpeakers=q_init.shape[1],
+                    maxIters=40,
+                    epsilon=1e-6,
+                    loopProb=loopP,
+                    Fa=Fa,
+                    Fb=Fb,
+                    dtype=dtype,
+                )
+                if L[-1][0] > prev_L:
+                    prev_L = L[-1][0]
+                    q = q_tmp
+            labels1st = np.argsort(-q, axis=1)[:, 0]
+    else:
+        raise ValueError("Wrong option for args.initialization.")
+    return labels1st, labels2nd
+
+
+def vb_resegment(
+    x, model, labels, lda_dim, Fa, Fb, loopP, init_smoothing=5.0, dtype=np.float64
+):
+    """
+    VB-HMM clustering of the (transformed) x-vectors of one recording, initialized with
+    hard labels (e.g. from AHC).
+    Outputs:
+        q - matrix of the posteriors of the speakers (in columns) for the x-vectors
+    """
+    plda_psi = model.plda_psi
+    plda_tr = model.plda_tr.astype(dtype)
+    plda_mu = model.plda_mu.astype(dtype)
+    # Smooth the hard labels obtained from AHC to soft assignments
+    # of x-vectors to speakers
+    qinit = np.zeros((len(labels), np.max(labels) + 1))
+    qinit[range(len(labels)), labels] = 1.0
+    qinit = softmax(qinit * init_smoothing, axis=1)
+    fea = (x - plda_mu).dot(plda_tr.T)[:, :lda_dim]
+    # Use VB-HMM for x-vector clustering. Instead of i-vector extractor model, we use PLDA
+    # => GMM with only 1 component, V derived accross-class covariance,
+    # and iE is inverse within-class covariance (i.e. identity)
+    sm = np.zeros(lda_dim)
+    siE = np.ones(lda_dim)
+    sV = np.sqrt(plda_psi[:lda_dim])
+    q, sp, L = VB_diarization(
+        fea,
+        sm,
+        np.diag(siE),
+        np.diag(sV),
+        pi=None,
+        gamma=qinit,
+        maxSpeakers=qinit.shape[1],
+        maxIters=40,
+        epsilon=1e-6,
+        loopProb=loopP,
+        Fa=Fa,
+        Fb=Fb,
+        dtype=dtype,
+    )
+    return q
+
+
+def posterior_labels(q):
+    """Returns the most likely and (if there is more than one speaker, else None) the
+    second most likely speaker of each x-vector from the VB-HMM posteriors."""
+    ranking = np.argsort(-q, axis=1)
+    return ranking[:, 0], ranking[:, 1] if q.shape[1] > 1 else None
+
+
+def labels_to_segments(start, end, labels1st, labels2nd=None, overlap_rttm=None):
+    """
+    Merges the x-vector labels into speaker segments and (if there is an overlap
+    RTTM and second speaker labels) adds the second speaker in the overlap regions.
+    overlap_rttm can be a path or a tuple of arrays (starts, ends), see
+    diarization_lib.get_overlapping_segments.
+    Outputs:
+        starts, ends, labels - speaker segments
+    """
+    starts, ends, out_labels = merge_adjacent_labels(start, end, labels1st)
+
+    # Overlap assignment
+    if overlap_rttm is not None and labels2nd is not None:
+        starts2, ends2, out_labels2 = merge_adjacent_labels(start, end, labels2nd)
+        # Keep the 2nd speaker segments which are in the overlap RTTM
+        starts2, ends2, out_labels2 = get_overlapping_segments(
+            starts2, ends2, out_labels2, overlap_rttm
         )
+        if starts2 is not None:
+            starts = np.concatenate((starts, starts2))
+            ends = np.concatenate((ends, ends2))
+            out_labels = np.concatenate((out_labels, out_labels2))
+    return starts, ends, out_labels
 
 
 if __name__ == "__main__":
@@ -106,7 +259,8 @@ if __name__ == "__main__":
         "--xvec-transform",
         required=True,
         type=str,
-        help="path to x-vector transformation h5 file",
+        help="path to x-vector transformation h5 file (or to a model bundle directory "
+        "exported by model_bundle.py, in which case --plda-file is ignored)",
     )
     parser.add_argument(
         "--plda-file",
@@ -153,22 +307,46 @@ if __name__ == "__main__":
         "assignments as the args.initialization for VB-HMM. This parameter controls the amount of"
         " smoothing. Not so important, high value (e.g. 10) is OK  => keeping hard assigment",
     )
+    parser.add_argument(
+        "--ahc-block-size",
+        required=False,
+        type=int,
+        default=0,
+        help="If positive, use two-stage AHC for recordings with more x-vectors than this: "
+        "contiguous blocks of this many x-vectors are clustered first and the resulting "
+        "clusters are clustered again (see diarization_lib.ahc_clustering_2stage). "
+        "By default, exact AHC on all x-vectors is used",
+    )
+    parser.add_argument(
+        "--nj",
+        required=False,
+        type=int,
+        default=1,
+        help="Number of processes used to cluster the blocks in two-stage AHC",
+    )
+    parser.add_argument(
+        "--precision",
+        required=False,
+        type=str,
+        default="float64",
+        choices=["float32", "float64"],
+        help="Floating point precision of the x-vector transforms, AHC similarities and "
+        "VB-HMM statistics. float32 halves the memory traffic on long recordings, while "
+        "the forward-backward messages and the ELBO are always kept in float64.",
+    )
 
     args = parser.parse_args()
     assert (
         0 <= args.loopP <= 1
     ), f"Expecting loopP between 0 and 1, got {args.loopP} instead."
 
+    dtype = np.dtype(args.precision)
+
     # segments file with x-vector timing information
     segs_dict = read_xvector_timing_dict(args.segments_file)
 
-    kaldi_plda = read_plda(args.plda_file)
-    plda_mu, plda_tr, plda_psi = kaldi_plda
-    W = np.linalg.inv(plda_tr.T.dot(plda_tr))
-    B = np.linalg.inv((plda_tr.T / plda_psi).dot(plda_tr))
-    acvar, wccn = eigh(B, W)
-    plda_psi = acvar[::-1]
-    plda_tr = wccn.T[::-1]
+    # x-vector transform and PLDA are loaded once for all the recordings
+    model = load_model_bundle(args.xvec_transform, args.plda_file)
 
     # Open ark file with x-vectors and in each iteration of the following for-loop
     # read a batch of x-vectors corresponding to one recording
@@ -179,124 +357,30 @@ if __name__ == "__main__":
     for file_name, segs in recit:
         print(file_name)
         seg_names, xvecs = zip(*segs)
-        x = np.array(xvecs)
-
-        with h5py.File(args.xvec_transform, "r") as f:
-            mean1 = np.array(f["mean1"])
-            mean2 = np.array(f["mean2"])
-            lda = np.array(f["lda"])
-            x = l2_norm(lda.T.dot((l2_norm(x - mean1)).transpose()).transpose() - mean2)
-
-        if (
-            args.init == "AHC"
-            or args.init.endswith("VB")
-            or args.init.startswith("random_")
-        ):
-            if args.init.startswith("AHC"):
-                # Kaldi-like AHC of x-vectors (scr_mx is matrix of pairwise
-                # similarities between all x-vectors)
-                scr_mx = cos_similarity(x)
-                # Figure out utterance specific args.threshold for AHC.
-                thr, _ = twoGMMcalib_lin(scr_mx.ravel())
-                # output "labels" is an integer vector of speaker (cluster) ids
-                scr_mx = squareform(-scr_mx, checks=False)
-                lin_mat = fastcluster.linkage(
-                    scr_mx, method="average", preserve_input="False"
-                )
-                del scr_mx
-                adjust = abs(lin_mat[:, 2].min())
-                lin_mat[:, 2] += adjust
-                labels1st = (
-                    fcluster(
-                        lin_mat, -(thr + args.threshold) + adjust, criterion="distance"
-                    )
-                    - 1
-                )
-            if args.init.endswith("VB"):
-                # Smooth the hard labels obtained from AHC to soft assignments
-                # of x-vectors to speakers
-                qinit = np.zeros((len(labels1st), np.max(labels1st) + 1))
-                qinit[range(len(labels1st)), labels1st] = 1.0
-                qinit = softmax(qinit * args.init_smoothing, axis=1)
-                fea = (x - plda_mu).dot(plda_tr.T)[:, : args.lda_dim]
-                # Use VB-HMM for x-vector clustering. Instead of i-vector extractor model, we use PLDA
-                # => GMM with only 1 component, V derived accross-class covariance,
-                # and iE is inverse within-class covariance (i.e. identity)
-                sm = np.zeros(args.lda_dim)
-                siE = np.ones(args.lda_dim)
-                sV = np.sqrt(plda_psi[: args.lda_dim])
-                q, sp, L = VB_diarization(
-                    fea,
-                    sm,
-                    np.diag(siE),
-                    np.diag(sV),
-                    pi=None,
-                    gamma=qinit,
-                    maxSpeakers=qinit.shape[1],
-                    maxIters=40,
-                    epsilon=1e-6,
-                    loopProb=args.loopP,
-                    Fa=args.Fa,
-                    Fb=args.Fb,
-                )
+        x = model.transform(np.array(xvecs), dtype=dtype)
 
-                labels1st = np.argsort(-q, axis=1)[:, 0]
-                if q.shape[1] > 1:
-                    labels2nd = np.argsort(-q, axis=1)[:, 1]
-            if args.init.startswith("random_"):
-                MAX_SPKS = 10
-                prev_L = -float("inf")
-                random_iterations = int(args.init.split("_")[1])
-                np.random.seed(3)  # for reproducibility
-                for _ in range(random_iterations):
-                    q_init = np.random.normal(
-                        size=(x.shape[0], MAX_SPKS), loc=0.5, scale=0.01
-                    )
-                    q_init = softmax(q_init * args.init_smoothing, axis=1)
-                    fea = (x - plda_mu).dot(plda_tr.T)[:, : args.lda_dim]
-                    sm = np.zeros(args.lda_dim)
-                    siE = np.ones(args.lda_dim)
-                    sV = np.sqrt(plda_psi[: args.lda_dim])
-                    q_tmp, sp, L = VB_diarization(
-                        fea,
-                        sm,
-                        np.diag(siE),
-                        np.diag(sV),
-                        pi=None,
-                        gamma=q_init,
-                        maxSpeakers=q_init.shape[1],
-                        maxIters=40,
-                        epsilon=1e-6,
-                        loopProb=args.loopP,
-                        Fa=args.Fa,
-                        Fb=args.Fb,
-                    )
-                    if L[-1][0] > prev_L:
-                        prev_L = L[-1][0]
-                        q = q_tmp
-                labels1st = np.argsort(-q, axis=1)[:, 0]
-                if q.shape[1] > 1:
-                    labels2nd = np.argsort(-q, axis=1)[:, 1]
-        else:
-            raise ValueError("Wrong option for args.initialization.")
+        labels1st, labels2nd = cluster_vbx(
+            x,
+            model,
+            args.init,
+            args.threshold,
+            args.lda_dim,
+            args.Fa,
+            args.Fb,
+            args.loopP,
+            init_smoothing=args.init_smoothing,
+            ahc_block_size=args.ahc_block_size,
+            nj=args.nj,
+            dtype=dtype,
+        )
 
         assert np.all(segs_dict[file_name][0] == np.array(seg_names))
         start, end = segs_dict[file_name][1].T
 
-        starts, ends, out_labels = merge_adjacent_labels(start, end, labels1st)
-
-        # Overlap assignment
-        if args.overlap_rttm and args.init.endswith("VB") and q.shape[1] > 1:
-            starts2, ends2, out_labels2 = merge_adjacent_labels(start, end, labels2nd)
-            # Keep the 2nd speaker segments which are in the overlap RTTM
-            starts2, ends2, out_labels2 = get_overlapping_segments(
-                starts2, ends2, out_labels2, args.overlap_rttm
-            )
-            if starts2 is not None:
-                starts = np.concatenate((starts, starts2))
-                ends = np.concatenate((ends, ends2))
-                out_labels = np.concatenate((out_labels, out_labels2))
+        starts, ends, out_labels = labels_to_segments(
+            start, end, labels1st, labels2nd, args.overlap_rttm
+        )
 
         mkdir_p(args.out_rttm_dir)
         with open(os.path.join(args.out_rttm_dir, f"{file_name}.rttm"), "w") as fp:
-            write_output(fp, out_labels, starts, ends)
+            write_rttm(fp, file_name, starts, ends, out_labels + 1)
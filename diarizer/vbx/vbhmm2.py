@@ -24,30 +24,25 @@
 import argparse
 import os
 import itertools
-from collections import namedtuple
 
 import fastcluster
-import h5py
 import kaldi_io
 import numpy as np
 from scipy.cluster.hierarchy import fcluster
 from scipy.spatial.distance import squareform
 from scipy.special import softmax
-from scipy.linalg import eigh
 
 from diarizer.diarization_lib import (
     read_xvector_timing_dict,
-    l2_norm,
     cos_similarity,
     twoGMMcalib_lin,
     mkdir_p,
 )
-from diarizer.kaldi_utils import read_plda
+from diarizer.model_bundle import load_model_bundle
+from diarizer.io_utils import write_rttm
+from diarizer.postprocessing import subsegments_to_segments
 from diarizer.vbx.VB_diarization import VB_diarization
 
-Segment = namedtuple("Segment", ["channel", "start", "end", "label"])
-
-
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -81,7 +76,8 @@ if __name__ == "__main__":
         "--xvec-transform",
         required=True,
         type=str,
-        help="path to x-vector transformation h5 file",
+        help="path to x-vector transformation h5 file (or to a model bundle directory "
+        "exported by model_bundle.py, in which case --plda-file is ignored)",
     )
     parser.add_argument(
         "--plda-file",
@@ -137,13 +133,9 @@ if __name__ == "__main__":
     # segments file with x-vector timing information
     segs_dict = read_xvector_timing_dict(args.segments_file)
 
-    kaldi_plda = read_plda(args.plda_file)
-    plda_mu, plda_tr, plda_psi = kaldi_plda
-    W = np.linalg.inv(plda_tr.T.dot(plda_tr))
-    B = np.linalg.inv((plda_tr.T / plda_psi).dot(plda_tr))
-    acvar, wccn = eigh(B, W)
-    plda_psi = acvar[::-1]
-    plda_tr = wccn.T[::-1]
+    # x-vector transform and PLDA are loaded once for all the recordings
+    model = load_model_bundle(args.xvec_transform, args.plda_file)
+    plda_mu, plda_tr, plda_psi = model.plda_mu, model.plda_tr, model.plda_psi
 
     # Open ark file with x-vectors and in each iteration of the following for-loop
     # read a batch of x-vectors corresponding to one recording
@@ -162,11 +154,7 @@ if __name__ == "__main__":
         num_ch0 = len(list(filter(lambda e: e.rsplit("_", 2)[1] == "0", seg_names)))
         num_ch1 = len(list(filter(lambda e: e.rsplit("_", 2)[1] == "1", seg_names)))
 
-        with h5py.File(args.xvec_transform, "r") as f:
-            mean1 = np.array(f["mean1"])
-            mean2 = np.array(f["mean2"])
-            lda = np.array(f["lda"])
-            x = l2_norm(lda.T.dot((l2_norm(x - mean1)).transpose()).transpose() - mean2)
+        x = model.transform(x)
 
         if (
             args.init == "AHC"
@@ -261,65 +249,13 @@ if __name__ == "__main__":
         assert np.all(segs_dict[file_name][0] == np.array(seg_names))
         start, end = segs_dict[file_name][1].T
 
-        # split the labels into two channels and process both channels
-        labels_ch0 = labels[:num_ch0]
-        labels_ch1 = labels[num_ch0:]
-        start_ch0 = start[:num_ch0]
-        start_ch1 = start[num_ch0:]
-        end_ch0 = end[:num_ch0]
-        end_ch1 = end[num_ch0:]
-        subsegments = []
-        for (label, start, end) in zip(labels_ch0, start_ch0, end_ch0):
-            subsegments.append(Segment(0, start, end, label))
-        for (label, start, end) in zip(labels_ch1, start_ch1, end_ch1):
-            subsegments.append(Segment(1, start, end, label))
-
-        # At this point the subsegments are overlapping, since we got them from a
-        # sliding window diarization method. We make them contiguous here.
-        contiguous_segs = []
-        for i, seg in enumerate(subsegments):
-            # If it is last segment in channel or last contiguous segment, add it to new_segs
-            if (
-                i == len(subsegments) - 1
-                or seg.channel != subsegments[i + 1].channel
-                or seg.end <= subsegments[i + 1].start
-            ):
-                contiguous_segs.append(
-                    Segment(seg.channel, seg.start, seg.end, seg.label)
-                )
-            # Otherwise split overlapping interval between current and next segment
-            else:
-                avg = (subsegments[i + 1].start + seg.end) / 2
-                contiguous_segs.append(Segment(seg.channel, seg.start, avg, seg.label))
-                subsegments[i + 1] = subsegments[i + 1]._replace(start=avg)
-
-        # At this point, we have contiguous subsegments for each channel. But the
-        # speaker segments across channels may still overlap. We merge cross-channel
-        # segments of the same speaker now.
-        segs_by_speaker = {
-            spk: list(segs)
-            for spk, segs in itertools.groupby(
-                sorted(contiguous_segs, key=lambda x: (x.label, x.start)),
-                lambda x: x.label,
-            )
-        }
-        merged_segs = []
-        for spk, segs in segs_by_speaker.items():
-            merged_segs.append(segs[0])
-            for i, seg in enumerate(segs[1:]):
-                # If start time is before the end time of previous segment, then combine segments
-                if float(seg.start) <= float(merged_segs[-1].end):
-                    merged_segs[-1] = merged_segs[-1]._replace(end=seg.end)
-                else:
-                    merged_segs.append(seg)
+        # The labels of the first num_ch0 x-vectors are from channel 0 and the rest
+        # from channel 1. The subsegments are overlapping, since we got them from a
+        # sliding window diarization method. We make them contiguous in each channel
+        # and merge the segments of the same speaker (also across channels).
+        channels = np.arange(len(labels)) >= num_ch0
+        starts, ends, out_labels = subsegments_to_segments(start, end, labels, channels)
 
         mkdir_p(args.out_rttm_dir)
-        rttm_str = "SPEAKER {file} 1 {start:.03f} {duration:.03f} <NA> <NA> {label} <NA> <NA>\n"
         with open(os.path.join(args.out_rttm_dir, f"{file_name}.rttm"), "w") as fp:
-            for seg in merged_segs:
-                duration = seg.end - seg.start
-                fp.write(
-                    "SPEAKER {0} 1 {1:7.3f} {2:7.3f} <NA> <NA> {3} <NA> <NA>\n".format(
-                        file_name, seg.start, duration, seg.label
-                    )
-                )
+            write_rttm(fp, file_name, starts, ends, out_labels)
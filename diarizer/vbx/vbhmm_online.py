@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+
+# @Authors: Desh Raj
+# @Emails: r.desh26@gmail.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# Online version of the AHC+VB recipe in vbhmm.py. The x-vectors of each recording
+# are fed to OnlineVBx in chunks (simulating a live stream), and the speaker segments
+# are written to the RTTM file as soon as they become final. See online_vbx.py for
+# details.
+
+import argparse
+import os
+import itertools
+
+import kaldi_io
+import numpy as np
+
+from diarizer.diarization_lib import read_xvector_timing_dict, mkdir_p
+from diarizer.io_utils import write_rttm
+from diarizer.model_bundle import load_model_bundle
+from diarizer.vbx.online_vbx import OnlineVBx
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--out-rttm-dir",
+        required=True,
+        type=str,
+        help="Directory to store output rttm files",
+    )
+    parser.add_argument(
+        "--xvec-ark-file",
+        required=True,
+        type=str,
+        help="Kaldi ark file with x-vectors from one or more input recordings. "
+        "Attention: all x-vectors from one recording must be in one ark file",
+    )
+    parser.add_argument(
+        "--segments-file",
+        required=True,
+        type=str,
+        help="File with x-vector timing info (see diarization_lib.read_xvector_timing_dict)",
+    )
+    parser.add_argument(
+        "--xvec-transform",
+        required=True,
+        type=str,
+        help="path to x-vector transformation h5 file (or to a model bundle directory "
+        "exported by model_bundle.py, in which case --plda-file is ignored)",
+    )
+    parser.add_argument(
+        "--plda-file",
+        required=True,
+        type=str,
+        help="File with PLDA model in Kaldi format used for AHC and VB-HMM x-vector clustering",
+    )
+    parser.add_argument(
+        "--threshold",
+        required=True,
+        type=float,
+        help="args.threshold (bias) used for AHC",
+    )
+    parser.add_argument(
+        "--lda-dim",
+        required=True,
+        type=int,
+        help="For VB-HMM, x-vectors are reduced to this dimensionality using LDA",
+    )
+    parser.add_argument(
+        "--Fa",
+        required=True,
+        type=float,
+        help="Parameter of VB-HMM (see VB_diarization.VB_diarization)",
+    )
+    parser.add_argument(
+        "--Fb",
+        required=True,
+        type=float,
+        help="Parameter of VB-HMM (see VB_diarization.VB_diarization)",
+    )
+    parser.add_argument(
+        "--loopP",
+        required=True,
+        type=float,
+        help="Parameter of VB-HMM (see VB_diarization.VB_diarization)",
+    )
+    parser.add_argument(
+        "--init-smoothing",
+        required=False,
+        type=float,
+        default=5.0,
+        help="Smoothing of the hard AHC assignments used to initialize VB-HMM "
+        "(see vbhmm.py)",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        required=False,
+        type=int,
+        default=20,
+        help="Number of x-vectors added in each update",
+    )
+    parser.add_argument(
+        "--lookback",
+        required=False,
+        type=int,
+        default=400,
+        help="Maximum number of x-vectors VB-HMM is re-run on in each update. Older "
+        "x-vectors are only kept in the speaker models, which bounds the cost of an update",
+    )
+    parser.add_argument(
+        "--delay",
+        required=False,
+        type=int,
+        default=40,
+        help="Number of most recent x-vectors whose labels can still change. The "
+        "segments are written once they are older than this",
+    )
+
+    args = parser.parse_args()
+    assert (
+        0 <= args.loopP <= 1
+    ), f"Expecting loopP between 0 and 1, got {args.loopP} instead."
+
+    # segments file with x-vector timing information
+    segs_dict = read_xvector_timing_dict(args.segments_file)
+
+    # x-vector transform and PLDA are loaded once for all the recordings
+    model = load_model_bundle(args.xvec_transform, args.plda_file)
+
+    online_vbx = OnlineVBx(
+        (model.plda_mu, model.plda_tr, model.plda_psi),
+        args.lda_dim,
+        args.threshold,
+        args.Fa,
+        args.Fb,
+        args.loopP,
+        init_smoothing=args.init_smoothing,
+        lookback=args.lookback,
+        delay=args.delay,
+    )
+
+    mkdir_p(args.out_rttm_dir)
+
+    # Open ark file with x-vectors and in each iteration of the following for-loop
+    # read a batch of x-vectors corresponding to one recording
+    arkit = kaldi_io.read_vec_flt_ark(args.xvec_ark_file)
+    recit = itertools.groupby(
+        arkit, lambda e: e[0].rsplit("_", 1)[0]
+    )  # group xvectors in ark by recording name
+    for file_name, segs in recit:
+        print(file_name)
+        seg_names, xvecs = zip(*segs)
+        assert np.all(segs_dict[file_name][0] == np.array(seg_names))
+        start, end = segs_dict[file_name][1].T
+
+        online_vbx.reset()
+        with open(os.path.join(args.out_rttm_dir, f"{file_name}.rttm"), "w") as fp:
+            for i in range(0, len(xvecs), args.chunk_size):
+                x = model.transform(np.array(xvecs[i : i + args.chunk_size]))
+                starts, ends, out_labels = online_vbx.update(
+                    x, start[i : i + args.chunk_size], end[i : i + args.chunk_size]
+                )
+                write_rttm(fp, file_name, starts, ends, out_labels.astype(int) + 1)
+                fp.flush()
+            starts, ends, out_labels = online_vbx.flush()
+            write_rttm(fp, file_name, starts, ends, out_labels.astype(int) + 1)
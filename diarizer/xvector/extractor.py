@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# @Authors: Lukas Burget, Federico Landini, Jan Profant
+# @Emails: burget@fit.vutbr.cz, landini@fit.vutbr.cz, jan.profant@phonexia.com
+#
+# X-vector extraction from the speech segments of a recording (the processing done by
+# predict.py for each file), so that it can also be used in memory (see pipeline.py).
+
+import logging
+import os
+
+import numpy as np
+
+from diarizer.xvector import features
+
+logger = logging.getLogger(__name__)
+
+
+def get_embedding(fea, model, label_name=None, input_name=None, backend="pytorch", device=None):
+    if backend == "pytorch":
+        import torch
+
+        data = torch.from_numpy(fea).to(device)
+        data = data[None, :, :]
+        data = torch.transpose(data, 1, 2)
+        spk_embeds = model(data)
+        return spk_embeds.data.cpu().numpy()[0]
+    elif backend == "onnx":
+        return model.run(
+            [label_name],
+            {input_name: fea.astype(np.float32).transpose()[np.newaxis, :, :]},
+        )[0].squeeze()
+
+
+class XVectorExtractor:
+    """Extracts x-vectors on sliding windows of the fbank features of speech segments.
+    Input (of __call__):
+        fn         - recording name (used in the x-vector keys)
+        signal     - vector of samples
+        samplerate - 8000 or 16000
+        labs       - N x 2 array with start and end times (in seconds) of the speech
+                     segments
+    Outputs:
+        keys     - list of x-vector keys (<fn>_<segment>-<start frame>-<end frame>)
+        xvectors - list of x-vectors
+        starts   - list of x-vector start times (in seconds)
+        ends     - list of x-vector end times (in seconds)
+    """
+
+    def __init__(
+        self,
+        weights=None,
+        model=None,
+        model_file=None,
+        backend="pytorch",
+        ndim=64,
+        embed_dim=256,
+        seg_len=144,
+        seg_jump=24,
+        device="cpu",
+    ):
+        self.backend = backend
+        self.seg_len = seg_len
+        self.seg_jump = seg_jump
+        self.label_name, self.input_name = None, None
+        if backend == "pytorch":
+            import torch
+
+            from diarizer.models import resnet
+
+            self.device = torch.device(device=device)
+            if model_file is not None:
+                self.model = torch.load(model_file).to(self.device)
+            elif model is not None and weights is not None:
+                self.model = getattr(resnet, model)(feat_dim=ndim, embed_dim=embed_dim)
+                self.model = self.model.to(self.device)
+                checkpoint = torch.load(weights, map_location=self.device)
+                self.model.load_state_dict(checkpoint["state_dict"], strict=False)
+                self.model.eval()
+            else:
+                raise ValueError(
+                    "Wrong combination of --model/--weights/--model_file "
+                    "parameters provided (or not provided at all)"
+                )
+        elif backend == "onnx":
+            import onnxruntime
+
+            self.device = None
+            self.model = onnxruntime.InferenceSession(weights)
+            self.input_name = self.model.get_inputs()[0].name
+            self.label_name = self.model.get_outputs()[0].name
+        else:
+            raise ValueError(f"Unknown backend {backend}")
+
+    def fbank_params(self, samplerate):
+        """Returns noverlap, winlen, window and fbank_mx for the sampling rate."""
+        if samplerate == 8000:
+            noverlap, winlen, hifreq = 120, 200, 3700
+        elif samplerate == 16000:
+            noverlap, winlen, hifreq = 240, 400, 7600
+        else:
+            raise ValueError(
+                f"Only 8kHz and 16kHz are supported. Got {samplerate} instead."
+            )
+        window = features.povey_window(winlen)
+        fbank_mx = features.mel_fbank_mx(
+            winlen, samplerate, NUMCHANS=64, LOFREQ=20.0, HIFREQ=hifreq, htk_bug=False
+        )
+        return noverlap, winlen, window, fbank_mx
+
+    def embed(self, data):
+        if self.backend == "pytorch":
+            import torch
+
+            with torch.no_grad():
+                return get_embedding(data, self.model, backend="pytorch", device=self.device)
+        return get_embedding(
+            data,
+            self.model,
+            label_name=self.label_name,
+            input_name=self.input_name,
+            backend=self.backend,
+        )
+
+    def __call__(self, fn, signal, samplerate, labs):
+        seg_len, seg_jump = self.seg_len, self.seg_jump
+        labs = (np.asarray(labs, dtype=float).reshape(-1, 2) * samplerate).astype(int)
+        noverlap, winlen, window, fbank_mx = self.fbank_params(samplerate)
+
+        LC = 150
+        RC = 149
+
+        np.random.seed(3)  # for reproducibility
+        signal = features.add_dither((signal * 2 ** 15).astype(int))
+
+        keys, xvectors, starts, ends = [], [], [], []
+
+        def add(key, xvector, seg_start, seg_end):
+            if np.isnan(xvector).any():
+                logger.warning(f"NaN found, not processing: {key}{os.linesep}")
+            else:
+                keys.append(key)
+                xvectors.append(xvector)
+                starts.append(seg_start)
+                ends.append(seg_end)
+
+        for segnum in range(len(labs)):
+            seg = signal[labs[segnum, 0] : labs[segnum, 1]]
+            if seg.shape[0] > 0.01 * samplerate:  # process segment only if longer than 0.01s
+                # Mirror noverlap//2 initial and final samples
+                seg = np.r_[
+                    seg[noverlap // 2 - 1 :: -1],
+                    seg,
+                    seg[-1 : -winlen // 2 - 1 : -1],
+                ]
+                fea = features.fbank_htk(
+                    seg, window, noverlap, fbank_mx, USEPOWER=True, ZMEANSOURCE=True
+                )
+                fea = features.cmvn_floating_kaldi(fea, LC, RC, norm_vars=False).astype(
+                    np.float32
+                )
+
+                slen = len(fea)
+                start = -seg_jump
+                seg_offset = labs[segnum, 0] / float(samplerate)
+
+                for start in range(0, slen - seg_len, seg_jump):
+                    add(
+                        f"{fn}_{segnum:04}-{start:08}-{(start + seg_len):08}",
+                        self.embed(fea[start : start + seg_len]),
+                        round(seg_offset + start / 100.0, 3),
+                        round(seg_offset + start / 100.0 + seg_len / 100.0, 3),
+                    )
+
+                if slen - start - seg_jump >= 10:
+                    add(
+                        f"{fn}_{segnum:04}-{(start + seg_jump):08}-{slen:08}",
+                        self.embed(fea[start + seg_jump : slen]),
+                        round(seg_offset + (start + seg_jump) / 100.0, 3),
+                        round(labs[segnum, 1] / float(samplerate), 3),
+                    )
+        return keys, xvectors, starts, ends
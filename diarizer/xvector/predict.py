@@ -11,12 +11,11 @@ import time
 
 import kaldi_io
 import numpy as np
-import onnxruntime
 import soundfile as sf
 import torch.backends
 
-import features
-from diarizer.models.resnet import *
+from diarizer.io_utils import read_lab
+from diarizer.xvector.extractor import XVectorExtractor
 
 torch.backends.cudnn.enabled = False
 
@@ -69,20 +68,6 @@ def write_txt_vectors(path, data_dict):
             )
 
 
-def get_embedding(fea, model, label_name=None, input_name=None, backend="pytorch"):
-    if backend == "pytorch":
-        data = torch.from_numpy(fea).to(device)
-        data = data[None, :, :]
-        data = torch.transpose(data, 1, 2)
-        spk_embeds = model(data)
-        return spk_embeds.data.cpu().numpy()[0]
-    elif backend == "onnx":
-        return model.run(
-            [label_name],
-            {input_name: fea.astype(np.float32).transpose()[np.newaxis, :, :]},
-        )[0].squeeze()
-
-
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -153,185 +138,42 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
-    seg_len = args.seg_len
-    seg_jump = args.seg_jump
-
-    device = ""
+    device = "cpu"
     if args.gpus == True:
         logger.info(f"Using GPU for x-vector extraction")
 
         # gpu configuration
         # initialize_gpus(args) # already done in queue-freegpu.pl
-        device = torch.device(device="cuda")
-        _ = torch.ones(1).to(device)  # GPU reserve variable
-    else:
-        device = torch.device(device="cpu")
-
-    model, label_name, input_name = "", None, None
-
-    if args.backend == "pytorch":
-        if args.model_file is not None:
-            model = torch.load(args.model_file)
-            model = model.to(device)
-        elif args.model is not None and args.weights is not None:
-            model = eval(args.model)(feat_dim=args.ndim, embed_dim=args.embed_dim)
-            model = model.to(device)
-            checkpoint = torch.load(args.weights, map_location=device)
-            model.load_state_dict(checkpoint["state_dict"], strict=False)
-            model.eval()
-    elif args.backend == "onnx":
-        model = onnxruntime.InferenceSession(args.weights)
-        input_name = model.get_inputs()[0].name
-        label_name = model.get_outputs()[0].name
-
-    else:
-        raise ValueError(
-            "Wrong combination of --model/--weights/--model_file "
-            "parameters provided (or not provided at all)"
-        )
+        device = "cuda"
+        _ = torch.ones(1).to(torch.device(device=device))  # GPU reserve variable
+
+    extractor = XVectorExtractor(
+        weights=args.weights,
+        model=args.model,
+        model_file=args.model_file,
+        backend=args.backend,
+        ndim=args.ndim,
+        embed_dim=args.embed_dim,
+        seg_len=args.seg_len,
+        seg_jump=args.seg_jump,
+        device=device,
+    )
 
     file_names = np.atleast_1d(np.loadtxt(args.in_file_list, dtype=object))
 
-    with torch.no_grad():
-        with open(args.out_seg_fn, "w") as seg_file:
-            with open(args.out_ark_fn, "wb") as ark_file:
-                for fn in file_names:
-                    with Timer(f"Processing file {fn}"):
-                        signal, samplerate = sf.read(
-                            f"{os.path.join(args.in_wav_dir, fn)}.wav"
-                        )
-                        labs = np.atleast_2d(
-                            (
-                                np.loadtxt(
-                                    f"{os.path.join(args.in_lab_dir, fn)}.lab",
-                                    usecols=(0, 1),
-                                )
-                                * samplerate
-                            ).astype(int)
-                        )
-                        if samplerate == 8000:
-                            noverlap = 120
-                            winlen = 200
-                            window = features.povey_window(winlen)
-                            fbank_mx = features.mel_fbank_mx(
-                                winlen,
-                                samplerate,
-                                NUMCHANS=64,
-                                LOFREQ=20.0,
-                                HIFREQ=3700,
-                                htk_bug=False,
-                            )
-                        elif samplerate == 16000:
-                            noverlap = 240
-                            winlen = 400
-                            window = features.povey_window(winlen)
-                            fbank_mx = features.mel_fbank_mx(
-                                winlen,
-                                samplerate,
-                                NUMCHANS=64,
-                                LOFREQ=20.0,
-                                HIFREQ=7600,
-                                htk_bug=False,
-                            )
-                        else:
-                            raise ValueError(
-                                f"Only 8kHz and 16kHz are supported. Got {samplerate} instead."
-                            )
-
-                        LC = 150
-                        RC = 149
-
-                        np.random.seed(3)  # for reproducibility
-                        signal = features.add_dither((signal * 2 ** 15).astype(int))
-
-                        for segnum in range(len(labs)):
-                            seg = signal[labs[segnum, 0] : labs[segnum, 1]]
-                            if (
-                                seg.shape[0] > 0.01 * samplerate
-                            ):  # process segment only if longer than 0.01s
-                                # Mirror noverlap//2 initial and final samples
-                                seg = np.r_[
-                                    seg[noverlap // 2 - 1 :: -1],
-                                    seg,
-                                    seg[-1 : -winlen // 2 - 1 : -1],
-                                ]
-                                fea = features.fbank_htk(
-                                    seg,
-                                    window,
-                                    noverlap,
-                                    fbank_mx,
-                                    USEPOWER=True,
-                                    ZMEANSOURCE=True,
-                                )
-                                fea = features.cmvn_floating_kaldi(
-                                    fea, LC, RC, norm_vars=False
-                                ).astype(np.float32)
-
-                                slen = len(fea)
-                                start = -seg_jump
-
-                                for start in range(0, slen - seg_len, seg_jump):
-                                    data = fea[start : start + seg_len]
-                                    xvector = get_embedding(
-                                        data,
-                                        model,
-                                        label_name=label_name,
-                                        input_name=input_name,
-                                        backend=args.backend,
-                                    )
-
-                                    key = f"{fn}_{segnum:04}-{start:08}-{(start + seg_len):08}"
-                                    if np.isnan(xvector).any():
-                                        logger.warning(
-                                            f"NaN found, not processing: {key}{os.linesep}"
-                                        )
-                                    else:
-                                        seg_start = round(
-                                            labs[segnum, 0] / float(samplerate)
-                                            + start / 100.0,
-                                            3,
-                                        )
-                                        seg_end = round(
-                                            labs[segnum, 0] / float(samplerate)
-                                            + start / 100.0
-                                            + seg_len / 100.0,
-                                            3,
-                                        )
-                                        seg_file.write(
-                                            f"{key} {fn} {seg_start} {seg_end}{os.linesep}"
-                                        )
-                                        kaldi_io.write_vec_flt(
-                                            ark_file, xvector, key=key
-                                        )
-
-                                if slen - start - seg_jump >= 10:
-                                    data = fea[start + seg_jump : slen]
-                                    xvector = get_embedding(
-                                        data,
-                                        model,
-                                        label_name=label_name,
-                                        input_name=input_name,
-                                        backend=args.backend,
-                                    )
-
-                                    key = f"{fn}_{segnum:04}-{(start + seg_jump):08}-{slen:08}"
-
-                                    if np.isnan(xvector).any():
-                                        logger.warning(
-                                            f"NaN found, not processing: {key}{os.linesep}"
-                                        )
-                                    else:
-                                        seg_start = round(
-                                            labs[segnum, 0] / float(samplerate)
-                                            + (start + seg_jump) / 100.0,
-                                            3,
-                                        )
-                                        seg_end = round(
-                                            labs[segnum, 1] / float(samplerate), 3
-                                        )
-                                        seg_file.write(
-                                            f"{key} {fn} {seg_start} {seg_end}{os.linesep}"
-                                        )
-                                        kaldi_io.write_vec_flt(
-                                            ark_file, xvector, key=key
-                                        )
+    with open(args.out_seg_fn, "w") as seg_file:
+        with open(args.out_ark_fn, "wb") as ark_file:
+            for fn in file_names:
+                with Timer(f"Processing file {fn}"):
+                    signal, samplerate = sf.read(
+                        f"{os.path.join(args.in_wav_dir, fn)}.wav"
+                    )
+                    labs = read_lab(f"{os.path.join(args.in_lab_dir, fn)}.lab")
+                    keys, xvectors, starts, ends = extractor(
+                        fn, signal, samplerate, np.c_[labs["start"], labs["end"]]
+                    )
+                    for key, xvector, seg_start, seg_end in zip(
+                        keys, xvectors, starts, ends
+                    ):
+                        seg_file.write(f"{key} {fn} {seg_start} {seg_end}{os.linesep}")
+                        kaldi_io.write_vec_flt(ark_file, xvector, key=key)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Compare exact and two-stage AHC (diarization_lib.ahc_clustering vs
+# ahc_clustering_2stage) on synthetic sessions: runtime, peak memory and DER. Exact
+# AHC is only run on the sessions of up to --max-exact x-vectors, e.g.
+#   python local/benchmark_ahc.py --num-xvectors 2000 5000 30000 --max-exact 5000
+
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from diarizer.diarization_lib import ahc_clustering, ahc_clustering_2stage, l2_norm
+from diarizer.vbx.VB_diarization import DER
+
+
+def read_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark exact and two-stage AHC on synthetic x-vectors."
+    )
+    parser.add_argument(
+        "--num-xvectors",
+        type=int,
+        nargs="+",
+        default=[10000, 30000, 100000],
+        help="Session lengths (in x-vectors) to benchmark.",
+    )
+    parser.add_argument("--num-speakers", type=int, default=8)
+    parser.add_argument("--dim", type=int, default=128)
+    parser.add_argument(
+        "--turn-length", type=int, default=20, help="Mean speaker turn in x-vectors."
+    )
+    parser.add_argument("--threshold", type=float, default=-0.015)
+    parser.add_argument("--block-size", type=int, default=2000)
+    parser.add_argument("--nj", type=int, default=1)
+    parser.add_argument(
+        "--max-exact",
+        type=int,
+        default=0,
+        help="Also run exact AHC on sessions of up to this many x-vectors (it keeps "
+        "several NxN matrices in memory, so it is not run by default).",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def synthetic_session(num_xvectors, num_speakers, dim, turn_length, seed):
+    """Length-normalized x-vectors of speakers taking turns of random length."""
+    rng = np.random.RandomState(seed)
+    speakers = rng.randn(num_speakers, dim) * 2.0
+    turns = rng.geometric(1.0 / turn_length, size=num_xvectors)
+    turn_spk = rng.randint(num_speakers, size=num_xvectors)
+    ref = np.repeat(turn_spk, turns)[:num_xvectors]
+    x = speakers[ref] + rng.randn(num_xvectors, dim) * 3.0
+    return l2_norm(x), ref
+
+
+def run(fn, *args, **kwargs):
+    tracemalloc.start()
+    start = time.perf_counter()
+    labels, _ = fn(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return labels, elapsed, peak / 2 ** 20
+
+
+def hard_der(labels, ref):
+    gamma = np.zeros((len(labels), labels.max() + 1))
+    gamma[range(len(labels)), labels] = 1.0
+    return DER(gamma, ref)
+
+
+if __name__ == "__main__":
+    args = read_args()
+    print(
+        f"{'N':>7} {'method':>8} {'time[s]':>8} {'peak[MB]':>9} "
+        f"{'#spk':>5} {'DER[%]':>7}"
+    )
+    for num_xvectors in args.num_xvectors:
+        x, ref = synthetic_session(
+            num_xvectors, args.num_speakers, args.dim, args.turn_length, args.seed
+        )
+        methods = [
+            (
+                "2stage",
+                ahc_clustering_2stage,
+                dict(block_size=args.block_size, nj=args.nj, dtype=np.float32),
+            )
+        ]
+        if num_xvectors <= args.max_exact:
+            methods.insert(0, ("exact", ahc_clustering, dict(dtype=np.float32)))
+        for name, fn, kwargs in methods:
+            labels, elapsed, peak = run(fn, x, args.threshold, **kwargs)
+            print(
+                f"{num_xvectors:>7} {name:>8} {elapsed:>8.2f} {peak:>9.1f} "
+                f"{labels.max() + 1:>5} {100 * hard_der(labels, ref):>7.2f}"
+            )
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Time the conversion of labeled subsegments to RTTM segments
+# (diarizer.postprocessing) on synthetic sessions with single labels, overlap
+# (two-label) assignments and two channels.
+
+import argparse
+import io
+import time
+
+import numpy as np
+
+from diarizer.io_utils import write_rttm
+from diarizer.postprocessing import subsegments_to_segments
+
+
+def read_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark subsegment postprocessing on synthetic sessions."
+    )
+    parser.add_argument(
+        "--num-subsegments",
+        type=int,
+        nargs="+",
+        default=[10000, 100000],
+        help="Session lengths (in subsegments) to benchmark.",
+    )
+    parser.add_argument("--num-speakers", type=int, default=8)
+    parser.add_argument(
+        "--turn-length", type=int, default=10, help="Mean speaker turn in subsegments."
+    )
+    parser.add_argument(
+        "--overlap-prob",
+        type=float,
+        default=0.2,
+        help="Fraction of subsegments with a second speaker label.",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def synthetic_subsegments(num_subsegments, num_speakers, turn_length, rng):
+    """1.5s windows with 0.75s shift (and occasional gaps) labeled by speaker turns."""
+    gaps = np.cumsum(rng.rand(num_subsegments) < 0.05) * 3.0
+    starts = np.arange(num_subsegments) * 0.75 + gaps
+    turns = rng.geometric(1.0 / turn_length, size=num_subsegments)
+    labels = np.repeat(rng.randint(num_speakers, size=num_subsegments), turns)
+    return starts, starts + 1.5, labels[:num_subsegments]
+
+
+if __name__ == "__main__":
+    args = read_args()
+    rng = np.random.RandomState(args.seed)
+    print(f"{'N':>7} {'labels':>8} {'time[s]':>8} {'#segs':>7}")
+    for num_subsegments in args.num_subsegments:
+        starts, ends, labels = synthetic_subsegments(
+            num_subsegments, args.num_speakers, args.turn_length, rng
+        )
+        overlap_labels = np.empty(num_subsegments, dtype=object)
+        for i, label in enumerate(labels):
+            if rng.rand() < args.overlap_prob:
+                overlap_labels[i] = [label, (label + 1) % args.num_speakers]
+            else:
+                overlap_labels[i] = label
+        channels = np.arange(num_subsegments) >= num_subsegments // 2
+        half = num_subsegments // 2
+        cases = [
+            ("single", (starts, ends, labels)),
+            ("overlap", (starts, ends, overlap_labels)),
+            (
+                "2ch",
+                (
+                    np.r_[starts[:half], starts[: num_subsegments - half]],
+                    np.r_[ends[:half], ends[: num_subsegments - half]],
+                    labels,
+                    channels,
+                ),
+            ),
+        ]
+        for name, inputs in cases:
+            start = time.perf_counter()
+            seg_starts, seg_ends, seg_labels = subsegments_to_segments(*inputs)
+            write_rttm(io.StringIO(), "session", seg_starts, seg_ends, seg_labels)
+            elapsed = time.perf_counter() - start
+            print(f"{num_subsegments:>7} {name:>8} {elapsed:>8.3f} {len(seg_starts):>7}")
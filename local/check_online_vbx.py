@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Compare online VBx (vbx/online_vbx.py) with offline AHC+VB (vbx/vbhmm.py) on
+# synthetic sessions. With the default --lookback and --delay, which cover the whole
+# recording, the online labels must be the same as the offline ones (up to the speaker
+# names), and the script exits with an error otherwise. With smaller values, it reports
+# how much the online labels differ from the offline ones, e.g.
+#   python local/check_online_vbx.py --lookback 400 --delay 40
+
+import argparse
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+from diarizer.diarization_lib import ahc_clustering
+from diarizer.vbx.online_vbx import OnlineVBx
+from diarizer.vbx.vbhmm import vb_resegment
+
+
+def read_args():
+    parser = argparse.ArgumentParser(
+        description="Compare online and offline VBx on synthetic x-vectors."
+    )
+    parser.add_argument("--num-sessions", type=int, default=5)
+    parser.add_argument("--num-xvectors", type=int, default=600)
+    parser.add_argument("--num-speakers", type=int, default=4)
+    parser.add_argument("--dim", type=int, default=32)
+    parser.add_argument(
+        "--turn-length", type=int, default=15, help="Mean speaker turn in x-vectors."
+    )
+    parser.add_argument("--lda-dim", type=int, default=16)
+    parser.add_argument("--threshold", type=float, default=0.0)
+    parser.add_argument("--Fa", type=float, default=0.3)
+    parser.add_argument("--Fb", type=float, default=17)
+    parser.add_argument("--loopP", type=float, default=0.9)
+    parser.add_argument("--chunk-size", type=int, default=20)
+    parser.add_argument(
+        "--lookback",
+        type=int,
+        default=None,
+        help="Lookback of online VBx (by default, the whole recording).",
+    )
+    parser.add_argument(
+        "--delay",
+        type=int,
+        default=None,
+        help="Delay of online VBx (by default, the whole recording).",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def synthetic_session(num_xvectors, num_speakers, dim, turn_length, seed):
+    """X-vectors of speakers taking turns of random length, drawn from a PLDA model
+    with identity within-class covariance and across-class variances psi."""
+    rng = np.random.RandomState(seed)
+    psi = np.linspace(4.0, 0.5, dim)
+    speakers = rng.randn(num_speakers, dim) * np.sqrt(psi)
+    turns = rng.geometric(1.0 / turn_length, size=num_xvectors)
+    turn_spk = rng.randint(num_speakers, size=num_xvectors)
+    ref = np.repeat(turn_spk, turns)[:num_xvectors]
+    x = speakers[ref] + rng.randn(num_xvectors, dim)
+    return x, ref, psi
+
+
+def label_agreement(labels, ref):
+    """Fraction of x-vectors with the same label in both labelings, after mapping the
+    labels one-to-one."""
+    _, labels = np.unique(labels, return_inverse=True)
+    _, ref = np.unique(ref, return_inverse=True)
+    counts = np.zeros((labels.max() + 1, ref.max() + 1))
+    np.add.at(counts, (labels, ref), 1)
+    rows, cols = linear_sum_assignment(-counts)
+    return counts[rows, cols].sum() / len(ref)
+
+
+def online_labels(online_vbx, x, chunk_size):
+    """Runs online VBx and returns the label of each x-vector (x-vector i spans
+    [i, i + 1) seconds)."""
+    online_vbx.reset()
+    times = np.arange(len(x), dtype=float)
+    chunks = [slice(i, i + chunk_size) for i in range(0, len(x), chunk_size)]
+    outputs = [online_vbx.update(x[c], times[c], times[c] + 1) for c in chunks]
+    outputs.append(online_vbx.flush())
+    starts, _, labels = (np.concatenate(arrays) for arrays in zip(*outputs))
+    order = np.argsort(starts)
+    starts, labels = starts[order], labels[order]
+    return labels[np.searchsorted(starts, times + 0.5) - 1]
+
+
+if __name__ == "__main__":
+    args = read_args()
+    lookback = args.lookback or args.num_xvectors
+    delay = args.delay if args.delay is not None else lookback
+    exact = lookback >= args.num_xvectors and delay >= args.num_xvectors
+    print(f"{'session':>7} {'#spk':>5} {'#spk online':>11} {'agreement[%]':>12}")
+    mismatches = 0
+    for session in range(args.num_sessions):
+        x, ref, psi = synthetic_session(
+            args.num_xvectors,
+            args.num_speakers,
+            args.dim,
+            args.turn_length,
+            args.seed + session,
+        )
+        model = SimpleNamespace(
+            plda_mu=np.zeros(args.dim), plda_tr=np.eye(args.dim), plda_psi=psi
+        )
+        ahc_labels, _ = ahc_clustering(x, args.threshold)
+        q = vb_resegment(
+            x, model, ahc_labels, args.lda_dim, args.Fa, args.Fb, args.loopP
+        )
+        offline = q.argmax(axis=1)
+        online_vbx = OnlineVBx(
+            (model.plda_mu, model.plda_tr, model.plda_psi),
+            args.lda_dim,
+            args.threshold,
+            args.Fa,
+            args.Fb,
+            args.loopP,
+            lookback=lookback,
+            delay=delay,
+        )
+        online = online_labels(online_vbx, x, args.chunk_size)
+        agreement = label_agreement(online, offline)
+        mismatches += agreement < 1
+        print(
+            f"{session:>7} {len(np.unique(offline)):>5} {len(np.unique(online)):>11} "
+            f"{100 * agreement:>12.2f}"
+        )
+    if exact and mismatches > 0:
+        print(
+            f"Online and offline labels differ in {mismatches} of {args.num_sessions} "
+            "sessions, although the lookback and delay cover the whole recording",
+            file=sys.stderr,
+        )
+        sys.exit(1)
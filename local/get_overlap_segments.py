@@ -19,6 +19,9 @@ import sys
 import itertools
 from collections import defaultdict
 
+from diarizer.intervals import count_regions
+from diarizer.io_utils import read_rttm
+
 
 def get_args():
     parser = argparse.ArgumentParser(
@@ -63,30 +66,13 @@ def groupby(iterable, keyfunc):
 
 def find_overlapping_segments(segs, label):
     reco_id = segs[0].reco_id
-    tokens = []
-    for seg in segs:
-        tokens.append(("BEG", seg.start_time))
-        tokens.append(("END", seg.end_time))
-    sorted_tokens = sorted(tokens, key=lambda x: x[1])
-
-    overlap_segs = []
-    spkr_count = 0
-    ovl_begin = 0
-    ovl_end = 0
-    for token in sorted_tokens:
-        if token[0] == "BEG":
-            spkr_count += 1
-            if spkr_count == 2:
-                ovl_begin = token[1]
-        else:
-            spkr_count -= 1
-            if spkr_count == 1:
-                ovl_end = token[1]
-                overlap_segs.append(
-                    Segment(reco_id, ovl_begin, end_time=ovl_end, spk_id=label)
-                )
-
-    return overlap_segs
+    starts, ends = count_regions(
+        [seg.start_time for seg in segs], [seg.end_time for seg in segs], min_count=2
+    )
+    return [
+        Segment(reco_id, start, end_time=end, spk_id=label)
+        for start, end in zip(starts, ends)
+    ]
 
 
 def find_single_speaker_segments(segs):
@@ -129,12 +115,10 @@ def main():
     args = get_args()
 
     # First we read all segments and store as a list of objects
-    segments = []
-    for line in args.input_rttm:
-        parts = line.strip().split()
-        segments.append(
-            Segment(parts[1], float(parts[3]), dur=float(parts[4]), spk_id=parts[7])
-        )
+    segments = [
+        Segment(reco_id, start, end_time=end, spk_id=spk_id)
+        for reco_id, _, start, end, spk_id in read_rttm(args.input_rttm).tolist()
+    ]
 
     # We group the segment list into a dictionary indexed by reco_id
     reco2segs = defaultdict(
@@ -14,6 +14,13 @@ def read_args():
         description="Parallel coordinates plot for hparams."
     )
     parser.add_argument("exp_dir", type=str, help="Path to experiment directory.")
+    parser.add_argument(
+        "--log",
+        type=str,
+        default="hp_search.log",
+        help="Name of the log in the experiment directory: the VAD search log, or a "
+        "table written by diarizer/cluster_sweep.py (.tsv).",
+    )
     return parser.parse_args()
 
 
@@ -46,6 +53,12 @@ def read_log(log_file):
     return df
 
 
+def read_table(table_file):
+    # the error components are not plotted as dimensions
+    df = pd.read_csv(table_file, sep="\t")
+    return df.drop(columns=["miss", "fa", "conf", "jer"], errors="ignore")
+
+
 def plot_parallel_coords(df):
     fig = px.parallel_coordinates(
         df,
@@ -56,6 +69,9 @@ def plot_parallel_coords(df):
             "offset": "Offset threshold",
             "min_duration_on": "Min duration on",
             "min_duration_off": "Min duration off",
+            "init_smoothing": "Init smoothing",
+            "min_neighbors": "Min neighbors",
+            "max_neighbors": "Max neighbors",
         },
     )
     return fig
@@ -64,6 +80,7 @@ def plot_parallel_coords(df):
 if __name__ == "__main__":
     args = read_args()
     exp_dir = Path(args.exp_dir)
-    df = read_log(exp_dir / "hp_search.log")
+    log_file = exp_dir / args.log
+    df = read_table(log_file) if log_file.suffix == ".tsv" else read_log(log_file)
     fig = plot_parallel_coords(df)
     fig.write_html(exp_dir / "parallel_coordinates.html")
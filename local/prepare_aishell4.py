@@ -13,6 +13,8 @@ import logging
 
 from utils import rttm_to_vad_segments
 
+from diarizer.io_utils import write_lab
+
 import torch
 import torchaudio
 
@@ -110,9 +112,9 @@ def main(data_dir, output_dir):
             # Write VAD
             vad_segments = rttm_to_vad_segments(file)
             with open(vad_dir / f"{recording.id}.lab", "w") as f:
-                for segs in vad_segments:
-                    start, end = segs
-                    f.write(f"{start:.3f} {end:.3f} sp\n")
+                starts = [start for start, _ in vad_segments]
+                ends = [end for _, end in vad_segments]
+                write_lab(f, starts, ends)
 
 
 if __name__ == "__main__":
@@ -12,6 +12,8 @@ import logging
 
 from utils import supervision_to_vad_segments
 
+from diarizer.io_utils import write_lab
+
 import torch
 import torchaudio
 
@@ -94,9 +96,9 @@ def main(data_dir, output_dir):
             # Write VAD
             vad_segments = supervision_to_vad_segments(supervisions)
             with open(vad_dir / f"{recording_id}.lab", "w") as f:
-                for segs in vad_segments:
-                    start, end = segs
-                    f.write(f"{start:.3f} {end:.3f} sp\n")
+                starts = [start for start, _ in vad_segments]
+                ends = [end for _, end in vad_segments]
+                write_lab(f, starts, ends)
 
 
 if __name__ == "__main__":
@@ -1,5 +1,6 @@
 #!/usr/bin/env bash
 stage=0
+cache_dir=exp/cache  # outputs of unchanged jobs are reused ("" to disable)
 
 # Overlap detector Hyperparameters (tuned on dev)
 onset=0.2
@@ -45,6 +46,9 @@ if [ $stage -le 1 ]; then
       echo ${filename} > exp/list_${filename}.txt
       
       $train_cmd $EXP_DIR/${part}/log/ovl/ovl_${filename}.log \
+        ${cache_dir:+python diarizer/stage_cache.py --cache-dir $cache_dir --deps diarizer \
+          --inputs $DATA_DIR/${part}/audios/${audio} \
+          --outputs $EXP_DIR/${part}/ovl/${filename}.rttm --} \
         python diarizer/overlap/pyannote_overlap.py \
           --model diarizer/models/pyannote/aishell_epoch0_step2150.ckpt \
           --in-dir $DATA_DIR/${part}/audios \
@@ -1,5 +1,6 @@
 #!/usr/bin/env bash
 stage=0
+cache_dir=exp/cache  # outputs of unchanged jobs are reused ("" to disable)
 
 # VAD Hyperparameters (tuned on eval)
 onset=0.6
@@ -45,6 +46,9 @@ if [ $stage -le 1 ]; then
       echo ${filename} > exp/list_${filename}.txt
       
       $train_cmd $EXP_DIR/${part}/log/vad/vad_${filename}.log \
+        ${cache_dir:+python diarizer/stage_cache.py --cache-dir $cache_dir --deps diarizer \
+          --inputs $DATA_DIR/$part/audios/${audio} \
+          --outputs $EXP_DIR/$part/vad/${filename}.lab --} \
         python diarizer/vad/pyannote_vad.py \
           --model diarizer/models/pyannote/alimeeting_epoch0_step2492.ckpt \
           --in-dir $DATA_DIR/$part/audios \
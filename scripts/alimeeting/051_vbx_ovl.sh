@@ -1,5 +1,6 @@
 #!/usr/bin/env bash
 stage=0
+cache_dir=exp/cache  # outputs of unchanged jobs are reused ("" to disable)
 
 # Hyperparameters (same as AISHELL-4)
 Fa=0.5
@@ -24,6 +25,8 @@ if [ $stage -le 0 ]; then
       filename=$(echo "${audio}" | cut -f 1 -d '.')
       
       $train_cmd $EXP_DIR/$part/log/vbx_ovl/vb_${filename}.log \
+        ${cache_dir:+python diarizer/stage_cache.py --cache-dir $cache_dir --deps diarizer \
+          --outputs $EXP_DIR/$part/vbx_ovl/${filename}.rttm --} \
         python diarizer/vbx/vbhmm.py \
           --init AHC+VB \
           --out-rttm-dir $EXP_DIR/$part/vbx_ovl \
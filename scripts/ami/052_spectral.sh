@@ -1,5 +1,6 @@
 #!/usr/bin/env bash
 stage=0
+cache_dir=exp/cache  # outputs of unchanged jobs are reused ("" to disable)
 
 . ./cmd.sh
 . ./path.sh
@@ -19,6 +20,8 @@ if [ $stage -le 0 ]; then
       filename=$(echo "${audio}" | cut -f 1 -d '.')
       
       $train_cmd $EXP_DIR/$part/log/spectral/sc_${filename}.log \
+        ${cache_dir:+python diarizer/stage_cache.py --cache-dir $cache_dir --deps diarizer \
+          --outputs $EXP_DIR/$part/spectral/${filename}.rttm --} \
         python diarizer/spectral/sclust.py \
           --out-rttm-dir $EXP_DIR/$part/spectral \
           --xvec-ark-file $EXP_DIR/$part/xvec/${filename}.ark \
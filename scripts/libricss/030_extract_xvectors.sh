@@ -1,5 +1,6 @@
 #!/usr/bin/env bash
 stage=0
+cache_dir=exp/cache  # outputs of unchanged jobs are reused ("" to disable)
 
 . ./cmd.sh
 . ./path.sh
@@ -23,6 +24,9 @@ if [ $stage -le 0 ]; then
 
       # run feature and x-vectors extraction
       $cuda_cmd $EXP_DIR/${part}/log/xvec/xvec_${filename}.log \
+        ${cache_dir:+python diarizer/stage_cache.py --cache-dir $cache_dir --deps diarizer \
+          --inputs $DATA_DIR/${part}/audios/${audio} $EXP_DIR/${part}/vad/${filename}.lab \
+          --outputs $EXP_DIR/${part}/xvec/${filename}.ark $EXP_DIR/${part}/xvec/${filename}.seg --} \
         python diarizer/xvector/predict.py \
             --gpus true \
             --in-file-list exp/list_${filename}.txt \
@@ -1,5 +1,6 @@
 #!/usr/bin/env bash
 stage=0
+cache_dir=exp/cache  # outputs of unchanged jobs are reused ("" to disable)
 
 # VAD Hyperparameters (tuned on session0)
 onset=0.7
@@ -36,6 +37,9 @@ if [ $stage -le 0 ]; then
       
       utils/queue.pl -l "hostname=c*" --mem 2G \
         $EXP_DIR/${part}/log/vad${aligned_affix}/vad_${filename}.log \
+        ${cache_dir:+python diarizer/stage_cache.py --cache-dir $cache_dir --deps diarizer \
+          --inputs $DATA_DIR/${part}/audios/${audio} \
+          --outputs $EXP_DIR/${part}/vad${aligned_affix}/${filename}.lab --} \
         python diarizer/vad/pyannote_vad.py $aligned_opts \
           --in-dir $DATA_DIR/${part}/audios \
           --file-list exp/list_${filename}.txt \
@@ -1,5 +1,6 @@
 #!/usr/bin/env bash
 stage=0
+cache_dir=exp/cache  # outputs of unchanged jobs are reused ("" to disable)
 
 aligned=false
 
@@ -30,6 +31,9 @@ if [ $stage -le 0 ]; then
       # run feature and x-vectors extraction
       utils/queue-ackgpu.pl -l "hostname=c0*\&!c07*" --gpu 1 --mem 2G \
         $EXP_DIR/${part}/log/xvec${aligned_affix}/xvec_${filename}.log \
+        ${cache_dir:+python diarizer/stage_cache.py --cache-dir $cache_dir --deps diarizer \
+          --inputs $DATA_DIR/${part}/audios/${audio} $EXP_DIR/${part}/vad${aligned_affix}/${filename}.lab \
+          --outputs $EXP_DIR/${part}/xvec${aligned_affix}/${filename}.ark $EXP_DIR/${part}/xvec${aligned_affix}/${filename}.seg --} \
         python diarizer/xvector/predict.py \
             --gpus true \
             --in-file-list exp/list_${filename}.txt \
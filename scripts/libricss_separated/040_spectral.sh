@@ -1,5 +1,6 @@
 #!/usr/bin/env bash
 stage=0
+cache_dir=exp/cache  # outputs of unchanged jobs are reused ("" to disable)
 
 . ./path.sh
 . ./utils/parse_options.sh
@@ -24,6 +25,8 @@ if [ $stage -le 0 ]; then
       cat $EXP_DIR/$part/xvec/${filename}_{0,1}.seg | awk '{print $1, substr($2, 1, length($2)-2), $3, $4}' > $EXP_DIR/$part/xvec/$filename.seg
 
       utils/queue.pl --mem 2G -l hostname="!b03*" $EXP_DIR/${part}/log/spectral/spectral_${filename}.log \
+        ${cache_dir:+python diarizer/stage_cache.py --cache-dir $cache_dir --deps diarizer \
+          --outputs $EXP_DIR/${part}/spectral/${filename}.rttm --} \
         python diarizer/spectral/sclust2.py \
             --out-rttm-dir $EXP_DIR/${part}/spectral \
             --xvec-ark-file $EXP_DIR/${part}/xvec/${filename}.ark \